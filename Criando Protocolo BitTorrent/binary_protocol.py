@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""Protocolo binário compacto entre peers e tracker.
+
+Convive com o protocolo de texto: toda mensagem binária começa com o byte MAGIC,
+que nunca é o primeiro byte de um comando de texto (JOIN, UPDATE, PEERLIST...).
+
+Cabeçalho (3 bytes): MAGIC | VERSÃO | TIPO
+    JOIN      info_hash (20 bytes) | porta_tcp (uint16)
+              [| numwant (uint16) [| mtu (uint16, 0 = padrão) [| total de pedaços (uint32)]]]
+    UPDATE    info_hash (20 bytes) | porta_tcp (uint16) + bitfield (resto do datagrama)
+    PEERLIST  quantidade (uint16) + N entradas de:
+              ip (4 bytes) | porta_tcp (uint16) | deslocamento (uint16) | tamanho_bitfield (uint16) | bitfield
+              O bitfield de uma entrada começa no byte `deslocamento` do bitfield do peer;
+              um bitfield que não cabe numa página vai em várias entradas do mesmo peer,
+              que o peer junta de volta.
+    HAVE      info_hash (20 bytes) | porta_tcp (uint16) | sequência (uint32) | índices novos (uint32 cada)
+    RESYNC    (sem corpo) tracker pede ao peer um UPDATE completo
+    PEERPAGE  id_resposta (uint32) | índice (uint16) | total (uint16) + corpo de uma PEERLIST
+              (um fragmento de uma PEERLIST que não cabe em um datagrama do tamanho da MTU)
+    RESEND    id_resposta (uint32) | índices das páginas faltantes (uint16 cada)
+    SCRAPE    info_hash (20 bytes)
+    SCRAPEINFO seeders (uint32) | leechers (uint32) | concluídos (uint32) | N (uint32) |
+              codificação (uint8) + disponibilidade dos N pedaços (contagens saturadas em 65535):
+              0 = vetor: N contagens (uint16 cada)
+              1 = RLE: R (uint32) + R pares de tamanho da sequência (uint16) | contagem (uint16)
+              O tracker usa a codificação menor; enxames estáveis costumam ter longas
+              sequências de pedaços com a mesma disponibilidade.
+    INTERVAL  intervalo (uint32) | intervalo mínimo (uint32), em segundos: de quanto em
+              quanto tempo o peer deve anunciar e o menor intervalo entre anúncios/SCRAPEs
+
+O info_hash identifica o enxame (conteúdo) ao qual a mensagem se refere; um mesmo
+tracker hospeda vários enxames. As versões 1 (sem info_hash) e 2 (entradas da PEERLIST
+sem deslocamento) não são mais aceitas.
+
+Os inteiros são big-endian (ordem de rede). O bitfield segue o formato do BitTorrent:
+o bit mais significativo do primeiro byte é o pedaço 0. Bytes zerados no final são
+omitidos, então o bitfield de um peer sem pedaços tem tamanho 0.
+
+Internamente o tracker guarda os pedaços como máscara (int), com o bit i = pedaço i.
+As conversões entre máscara e bitfield usam bytes.translate e int.from_bytes/to_bytes,
+ou seja, são feitas em C, sem laço Python por pedaço.
+"""
+
+import itertools
+import socket
+import struct
+
+MAGIC = 0xB7
+VERSION = 3
+
+INFO_HASH_SIZE = 20
+
+MSG_JOIN = 1
+MSG_UPDATE = 2
+MSG_PEERLIST = 3
+MSG_HAVE = 4
+MSG_RESYNC = 5
+MSG_PEERPAGE = 6
+MSG_RESEND = 7
+MSG_SCRAPE = 8
+MSG_SCRAPEINFO = 9
+MSG_INTERVAL = 10
+
+HEADER = struct.Struct("!BBB")
+INFO_HASH = struct.Struct(f"!{INFO_HASH_SIZE}s")
+PORT = struct.Struct("!H")
+COUNT = struct.Struct("!H")
+HAVE = struct.Struct("!HI")         # porta + sequência
+INDEX = struct.Struct("!I")
+PAGE = struct.Struct("!IHH")        # id da resposta + índice da página + total de páginas
+RESPONSE_ID = struct.Struct("!I")
+PAGE_INDEX = struct.Struct("!H")
+TOTAL = struct.Struct("!I")
+AVAILABILITY = struct.Struct("!H")
+COUNT_RUNS = struct.Struct("!I")
+SCRAPE_INFO = struct.Struct("!IIIIB") # seeders + leechers + concluídos + quantidade de pedaços + codificação
+RUN = struct.Struct("!HH")          # tamanho da sequência + contagem
+INTERVAL = struct.Struct("!II")     # intervalo + intervalo mínimo
+MAX_AVAILABILITY = 0xFFFF
+MAX_RUN = 0xFFFF
+
+AVAILABILITY_VECTOR = 0
+AVAILABILITY_RLE = 1
+PEER_ENTRY = struct.Struct("!4sHHH") # ip + porta (6 bytes compactados) + deslocamento + tamanho do bitfield
+
+# Para cada valor de byte, as posições (0 = bit mais significativo) dos bits ligados.
+BYTE_BITS = [tuple(bit for bit in range(8) if value & (0x80 >> bit)) for value in range(256)]
+
+# Tabela de inversão da ordem dos bits de um byte (bitfield MSB-primeiro <-> máscara LSB-primeiro).
+REVERSE_BITS = bytes(int(f"{value:08b}"[::-1], 2) for value in range(256))
+
+class ProtocolError(ValueError):
+    """Mensagem binária malformada ou de versão não suportada."""
+
+def is_binary(data):
+    """Indica se o datagrama usa o protocolo binário."""
+    return len(data) > 0 and data[0] == MAGIC
+
+def pieces_to_bitfield(pieces, limit=None):
+    """Converte um conjunto de índices de pedaços em bitfield (bytes).
+    Com `limit`, um índice >= `limit` levanta ValueError antes de alocar o bitfield.
+    """
+    if not pieces:
+        return b""
+    if min(pieces) < 0:
+        raise ValueError("Índice de pedaço negativo")
+    if limit is not None and max(pieces) >= limit:
+        raise ValueError(f"Índice de pedaço fora do limite ({limit}): {max(pieces)}")
+    bitfield = bytearray((max(pieces) >> 3) + 1)
+    for index in pieces:
+        bitfield[index >> 3] |= 0x80 >> (index & 7)
+    return bytes(bitfield)
+
+def bitfield_to_pieces(bitfield):
+    """Converte um bitfield (bytes) de volta em conjunto de índices de pedaços."""
+    return {(byte_index << 3) + bit
+            for byte_index, byte in enumerate(bitfield) if byte
+            for bit in BYTE_BITS[byte]}
+
+def bitfield_to_mask(bitfield):
+    """Converte um bitfield (bytes) em máscara de pedaços (int)."""
+    return int.from_bytes(bitfield.translate(REVERSE_BITS), "little")
+
+def mask_to_bitfield(mask):
+    """Converte uma máscara de pedaços (int) em bitfield (bytes), sem bytes zerados no final."""
+    return mask.to_bytes((mask.bit_length() + 7) >> 3, "little").translate(REVERSE_BITS)
+
+def pieces_to_mask(pieces, limit=None):
+    """Converte um conjunto de índices de pedaços em máscara (int) (ver `pieces_to_bitfield`)."""
+    return bitfield_to_mask(pieces_to_bitfield(pieces, limit))
+
+def mask_to_pieces(mask):
+    """Lista ordenada dos índices de pedaços presentes na máscara."""
+    return [(byte_index << 3) + bit
+            for byte_index, byte in enumerate(mask_to_bitfield(mask)) if byte
+            for bit in BYTE_BITS[byte]]
+
+def split_info_hash(body):
+    """Separa o info_hash do início do corpo de uma mensagem: (info_hash, resto)."""
+    if len(body) < INFO_HASH.size:
+        raise ProtocolError("Mensagem sem info_hash")
+    return body[:INFO_HASH.size], body[INFO_HASH.size:]
+
+def encode_join(info_hash, tcp_port, numwant=None, mtu=None, total_pieces=None):
+    """JOIN; `mtu` (maior datagrama que o peer aceita receber) e `total_pieces`
+    (pedaços do arquivo, se o peer já sabe) exigem `numwant`.
+    """
+    message = HEADER.pack(MAGIC, VERSION, MSG_JOIN) + INFO_HASH.pack(info_hash) + PORT.pack(tcp_port)
+    if numwant is not None:
+        message += COUNT.pack(numwant)
+        if mtu is not None or total_pieces is not None:
+            message += COUNT.pack(mtu or 0)
+        if total_pieces is not None:
+            message += TOTAL.pack(total_pieces)
+    return message
+
+def decode_join(body):
+    """Decodifica o corpo de um JOIN em
+    (info_hash, porta_tcp, numwant ou None, mtu ou None, total de pedaços ou None).
+    """
+    info_hash, body = split_info_hash(body)
+    (tcp_port,) = PORT.unpack_from(body, 0)
+    numwant = mtu = total_pieces = None
+    offset = PORT.size
+    if len(body) >= offset + COUNT.size:
+        (numwant,) = COUNT.unpack_from(body, offset)
+        offset += COUNT.size
+    if len(body) >= offset + COUNT.size:
+        (mtu,) = COUNT.unpack_from(body, offset)
+        mtu = mtu or None
+        offset += COUNT.size
+    if len(body) >= offset + TOTAL.size:
+        (total_pieces,) = TOTAL.unpack_from(body, offset)
+    return info_hash, tcp_port, numwant, mtu, total_pieces
+
+def encode_update(info_hash, tcp_port, bitfield):
+    return HEADER.pack(MAGIC, VERSION, MSG_UPDATE) + INFO_HASH.pack(info_hash) + PORT.pack(tcp_port) + bitfield
+
+def decode_update(body):
+    """Decodifica o corpo de um UPDATE em (info_hash, porta_tcp, bitfield)."""
+    info_hash, body = split_info_hash(body)
+    (tcp_port,) = PORT.unpack_from(body, 0)
+    return info_hash, tcp_port, body[PORT.size:]
+
+def encode_have(info_hash, tcp_port, seq, indices):
+    """HAVE com os índices dos pedaços adquiridos desde a sequência anterior."""
+    indices = list(indices)
+    return (HEADER.pack(MAGIC, VERSION, MSG_HAVE) + INFO_HASH.pack(info_hash) + HAVE.pack(tcp_port, seq)
+            + struct.pack(f"!{len(indices)}I", *indices))
+
+def decode_have(body):
+    """Decodifica o corpo de um HAVE em (info_hash, porta_tcp, sequência, lista de índices)."""
+    info_hash, body = split_info_hash(body)
+    tcp_port, seq = HAVE.unpack_from(body, 0)
+    rest = body[HAVE.size:]
+    if len(rest) % INDEX.size:
+        raise ProtocolError("HAVE com lista de índices truncada")
+    return info_hash, tcp_port, seq, list(struct.unpack(f"!{len(rest) // INDEX.size}I", rest))
+
+def encode_resync():
+    return HEADER.pack(MAGIC, VERSION, MSG_RESYNC)
+
+def encode_peer_entry(ip, tcp_port, bitfield, offset=0):
+    """Codifica uma entrada de peer da PEERLIST (6 bytes de endereço + bitfield), com o
+    bitfield começando no byte `offset` do bitfield do peer.
+    """
+    return PEER_ENTRY.pack(socket.inet_aton(ip), tcp_port, offset, len(bitfield)) + bitfield
+
+def encode_peerlist(entries):
+    """Monta uma PEERLIST a partir de entradas já codificadas por `encode_peer_entry`."""
+    return HEADER.pack(MAGIC, VERSION, MSG_PEERLIST) + COUNT.pack(len(entries)) + b"".join(entries)
+
+def decode_peerlist(body):
+    """Decodifica o corpo de uma PEERLIST em uma lista de (ip, porta_tcp, bitfield).
+    O bitfield devolvido já começa no pedaço 0 (o deslocamento vira bytes zerados).
+    """
+    (count,) = COUNT.unpack_from(body, 0)
+    offset = COUNT.size
+    peers = []
+    for _ in range(count):
+        if offset + PEER_ENTRY.size > len(body):
+            raise ProtocolError("PEERLIST truncada")
+        packed_ip, tcp_port, bitfield_offset, bitfield_len = PEER_ENTRY.unpack_from(body, offset)
+        offset += PEER_ENTRY.size
+        bitfield = body[offset:offset + bitfield_len]
+        if len(bitfield) != bitfield_len:
+            raise ProtocolError("Bitfield truncado na PEERLIST")
+        offset += bitfield_len
+        if bitfield_offset and bitfield:
+            bitfield = bytes(bitfield_offset) + bitfield
+        peers.append((socket.inet_ntoa(packed_ip), tcp_port, bitfield))
+    return peers
+
+def encode_peerpage(response_id, index, total, entries):
+    """Monta uma página de uma PEERLIST fragmentada (entradas de `encode_peer_entry`)."""
+    return (HEADER.pack(MAGIC, VERSION, MSG_PEERPAGE) + PAGE.pack(response_id, index, total)
+            + COUNT.pack(len(entries)) + b"".join(entries))
+
+def decode_peerpage(body):
+    """Decodifica o corpo de uma PEERPAGE em (id_resposta, índice, total, entradas)."""
+    if len(body) < PAGE.size:
+        raise ProtocolError("PEERPAGE menor que o cabeçalho da página")
+    response_id, index, total = PAGE.unpack_from(body, 0)
+    if index >= total:
+        raise ProtocolError(f"Página {index} fora do total {total}")
+    return response_id, index, total, decode_peerlist(body[PAGE.size:])
+
+def encode_resend(response_id, indices):
+    """Pede ao tracker as páginas `indices` da resposta `response_id`."""
+    indices = list(indices)
+    return (HEADER.pack(MAGIC, VERSION, MSG_RESEND) + RESPONSE_ID.pack(response_id)
+            + struct.pack(f"!{len(indices)}H", *indices))
+
+def decode_resend(body):
+    """Decodifica o corpo de um RESEND em (id_resposta, lista de índices de páginas)."""
+    (response_id,) = RESPONSE_ID.unpack_from(body, 0)
+    rest = body[RESPONSE_ID.size:]
+    if len(rest) % PAGE_INDEX.size:
+        raise ProtocolError("RESEND com lista de páginas truncada")
+    return response_id, list(struct.unpack(f"!{len(rest) // PAGE_INDEX.size}H", rest))
+
+def encode_scrape(info_hash):
+    return HEADER.pack(MAGIC, VERSION, MSG_SCRAPE) + INFO_HASH.pack(info_hash)
+
+def decode_scrape(body):
+    """Decodifica o corpo de um SCRAPE no info_hash pedido."""
+    info_hash, _ = split_info_hash(body)
+    return info_hash
+
+def availability_runs(availability):
+    """Sequências (contagem, tamanho) de pedaços consecutivos com a mesma disponibilidade."""
+    return [(count, len(list(group))) for count, group in itertools.groupby(availability)]
+
+def encode_scrapeinfo(seeders, leechers, completed, availability):
+    """Resposta ao SCRAPE: contadores do enxame e a disponibilidade de cada pedaço,
+    como vetor de uint16 ou em RLE, o que for menor.
+    """
+    counts = [min(count, MAX_AVAILABILITY) for count in availability]
+    runs = []
+    for count, length in availability_runs(counts):
+        while length > MAX_RUN:
+            runs.append((MAX_RUN, count))
+            length -= MAX_RUN
+        runs.append((length, count))
+    header = HEADER.pack(MAGIC, VERSION, MSG_SCRAPEINFO)
+    if len(runs) * RUN.size + COUNT_RUNS.size < len(counts) * AVAILABILITY.size:
+        return (header + SCRAPE_INFO.pack(seeders, leechers, completed, len(counts), AVAILABILITY_RLE)
+                + COUNT_RUNS.pack(len(runs)) + b"".join(RUN.pack(*run) for run in runs))
+    return (header + SCRAPE_INFO.pack(seeders, leechers, completed, len(counts), AVAILABILITY_VECTOR)
+            + struct.pack(f"!{len(counts)}H", *counts))
+
+def decode_scrapeinfo(body):
+    """Decodifica o corpo de um SCRAPEINFO em (seeders, leechers, concluídos, disponibilidade)."""
+    seeders, leechers, completed, count, encoding = SCRAPE_INFO.unpack_from(body, 0)
+    rest = body[SCRAPE_INFO.size:]
+    if encoding == AVAILABILITY_VECTOR:
+        if len(rest) != count * AVAILABILITY.size:
+            raise ProtocolError("SCRAPEINFO com disponibilidade truncada")
+        availability = list(struct.unpack(f"!{count}H", rest))
+    elif encoding == AVAILABILITY_RLE:
+        (num_runs,) = COUNT_RUNS.unpack_from(rest, 0)
+        if len(rest) != COUNT_RUNS.size + num_runs * RUN.size:
+            raise ProtocolError("SCRAPEINFO com sequências truncadas")
+        availability = []
+        for length, value in RUN.iter_unpack(rest[COUNT_RUNS.size:]):
+            availability.extend([value] * length)
+        if len(availability) != count:
+            raise ProtocolError("SCRAPEINFO com sequências que não somam o total de pedaços")
+    else:
+        raise ProtocolError(f"Codificação de disponibilidade desconhecida: {encoding}")
+    return seeders, leechers, completed, availability
+
+def decode_header(data):
+    """Valida o cabeçalho e retorna (tipo, corpo) de uma mensagem binária."""
+    if len(data) < HEADER.size:
+        raise ProtocolError("Mensagem binária menor que o cabeçalho")
+    magic, version, msg_type = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ProtocolError("Byte mágico inválido")
+    if version != VERSION:
+        raise ProtocolError(f"Versão de protocolo não suportada: {version}")
+    return msg_type, data[HEADER.size:]
+
+def encode_interval(interval, min_interval):
+    """Intervalo de anúncio que o tracker pede ao peer (ver tracker_interval.py)."""
+    return HEADER.pack(MAGIC, VERSION, MSG_INTERVAL) + INTERVAL.pack(interval, min_interval)
+
+def decode_interval(body):
+    """Decodifica o corpo de um INTERVAL em (intervalo, intervalo mínimo)."""
+    return INTERVAL.unpack_from(body, 0)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Metainfo do conteúdo: tamanho, tamanho do pedaço e o SHA-1 de cada pedaço.
+
+Com `make`, o arquivo é dividido em pedaços e os hashes são calculados em paralelo
+(um pool de threads ou, com --processes, de processos), cada tarefa lendo e
+calculando um lote contíguo de pedaços. O hashlib solta o GIL enquanto calcula,
+então as threads já usam todos os núcleos; os processos evitam o GIL por completo.
+Seeders e leechers carregam o metainfo na inicialização (peer_v3.py --metainfo):
+o leecher não precisa pedir o SIZE a outro peer, cada pedaço recebido é conferido
+antes de ser gravado, e o content ID vira o info-hash do enxame no tracker.
+
+Formato do arquivo:
+
+    MAGIC (8 bytes) | tamanho do arquivo (uint64) | tamanho do pedaço (uint32) |
+    content ID (20 bytes) | SHA-1 de cada pedaço (20 bytes por pedaço, em ordem)
+
+O content ID é o SHA-1 do tamanho, do tamanho do pedaço e dos hashes dos pedaços:
+identifica o conteúdo, não o nome do arquivo, e confere a integridade do metainfo.
+Um arquivo de 1 GB em pedaços de 100 KB dá um metainfo de ~200 KB.
+
+Exemplos:
+    python metainfo.py make teste2.pdf --workers 8
+    python metainfo.py info teste2.pdf.meta
+"""
+
+import argparse
+import hashlib
+import math
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+
+MAGIC = b"P2PMETA1"
+HEADER = struct.Struct("!8sQI20s")
+HASH_SIZE = hashlib.sha1().digest_size
+
+DEFAULT_PIECE_SIZE = 100 * 1024  # O mesmo PIECE_SIZE do peer_v3.
+HASH_BATCH_BYTES = 8 * 2**20     # Bytes lidos e calculados por tarefa do pool.
+METAINFO_SUFFIX = ".meta"        # Sufixo padrão do metainfo gerado por `make`.
+
+class MetainfoError(ValueError):
+    """Arquivo que não é um metainfo deste formato, ou corrompido."""
+
+def content_id(size, piece_size, hashes):
+    return hashlib.sha1(struct.pack("!QI", size, piece_size) + b"".join(hashes)).digest()
+
+def _hash_range(path, piece_size, first, count):
+    """SHA-1 de até `count` pedaços a partir do pedaço `first` (uma tarefa do pool)."""
+    digests = []
+    with open(path, "rb", buffering=0) as f:
+        f.seek(first * piece_size)
+        for _ in range(count):
+            data = f.read(piece_size)
+            if not data:
+                break
+            digests.append(hashlib.sha1(data).digest())
+    return digests
+
+def hash_pieces(path, piece_size=DEFAULT_PIECE_SIZE, workers=None, processes=False):
+    """Retorna a lista com o SHA-1 de cada pedaço do arquivo, calculados em paralelo
+    por `workers` threads (ou processos, com `processes`); padrão: um por núcleo.
+    """
+    total = math.ceil(os.path.getsize(path) / piece_size)
+    per_task = max(1, HASH_BATCH_BYTES // piece_size)
+    firsts = range(0, total, per_task)
+    pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with pool_class(max_workers=workers or os.cpu_count() or 1) as pool:
+        batches = pool.map(_hash_range, repeat(path), repeat(piece_size), firsts, repeat(per_task))
+        return [digest for batch in batches for digest in batch]
+
+class Metainfo:
+    """Tamanho, tamanho do pedaço e hashes dos pedaços de um conteúdo."""
+
+    def __init__(self, size, piece_size, hashes):
+        if size <= 0 or piece_size <= 0 or len(hashes) != math.ceil(size / piece_size):
+            raise MetainfoError(f"{len(hashes)} hashes para {size} bytes em pedaços de {piece_size}")
+        self.size = size
+        self.piece_size = piece_size
+        self.hashes = hashes
+        self.content_id = content_id(size, piece_size, hashes)
+
+    @property
+    def total_pieces(self):
+        return len(self.hashes)
+
+    def verify(self, piece_index, data):
+        """Indica se `data` é o pedaço `piece_index` deste conteúdo."""
+        return hashlib.sha1(data).digest() == self.hashes[piece_index]
+
+    def to_bytes(self):
+        return HEADER.pack(MAGIC, self.size, self.piece_size, self.content_id) + b"".join(self.hashes)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < HEADER.size:
+            raise MetainfoError("Metainfo curto demais")
+        magic, size, piece_size, stored_id = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise MetainfoError(f"Não é um metainfo (início {magic!r})")
+        body = data[HEADER.size:]
+        if len(body) % HASH_SIZE:
+            raise MetainfoError("Lista de hashes truncada")
+        meta = cls(size, piece_size, [body[i:i + HASH_SIZE] for i in range(0, len(body), HASH_SIZE)])
+        if meta.content_id != stored_id:
+            raise MetainfoError("Content ID não confere com os hashes (metainfo corrompido)")
+        return meta
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+def make_metainfo(path, piece_size=DEFAULT_PIECE_SIZE, workers=None, processes=False):
+    """Gera o metainfo de um arquivo (ver `hash_pieces`)."""
+    return Metainfo(os.path.getsize(path), piece_size, hash_pieces(path, piece_size, workers, processes))
+
+def main():
+    parser = argparse.ArgumentParser(description="Metainfo (tamanho e hashes dos pedaços) de um arquivo compartilhado.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    make = subparsers.add_parser("make", help="Gera o metainfo de um arquivo.")
+    make.add_argument("file", help="Arquivo a compartilhar.")
+    make.add_argument("-o", "--output", help=f"Metainfo gerado (padrão: <arquivo>{METAINFO_SUFFIX}).")
+    make.add_argument("--piece-size", type=int, default=DEFAULT_PIECE_SIZE // 1024, help="Tamanho do pedaço em KiB.")
+    make.add_argument("--workers", type=int, help="Threads (ou processos) calculando os hashes (padrão: um por núcleo).")
+    make.add_argument("--processes", action="store_true", help="Usa um pool de processos em vez de threads.")
+
+    info = subparsers.add_parser("info", help="Mostra um metainfo.")
+    info.add_argument("metainfo", help="Arquivo de metainfo.")
+    args = parser.parse_args()
+
+    if args.command == "make":
+        if args.piece_size <= 0:
+            parser.error("--piece-size precisa ser positivo")
+        try:
+            size = os.path.getsize(args.file)
+        except OSError as e:
+            parser.error(str(e))
+        if size == 0:
+            parser.error(f"Arquivo vazio: {args.file}")
+        start = time.perf_counter()
+        meta = make_metainfo(args.file, args.piece_size * 1024, args.workers, args.processes)
+        elapsed = time.perf_counter() - start
+        output = args.output or args.file + METAINFO_SUFFIX
+        meta.save(output)
+        print(f"{output}: {meta.total_pieces} pedaços, {elapsed:.2f}s ({size / 2**20 / max(elapsed, 1e-9):.0f} MiB/s)")
+        print(f"Content ID: {meta.content_id.hex()}")
+    else:
+        try:
+            meta = Metainfo.load(args.metainfo)
+        except (OSError, MetainfoError) as e:
+            parser.error(str(e))
+        print(f"Tamanho: {meta.size} bytes | Pedaços: {meta.total_pieces} de {meta.piece_size // 1024} KiB")
+        print(f"Content ID: {meta.content_id.hex()}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+import socket
+import time
+import argparse
+import logging
+import os
+import tempfile
+import hashlib
+import math
+import multiprocessing
+
+import peer_v3
+import metainfo
+from tracker_bench import BENCH_HOST, free_udp_port
+
+def run_seeder(path, port, upload_rate=0):
+    """Processo seeder dos benchmarks de transferência: serve `path` com o servidor TCP do
+    peer_v3. Com `upload_rate` (bytes/s), cada pedaço ou bloco lido espera o tempo que levaria
+    para sair nessa banda, simulando um peer remoto com upload limitado.
+    """
+    logging.disable(logging.CRITICAL)
+    if upload_rate:
+        read_piece, read_block = peer_v3.read_piece, peer_v3.read_block
+
+        def throttled_read_piece(piece_index):
+            data = read_piece(piece_index)
+            time.sleep(len(data) / upload_rate)
+            return data
+
+        def throttled_read_block(piece_index, offset, length, f=None):
+            data = read_block(piece_index, offset, length, f)
+            time.sleep(len(data) / upload_rate)
+            return data
+
+        peer_v3.read_piece, peer_v3.read_block = throttled_read_piece, throttled_read_block
+    peer_v3.target_file_path = path
+    peer_v3.total_pieces = math.ceil(os.path.getsize(path) / peer_v3.PIECE_SIZE)
+    peer_v3.owned_pieces.update(range(peer_v3.total_pieces))
+    peer_v3.my_ip, peer_v3.my_tcp_port = BENCH_HOST, port
+    peer_v3.tcp_server_thread()
+
+def free_tcp_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind((BENCH_HOST, 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def download_per_connection(addr):
+    """O caminho antigo: uma conexão TCP por pedaço (`fetch_piece`)."""
+    for index in range(peer_v3.total_pieces):
+        peer_v3.write_piece(index, peer_v3.fetch_piece(index, addr))
+    return peer_v3.total_pieces
+
+def download_pipelined(addr, depth):
+    """Uma conexão persistente (`PeerConnection`) com até `depth` blocos em andamento."""
+    blocks = []
+    for index in range(peer_v3.total_pieces):
+        partial = peer_v3.PartialPiece(peer_v3.get_piece_size(index))
+        blocks += [(index, *partial.block_range(block)) for block in range(partial.blocks)]
+    conn = peer_v3.PeerConnection(addr)
+    next_block = 0
+    try:
+        with open(peer_v3.target_file_path, "r+b") as f:
+            while next_block < len(blocks) or conn.pending:
+                if len(conn.pending) <= depth // 2:
+                    batch = blocks[next_block:next_block + depth - len(conn.pending)]
+                    conn.request(batch)
+                    next_block += len(batch)
+                (index, offset, _), data = conn.receive()
+                f.seek(index * peer_v3.PIECE_SIZE + offset)
+                f.write(data)
+    finally:
+        conn.close()
+    return 1
+
+def run_transfer_benchmark(args):
+    """Download do arquivo inteiro de um seeder local: uma conexão TCP por pedaço (caminho
+    antigo) vs uma conexão persistente com vários pedidos de bloco em andamento.
+    """
+    logging.disable(logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "seed.bin")
+        with open(source, "wb") as f:
+            f.write(os.urandom(int(args.size_mb * 2**20)))
+        with open(source, "rb") as f:
+            expected = hashlib.sha1(f.read()).digest()
+        port = free_tcp_port()
+        seeder = multiprocessing.Process(target=run_seeder, args=(source, port), daemon=True)
+        seeder.start()
+        time.sleep(0.5) # Dá tempo para o servidor TCP escutar.
+
+        peer_v3.target_file_path = os.path.join(directory, "leech.bin")
+        peer_v3.total_pieces = math.ceil(os.path.getsize(source) / peer_v3.PIECE_SIZE)
+        peer_v3.initialize_output_file(os.path.getsize(source))
+        addr = (BENCH_HOST, port)
+        paths = [("uma conexão por pedaço", lambda: download_per_connection(addr))]
+        paths += [(f"persistente, {depth} em andamento", lambda depth=depth: download_pipelined(addr, depth))
+                  for depth in args.depths]
+        print(f"Arquivo: {args.size_mb:.0f} MiB, {peer_v3.total_pieces} pedaços de {peer_v3.PIECE_SIZE // 1024} KiB | "
+              f"Repetições: {args.repeats}")
+        print(f"{'caminho':<30}{'melhor (s)':>12}{'mediana (s)':>13}{'MiB/s':>8}{'conexões':>10}")
+        try:
+            baseline = None
+            for name, download in paths:
+                times = []
+                for _ in range(args.repeats):
+                    start = time.perf_counter()
+                    connections = download()
+                    times.append(time.perf_counter() - start)
+                    with open(peer_v3.target_file_path, "rb") as f:
+                        if hashlib.sha1(f.read()).digest() != expected:
+                            raise RuntimeError(f"Arquivo baixado difere do original ({name})")
+                times.sort()
+                median = times[len(times) // 2]
+                baseline = baseline or median
+                print(f"{name:<30}{times[0]:>12.3f}{median:>13.3f}{args.size_mb / median:>8.0f}{connections:>10}"
+                      f"   ({baseline / median:.1f}x)")
+        finally:
+            seeder.terminate()
+            seeder.join()
+
+def reset_leecher(path, size, ports):
+    """Prepara o peer_v3 deste processo para baixar de novo o arquivo inteiro em `path`
+    dos seeders locais nas `ports` (todos com todos os pedaços).
+    """
+    total_pieces = math.ceil(size / peer_v3.PIECE_SIZE)
+    peer_v3.owned_pieces.clear()
+    peer_v3.connection_pool.close_all()
+    peer_v3.tracker_availability = None
+    peer_v3.total_pieces = total_pieces
+    peer_v3.target_file_path = path
+    peer_v3.initialize_output_file(size)
+    peer_v3.known_peers = {f"{BENCH_HOST}:{port}": {"ip": BENCH_HOST, "tcp_port": port,
+                                                   "pieces": set(range(total_pieces))}
+                           for port in ports}
+
+def run_seeders_benchmark(args):
+    """Download paralelo (DownloadScheduler) do arquivo inteiro com 1, 2, 4... seeders locais,
+    cada um com upload limitado a --seeder-rate MiB/s. A vazão total deve crescer com o
+    número de seeders até o limite de --max-connections.
+    """
+    logging.disable(logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "seed.bin")
+        with open(source, "wb") as f:
+            f.write(os.urandom(int(args.size_mb * 2**20)))
+        with open(source, "rb") as f:
+            expected = hashlib.sha1(f.read()).digest()
+        size = os.path.getsize(source)
+        ports = [free_tcp_port() for _ in range(max(args.seeder_counts))]
+        seeders = [multiprocessing.Process(target=run_seeder, args=(source, port, args.seeder_rate * 2**20), daemon=True)
+                   for port in ports]
+        for seeder in seeders:
+            seeder.start()
+        time.sleep(0.5) # Dá tempo para os servidores TCP escutarem.
+
+        # Os HAVEs do leecher vão para uma porta UDP sem tracker.
+        udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        peer_v3.tracker_addr = (BENCH_HOST, free_udp_port())
+        total_pieces = math.ceil(size / peer_v3.PIECE_SIZE)
+        print(f"Arquivo: {args.size_mb:.0f} MiB, {total_pieces} pedaços | Upload de cada seeder: "
+              f"{args.seeder_rate:.0f} MiB/s | Conexões: {args.max_connections} | "
+              f"Pedidos em andamento por peer: {peer_v3.PIPELINE_DEPTH}")
+        print(f"{'seeders':>8}{'tempo (s)':>11}{'MiB/s':>8}{'ideal':>8}{'ganho':>8}")
+        try:
+            baseline = None
+            for count in args.seeder_counts:
+                reset_leecher(os.path.join(directory, f"leech{count}.binincompleto"), size, ports[:count])
+                start = time.perf_counter()
+                if not peer_v3.download_all(udp_sock, args.max_connections):
+                    raise RuntimeError("Download interrompido")
+                elapsed = time.perf_counter() - start
+                # Ao completar, o peer tira o "incompleto" do nome do arquivo.
+                with open(peer_v3.target_file_path, "rb") as f:
+                    if hashlib.sha1(f.read()).digest() != expected:
+                        raise RuntimeError(f"Arquivo baixado difere do original ({count} seeders)")
+                baseline = baseline or elapsed
+                ideal = args.seeder_rate * min(count, args.max_connections)
+                print(f"{count:>8}{elapsed:>11.2f}{args.size_mb / elapsed:>8.1f}{ideal:>8.1f}{baseline / elapsed:>7.1f}x")
+        finally:
+            peer_v3.connection_pool.close_all()
+            udp_sock.close()
+            for seeder in seeders:
+                seeder.terminate()
+                seeder.join()
+
+def run_endgame_benchmark(args):
+    """Fim do download com seeders rápidos e lentos, sem endgame (1 peer por bloco) e com
+    2, 3... peers por bloco. A cauda é o tempo para baixar os últimos --tail-percent dos
+    pedaços: sem endgame, ela espera os blocos que ficaram com os seeders lentos.
+    """
+    logging.disable(logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "seed.bin")
+        with open(source, "wb") as f:
+            f.write(os.urandom(int(args.size_mb * 2**20)))
+        with open(source, "rb") as f:
+            expected = hashlib.sha1(f.read()).digest()
+        size = os.path.getsize(source)
+        rates = [args.seeder_rate] * args.seeders + [args.slow_rate] * args.slow_seeders
+        ports = [free_tcp_port() for _ in rates]
+        seeders = [multiprocessing.Process(target=run_seeder, args=(source, port, rate * 2**20), daemon=True)
+                   for port, rate in zip(ports, rates)]
+        for seeder in seeders:
+            seeder.start()
+        time.sleep(0.5) # Dá tempo para os servidores TCP escutarem.
+
+        # Guarda o momento em que cada pedaço é gravado.
+        stored_at = []
+        store_piece = peer_v3.store_piece
+
+        def timed_store_piece(piece_index, data, udp_sock):
+            stored = store_piece(piece_index, data, udp_sock)
+            stored_at.append(time.perf_counter())
+            return stored
+
+        peer_v3.store_piece = timed_store_piece
+        udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        peer_v3.tracker_addr = (BENCH_HOST, free_udp_port())
+        total_pieces = math.ceil(size / peer_v3.PIECE_SIZE)
+        tail_pieces = max(1, math.ceil(total_pieces * args.tail_percent / 100))
+        print(f"Arquivo: {args.size_mb:.0f} MiB, {total_pieces} pedaços | Seeders: {args.seeders} a "
+              f"{args.seeder_rate:g} MiB/s + {args.slow_seeders} a {args.slow_rate:g} MiB/s | "
+              f"Cauda: últimos {tail_pieces} pedaços | Repetições: {args.repeats}")
+        print(f"{'peers/bloco':>12}{'total (s)':>11}{'cauda (s)':>11}{'duplicados':>12}{'cancelados':>12}"
+              f"{'em dobro (KiB)':>16}")
+        try:
+            for requests in args.endgame_requests:
+                runs = []
+                for repeat in range(args.repeats):
+                    reset_leecher(os.path.join(directory, f"leech{requests}-{repeat}.binincompleto"),
+                                  size, ports)
+                    stored_at.clear()
+                    start = time.perf_counter()
+                    if not peer_v3.download_all(udp_sock, args.max_connections, endgame=requests):
+                        raise RuntimeError("Download interrompido")
+                    with open(peer_v3.target_file_path, "rb") as f:
+                        if hashlib.sha1(f.read()).digest() != expected:
+                            raise RuntimeError(f"Arquivo baixado difere do original ({requests} peers por bloco)")
+                    stored_at.sort()
+                    stats = peer_v3.download_scheduler.stats()
+                    runs.append((stored_at[-1] - start, stored_at[-1] - stored_at[-tail_pieces - 1]
+                                 if tail_pieces < len(stored_at) else stored_at[-1] - start,
+                                 stats["duplicate_requests"], stats["canceled_requests"], stats["wasted_bytes"]))
+                # Mediana pela cauda.
+                runs.sort(key=lambda run: run[1])
+                total, tail, duplicates, canceled, wasted = runs[len(runs) // 2]
+                print(f"{requests:>12}{total:>11.2f}{tail:>11.2f}{duplicates:>12}{canceled:>12}{wasted // 1024:>16}")
+        finally:
+            peer_v3.store_piece = store_piece
+            peer_v3.connection_pool.close_all()
+            udp_sock.close()
+            for seeder in seeders:
+                seeder.terminate()
+                seeder.join()
+
+def run_hashing_benchmark(args):
+    """Hashes dos pedaços para o metainfo (metainfo.make_metainfo): um worker vs pools de
+    threads e de processos. O arquivo fica no cache de páginas depois de criado, então a
+    medição é da CPU; com o arquivo fora do cache, o limite passa a ser o disco.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "seed.bin")
+        with open(source, "wb") as f:
+            for _ in range(int(args.size_mb)):
+                f.write(os.urandom(2**20))
+        expected = None
+        print(f"Arquivo: {args.size_mb:.0f} MiB, pedaços de {metainfo.DEFAULT_PIECE_SIZE // 1024} KiB | "
+              f"Núcleos: {os.cpu_count()} | Repetições: {args.repeats}")
+        print(f"{'pool':<10}{'workers':>8}{'mediana (s)':>13}{'MiB/s':>8}{'ganho':>8}")
+        baseline = None
+        for processes in (False, True):
+            for workers in args.workers:
+                times = []
+                for _ in range(args.repeats):
+                    start = time.perf_counter()
+                    meta = metainfo.make_metainfo(source, workers=workers, processes=processes)
+                    times.append(time.perf_counter() - start)
+                expected = expected or meta.content_id
+                if meta.content_id != expected:
+                    raise RuntimeError("Hashes diferentes entre as execuções")
+                times.sort()
+                median = times[len(times) // 2]
+                baseline = baseline or median
+                print(f"{'processos' if processes else 'threads':<10}{workers:>8}{median:>13.3f}"
+                      f"{args.size_mb / median:>8.0f}{baseline / median:>7.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks dos peers (transferência e metainfo).")
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+
+    transfer = subparsers.add_parser("transfer", help="Download entre peers: uma conexão por pedaço vs conexão persistente.")
+    transfer.add_argument("--size-mb", type=float, default=20, help="Tamanho do arquivo em MiB.")
+    transfer.add_argument("--depths", type=int, nargs="+", default=[1, 4, 16],
+                          help="Pedidos de bloco em andamento na conexão persistente.")
+    transfer.add_argument("--repeats", type=int, default=3, help="Downloads por caminho (vale a mediana).")
+    transfer.set_defaults(func=run_transfer_benchmark)
+
+    seeders = subparsers.add_parser("seeders", help="Download paralelo de vários seeders com upload limitado.")
+    seeders.add_argument("--size-mb", type=float, default=20, help="Tamanho do arquivo em MiB.")
+    seeders.add_argument("--seeder-counts", type=int, nargs="+", default=[1, 2, 4, 8])
+    seeders.add_argument("--seeder-rate", type=float, default=4, help="Upload de cada seeder em MiB/s.")
+    seeders.add_argument("--max-connections", type=int, default=8, help="Peers baixados em paralelo.")
+    seeders.set_defaults(func=run_seeders_benchmark)
+
+    endgame = subparsers.add_parser("endgame", help="Cauda do download com seeders lentos, com e sem endgame.")
+    endgame.add_argument("--size-mb", type=float, default=8, help="Tamanho do arquivo em MiB.")
+    endgame.add_argument("--seeders", type=int, default=3, help="Seeders rápidos.")
+    endgame.add_argument("--seeder-rate", type=float, default=4, help="Upload de cada seeder rápido em MiB/s.")
+    endgame.add_argument("--slow-seeders", type=int, default=2, help="Seeders lentos.")
+    endgame.add_argument("--slow-rate", type=float, default=0.1, help="Upload de cada seeder lento em MiB/s.")
+    endgame.add_argument("--max-connections", type=int, default=8, help="Peers baixados em paralelo.")
+    endgame.add_argument("--endgame-requests", type=int, nargs="+", default=[1, 2, 3],
+                         help="Peers por bloco no endgame (1 = sem endgame).")
+    endgame.add_argument("--tail-percent", type=float, default=5, help="Fração final dos pedaços medida como cauda.")
+    endgame.add_argument("--repeats", type=int, default=3, help="Downloads por configuração (vale a mediana).")
+    endgame.set_defaults(func=run_endgame_benchmark)
+
+    hashing = subparsers.add_parser("hashing", help="Hashes do metainfo com pools de threads e de processos.")
+    hashing.add_argument("--size-mb", type=float, default=256, help="Tamanho do arquivo em MiB.")
+    hashing.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    hashing.add_argument("--repeats", type=int, default=3, help="Execuções por configuração (vale a mediana).")
+    hashing.set_defaults(func=run_hashing_benchmark)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -9,13 +9,38 @@ import math
 import random
 import logging
 import select
+import hashlib
+import heapq
+import zlib
+from collections import deque
+
+import binary_protocol
+import metainfo
 
 # --- Configuração ---
 PIECE_SIZE = 100 * 1024  # Tamanho de cada pedaço em bytes (100 KB)
-UPDATE_INTERVAL = 30     # Segundos entre as atualizações do tracker
+UPDATE_INTERVAL = 30     # Segundos entre as atualizações do tracker até ele informar outro intervalo (INTERVAL)
 REQUEST_TIMEOUT = 60     # Segundos para esperar por uma resposta de pedaço
-MAX_CONNECTIONS = 5      # Máximo de downloads/uploads simultâneos
+MAX_CONNECTIONS = 5      # Máximo de downloads/uploads simultâneos (peers baixando em paralelo; ver --max-connections)
 LOG_LEVEL = logging.INFO # Nível de log para exibição de mensagens
+MAX_DATAGRAM_SIZE = 65535 # Maior datagrama UDP aceito do tracker
+NEGOTIATION_TIMEOUT = 2.0 # Segundos esperando resposta ao JOIN binário antes de voltar para o texto
+PAGE_TIMEOUT = 1.0       # Segundos sem novas páginas de uma PEERLIST paginada antes de pedir RESEND
+MAX_PAGE_RESENDS = 3     # Pedidos de RESEND por resposta antes de desistir dela
+AVAILABILITY_INTERVAL = 5.0 # Segundos entre os SCRAPEs que renovam a disponibilidade dos pedaços durante o download
+AVAILABILITY_AGE_FACTOR = 3 # Disponibilidade do tracker mais velha que este múltiplo do intervalo de SCRAPE é recalculada localmente
+TRACKER_FAILOVER_TIMEOUT = 10.0 # Segundos sem resposta do tracker a um pedido antes de passar para o próximo da lista
+TRACKER_PROBE_FACTOR = 3 # Sem ouvir o tracker por este múltiplo do intervalo de anúncio, o peer o sonda com um SCRAPE
+BLOCK_SIZE = 16 * 1024   # Tamanho de cada bloco pedido a um peer (um pedaço é baixado em blocos, de um ou mais peers)
+PIPELINE_DEPTH = 16      # Pedidos de bloco em andamento em cada conexão persistente com outro peer
+MAX_QUEUED_REQUESTS = 2 * PIPELINE_DEPTH # Pedidos na fila de quem atende uma conexão persistente; além disso para de ler
+KEEPALIVE_INTERVAL = 30  # Segundos sem tráfego numa conexão persistente ociosa antes de enviar um PING
+PEER_IDLE_TIMEOUT = 90   # Segundos sem pedidos até o lado que envia os pedaços fechar a conexão persistente
+CONNECTION_REUSE_LIMIT = 300 # Segundos sem downloads até fechar uma conexão ociosa guardada para reuso
+PEER_RETRY_DELAY = 5.0   # Segundos antes de voltar a baixar de um peer cuja conexão falhou
+RARITY_REFRESH = 1.0     # Segundos entre os recálculos da raridade usada para escolher os pedaços
+ENDGAME_MAX_REQUESTS = 2 # No endgame, peers aos quais um bloco que falta pode estar pedido ao mesmo tempo (1 desliga; ver --endgame-requests)
+ENDGAME_DUPLICATE_LIMIT = 64 # Pedidos duplicados em andamento no endgame, somando todos os peers (64 blocos = 1 MiB)
 # ---------------------
 
 # --- Configuração de Log ---
@@ -31,11 +56,28 @@ owned_pieces = set() # Conjunto de índices dos pedaços que este peer possui.
 total_pieces = 0     # Número total de pedaços do arquivo alvo.
 target_file_path = "" # Caminho para o arquivo que está sendo compartilhado ou baixado.
 output_file_path = "" # Caminho para o arquivo de saída (onde os pedaços baixados são salvos).
-piece_hashes = [] # Opcional: Para verificar a integridade dos pedaços (não implementado neste exemplo).
+piece_hashes = [] # SHA-1 de cada pedaço, do --metainfo (vazio: os pedaços recebidos não são conferidos).
 my_tcp_port = 0      # Porta TCP que este peer está escutando.
 my_ip = ""           # Endereço IP deste peer.
-tracker_addr = None  # Endereço (IP, Porta) do tracker.
+tracker_addr = None  # Endereço (IP, Porta) do tracker em uso.
+trackers = []        # Trackers do cluster (--tracker com vários endereços); `tracker_addr` é um deles.
+tracker_index = 0    # Posição de `tracker_addr` em `trackers`.
+tracker_pending = None # Momento (time.monotonic) do pedido mais antigo ainda sem resposta do tracker em uso.
+tracker_heard = 0.0  # Momento da última mensagem recebida do tracker em uso.
 peer_id = ""         # ID único deste peer (IP:Porta).
+tracker_protocol = "text" # Protocolo negociado com o tracker: "text" ou "binary".
+numwant = 50         # Máximo de peers pedidos ao tracker em cada JOIN.
+max_connections = MAX_CONNECTIONS # Peers dos quais se baixa ao mesmo tempo (--max-connections).
+endgame_requests = ENDGAME_MAX_REQUESTS # Peers por bloco no endgame (--endgame-requests).
+download_scheduler = None # Escalonador do download em andamento (estatísticas do endgame).
+tracker_mtu = None   # Maior datagrama de PEERLIST que aceitamos (None = padrão do tracker).
+have_seq = 0         # Sequência do último HAVE enviado ao tracker (reinicia em 0 a cada UPDATE completo).
+info_hash = bytes(binary_protocol.INFO_HASH_SIZE) # Identificador do enxame (conteúdo) no tracker.
+announce_interval = UPDATE_INTERVAL # Intervalo entre anúncios pedido pelo tracker (INTERVAL).
+min_announce_interval = 0   # Menor intervalo entre anúncios/SCRAPEs pedido pelo tracker.
+tracker_availability = None # Disponibilidade de cada pedaço no enxame inteiro, vinda do SCRAPE do tracker.
+availability_updated = 0.0  # Momento (time.monotonic) em que `tracker_availability` chegou.
+availability_requested = 0.0 # Momento do último SCRAPE enviado.
 shutdown_flag = threading.Event() # Flag para sinalizar o encerramento das threads.
 state_lock = threading.Lock() # Lock para proteger o acesso a `known_peers` e `owned_pieces` (recursos compartilhados).
 # --------------------
@@ -57,6 +99,19 @@ def get_my_ip():
         s.close()
     return ip
 
+def add_peer_entry(peers, ip, port, pieces):
+    """Adiciona uma entrada da PEERLIST ao dicionário de peers, ignorando a nossa.
+    O tracker divide a lista de pedaços de um peer grande demais para uma página em
+    várias entradas do mesmo peer, então entradas repetidas juntam os pedaços.
+    """
+    entry_peer_id = f"{ip}:{port}"
+    if entry_peer_id == peer_id:
+        return
+    if entry_peer_id in peers:
+        peers[entry_peer_id]["pieces"] |= pieces
+    else:
+        peers[entry_peer_id] = {"ip": ip, "tcp_port": port, "pieces": pieces}
+
 def parse_peer_list(peer_list_str):
     """Converte a lista de peers (string) que o tracker manda para um dicionário de peers.
     A string PEERLIST é formatada como: PEERLIST [ip1:porta1:[pedacos];ip2:porta2:[pedacos]]
@@ -72,7 +127,8 @@ def parse_peer_list(peer_list_str):
     for entry in peer_entries:
         try:
             # Divide cada entrada em IP, porta e lista de pedaços.
-            parts = entry.split(":")
+            # O tracker separa as entradas com " ; ", então remove os espaços das pontas.
+            parts = entry.strip().split(":")
             ip = parts[0]
             port = int(parts[1])
             # Remove os colchetes da string de pedaços e divide por vírgula.
@@ -82,14 +138,203 @@ def parse_peer_list(peer_list_str):
                 # Converte os pedaços para um conjunto de inteiros.
                 pieces = set(map(int, pieces_str.split(",")))
 
-            entry_peer_id = f"{ip}:{port}"
-            # Não adiciona a si mesmo à lista de peers conhecidos.
-            if entry_peer_id != peer_id:
-                peers[entry_peer_id] = {"ip": ip, "tcp_port": port, "pieces": pieces}
+            add_peer_entry(peers, ip, port, pieces)
         except (IndexError, ValueError) as e:
             logging.warning(f"Falha ao analisar a entrada do peer \t{entry}\t: {e}")
     return peers
 
+def parse_binary_peer_list(body):
+    """Equivalente binário de `parse_peer_list`: recebe o corpo de uma PEERLIST binária
+    (já sem o cabeçalho) e retorna o mesmo dicionário de peers.
+    """
+    peers = {}
+    try:
+        entries = binary_protocol.decode_peerlist(body)
+    except (binary_protocol.ProtocolError, IndexError) as e:
+        logging.warning(f"Falha ao analisar a PEERLIST binária: {e}")
+        return peers
+    for ip, port, bitfield in entries:
+        add_peer_entry(peers, ip, port, binary_protocol.bitfield_to_pieces(bitfield))
+    return peers
+
+class PeerlistAssembler:
+    """Junta as páginas (PEERPAGE) de PEERLISTs que não couberam em um datagrama.
+    Cada resposta do tracker tem um id; as páginas chegam em rajada e podem chegar fora
+    de ordem. Se uma resposta fica parada por PAGE_TIMEOUT com páginas faltando, pede
+    ao tracker só as páginas que faltam (RESEND).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {} # { id_resposta: {"total", "binary", "pages": {índice: peers}, "last", "resends"} }
+
+    def add(self, response_id, index, total, peers, binary):
+        """Guarda uma página; retorna o dicionário de peers completo quando a última chega."""
+        with self.lock:
+            entry = self.pending.setdefault(response_id, {"total": total, "binary": binary, "pages": {},
+                                                          "last": 0.0, "resends": 0})
+            entry["pages"][index] = peers
+            entry["last"] = time.time()
+            if len(entry["pages"]) < entry["total"]:
+                return None
+            del self.pending[response_id]
+        merged = {}
+        for page_peers in entry["pages"].values():
+            for info in page_peers.values():
+                add_peer_entry(merged, info["ip"], info["tcp_port"], info["pieces"])
+        return merged
+
+    def request_missing(self, udp_sock):
+        """Envia RESEND das respostas paradas há mais de PAGE_TIMEOUT.
+        Retorna True se ainda há alguma resposta incompleta aguardando páginas.
+        """
+        now = time.time()
+        requests = []
+        with self.lock:
+            for response_id, entry in list(self.pending.items()):
+                if now - entry["last"] < PAGE_TIMEOUT:
+                    continue
+                if entry["resends"] >= MAX_PAGE_RESENDS:
+                    logging.warning(f"Desistindo da PEERLIST paginada {response_id}: "
+                                    f"{entry['total'] - len(entry['pages'])} páginas perdidas")
+                    del self.pending[response_id]
+                    continue
+                entry["resends"] += 1
+                entry["last"] = now
+                missing = [index for index in range(entry["total"]) if index not in entry["pages"]]
+                requests.append((response_id, missing, entry["binary"]))
+            still_pending = bool(self.pending)
+        for response_id, missing, binary in requests:
+            logging.info(f"Pedindo ao tracker {len(missing)} páginas perdidas da resposta {response_id}")
+            if binary:
+                message = binary_protocol.encode_resend(response_id, missing)
+            else:
+                message = f"RESEND {response_id} {','.join(map(str, missing))}".encode("utf-8")
+            try:
+                udp_sock.sendto(message, tracker_addr)
+            except socket.error as e:
+                logging.error(f"Erro de socket ao enviar RESEND para o tracker: {e}")
+        return still_pending
+
+page_assembler = PeerlistAssembler()
+
+def content_info_hash(file_path):
+    """Info-hash padrão do conteúdo: SHA-1 do nome do arquivo (sem o sufixo 'incompleto'),
+    para que seeder e leechers do mesmo arquivo caiam no mesmo enxame sem configuração.
+    """
+    name = os.path.basename(file_path)
+    if name.endswith("incompleto"):
+        name = name[:-len("incompleto")]
+    return hashlib.sha1(name.encode("utf-8")).digest()
+
+def send_join(udp_sock, protocol):
+    """Envia um JOIN para o tracker no protocolo indicado, pedindo até `numwant` peers.
+    O tracker responde com uma PEERLIST. Um JOIN repetido serve como novo anúncio
+    para receber uma lista de peers atualizada.
+    """
+    # O total de pedaços (quando já conhecido) permite ao tracker contar os seeders.
+    total = total_pieces or None
+    expect_reply()
+    if protocol == "binary":
+        udp_sock.sendto(binary_protocol.encode_join(info_hash, my_tcp_port, numwant, tracker_mtu, total), tracker_addr)
+    else:
+        mtu_option = f" mtu={tracker_mtu}" if tracker_mtu else ""
+        total_option = f" total={total}" if total else ""
+        udp_sock.sendto(f"JOIN {my_ip} {my_tcp_port} numwant={numwant}{mtu_option}{total_option} swarm={info_hash.hex()}".encode("utf-8"), tracker_addr)
+
+def parse_peer_page(data):
+    """Se o datagrama é uma página de PEERLIST (texto ou binária), retorna
+    (id_resposta, índice, total, peers, binária); caso contrário, None.
+    """
+    if binary_protocol.is_binary(data):
+        msg_type, body = binary_protocol.decode_header(data)
+        if msg_type != binary_protocol.MSG_PEERPAGE:
+            return None
+        response_id, index, total, entries = binary_protocol.decode_peerpage(body)
+        peers = {}
+        for ip, port, bitfield in entries:
+            add_peer_entry(peers, ip, port, binary_protocol.bitfield_to_pieces(bitfield))
+        return response_id, index, total, peers, True
+
+    if not data.startswith(b"PEERPAGE "):
+        return None
+    # Formato: PEERPAGE <id_resposta> <índice> <total> [ip1:porta1:[pedacos] ; ...]
+    _, response_id, index, total, entries = data.decode("utf-8").split(" ", 4)
+    return int(response_id), int(index), int(total), parse_peer_list(entries), False
+
+def parse_tracker_peer_list(data):
+    """Analisa um datagrama do tracker e retorna o dicionário de peers se for uma PEERLIST
+    (texto ou binária), ou None para qualquer outra mensagem.
+    """
+    if binary_protocol.is_binary(data):
+        msg_type, body = binary_protocol.decode_header(data)
+        if msg_type == binary_protocol.MSG_PEERLIST:
+            return parse_binary_peer_list(body)
+        return None
+
+    response = data.decode("utf-8")
+    if response.startswith("PEERLIST"):
+        # Analisa a lista de peers recebida.
+        return parse_peer_list(response)
+    return None
+
+def join_tracker(udp_sock, protocol):
+    """Envia o JOIN para o tracker no protocolo indicado e retorna a lista de peers recebida.
+    Levanta socket.timeout se o tracker não responder.
+    """
+    send_join(udp_sock, protocol)
+    join_timeout = udp_sock.gettimeout()
+    try:
+        while True:
+            # Recebe a resposta do tracker: uma PEERLIST ou uma rajada de páginas.
+            try:
+                data, _ = udp_sock.recvfrom(MAX_DATAGRAM_SIZE)
+            except socket.timeout:
+                # Se já chegaram páginas, pede as que faltam em vez de desistir.
+                if page_assembler.request_missing(udp_sock):
+                    continue
+                raise
+            if apply_interval(data):
+                continue # O INTERVAL vem logo depois da PEERLIST; pode cruzar com páginas perdidas.
+            page = parse_peer_page(data)
+            if page is None:
+                break
+            # Depois da primeira página, uma pausa de PAGE_TIMEOUT já indica perda.
+            udp_sock.settimeout(PAGE_TIMEOUT)
+            peers = page_assembler.add(*page)
+            if peers is not None:
+                return peers
+    finally:
+        udp_sock.settimeout(join_timeout)
+    peers = parse_tracker_peer_list(data)
+    if peers is None:
+        logging.warning(f"Resposta inesperada do tracker após JOIN: {data[:40]!r}")
+        return {}
+    return peers
+
+def initial_join(udp_sock, protocol):
+    """JOIN inicial com o tracker em uso, negociando o protocolo (`protocol` é o --protocol).
+    Retorna a lista de peers; levanta socket.timeout se o tracker não responder.
+    """
+    global tracker_protocol
+    if protocol in ("auto", "binary"):
+        # Negociação: um tracker que entende o protocolo binário responde em binário.
+        # Um tracker antigo ignora a mensagem e, no modo auto, caímos para o texto.
+        udp_sock.settimeout(NEGOTIATION_TIMEOUT if protocol == "auto" else 5.0)
+        try:
+            peers = join_tracker(udp_sock, "binary")
+            tracker_protocol = "binary"
+            return peers
+        except socket.timeout:
+            if protocol == "binary":
+                raise
+            logging.info("Tracker não respondeu ao JOIN binário. Usando o protocolo de texto.")
+        finally:
+            udp_sock.settimeout(5.0)
+    peers = join_tracker(udp_sock, "text")
+    tracker_protocol = "text"
+    return peers
+
 def update_known_peers(new_peers):
     """Atualiza o dicionário `known_peers` com novas informações de peers.
     Utiliza um lock para garantir a segurança da thread ao acessar `known_peers`.
@@ -104,33 +349,268 @@ def update_known_peers(new_peers):
 
 def send_tracker_update(udp_sock):
     """Envia a lista atual de pedaços possuídos para o tracker.
-    A mensagem é formatada como: UPDATE <minha_porta_tcp> [<pedacos_possuidos>]
+    A mensagem é formatada como: UPDATE <minha_porta_tcp> [<pedacos_possuidos>] swarm=<info_hash>
+    É o estado completo; só é usado no início e quando o tracker pede RESYNC.
     """
-    print("Etrnou aqui - 1")
+    global have_seq
     with state_lock:
-        # Converte o conjunto de pedaços possuídos para uma string separada por vírgulas.
-        pieces_str = ",".join(map(str, sorted(list(owned_pieces))))
-    message = f"UPDATE {my_tcp_port} [{pieces_str}]"
+        # O UPDATE completo reinicia a sequência dos HAVEs.
+        have_seq = 0
+        if tracker_protocol == "binary":
+            # No protocolo binário os pedaços vão como bitfield (1 bit por pedaço).
+            message = binary_protocol.encode_update(info_hash, my_tcp_port, binary_protocol.pieces_to_bitfield(owned_pieces))
+        else:
+            # Converte o conjunto de pedaços possuídos para uma string separada por vírgulas.
+            pieces_str = ",".join(map(str, sorted(list(owned_pieces))))
+            message = f"UPDATE {my_tcp_port} [{pieces_str}] swarm={info_hash.hex()}".encode("utf-8")
     try:
-        # Envia a mensagem UDP para o tracker.
-        udp_sock.sendto(message.encode("utf-8"), tracker_addr)
+        # Envia a mensagem UDP para o tracker; a resposta é o INTERVAL.
+        expect_reply()
+        udp_sock.sendto(message, tracker_addr)
         logging.info(f"Enviado UPDATE para o tracker: {len(owned_pieces)} pedaços")
     except socket.error as e:
         logging.error(f"Erro de socket ao enviar UPDATE para o tracker: {e}")
     except Exception as e:
         logging.error(f"Erro ao enviar UPDATE para o tracker: {e}")
 
+def send_have(udp_sock, new_pieces=()):
+    """Envia ao tracker apenas os pedaços adquiridos desde o último HAVE.
+    A mensagem é formatada como: HAVE <minha_porta_tcp> <seq> [<pedacos_novos>] swarm=<info_hash>
+    Sem pedaços novos, repete a sequência atual e serve como sinal de vida; se o
+    tracker perceber um buraco na sequência, ele responde RESYNC.
+    """
+    global have_seq
+    new_pieces = sorted(new_pieces)
+    with state_lock:
+        if new_pieces:
+            have_seq += 1
+        if tracker_protocol == "binary":
+            message = binary_protocol.encode_have(info_hash, my_tcp_port, have_seq, new_pieces)
+        else:
+            message = f"HAVE {my_tcp_port} {have_seq} [{','.join(map(str, new_pieces))}] swarm={info_hash.hex()}".encode("utf-8")
+        try:
+            # Envia ainda sob o lock para que os HAVEs saiam na ordem da sequência.
+            udp_sock.sendto(message, tracker_addr)
+            logging.debug(f"Enviado HAVE {have_seq} para o tracker: {len(new_pieces)} pedaços novos")
+        except socket.error as e:
+            logging.error(f"Erro de socket ao enviar HAVE para o tracker: {e}")
+
 def tracker_update_thread(udp_sock):
     """Função da thread para enviar periodicamente atualizações para o tracker.
-    Esta thread executa em loop, enviando atualizações e esperando por um intervalo definido.
+    Envia o estado completo uma vez e, depois disso, apenas sinais de vida (HAVE sem
+    pedaços) a cada intervalo; os pedaços novos são anunciados por `send_have`.
+    Enquanto o download não termina, também repete o JOIN para renovar a lista de peers.
     """
     logging.info("Thread de atualização do tracker iniciada.")
-    while not shutdown_flag.is_set():
-        send_tracker_update(udp_sock)
-        # Espera pelo intervalo de atualização ou até que a flag de desligamento seja ativada.
-        shutdown_flag.wait(UPDATE_INTERVAL)
+    send_tracker_update(udp_sock)
+    # Espera pelo intervalo de anúncio (o tracker o ajusta conforme a carga) ou até que a
+    # flag de desligamento seja ativada.
+    while not shutdown_flag.wait(announce_interval):
+        send_have(udp_sock)
+        with state_lock:
+            downloading = len(owned_pieces) < total_pieces
+        if downloading:
+            # A PEERLIST vem limitada a numwant peers; enquanto baixa, o leecher
+            # anuncia de novo para conhecer outros peers (a resposta chega ao listener).
+            send_join(udp_sock, tracker_protocol)
+        elif len(trackers) > 1 and time.monotonic() - tracker_heard > TRACKER_PROBE_FACTOR * announce_interval:
+            # Os sinais de vida não têm resposta; com outros trackers para onde ir, o
+            # seeder sonda o atual de vez em quando para perceber se ele caiu.
+            send_scrape(udp_sock)
     logging.info("Thread de atualização do tracker parada.")
 
+def availability_period():
+    """Intervalo entre SCRAPEs: AVAILABILITY_INTERVAL, ou o intervalo mínimo do tracker se maior."""
+    return max(AVAILABILITY_INTERVAL, min_announce_interval)
+
+def parse_interval(data):
+    """Se o datagrama é um INTERVAL (texto ou binário), retorna (intervalo, mínimo); senão, None."""
+    if binary_protocol.is_binary(data):
+        msg_type, body = binary_protocol.decode_header(data)
+        if msg_type != binary_protocol.MSG_INTERVAL:
+            return None
+        return binary_protocol.decode_interval(body)
+    if not data.startswith(b"INTERVAL "):
+        return None
+    # Formato: INTERVAL <intervalo> <intervalo_mínimo>
+    _, interval, min_interval = data.decode("utf-8").split()
+    return int(interval), int(min_interval)
+
+def apply_interval(data):
+    """Adota o intervalo de anúncio se o datagrama for um INTERVAL; retorna se era."""
+    global announce_interval, min_announce_interval
+    intervals = parse_interval(data)
+    if intervals is None:
+        return False
+    interval, min_interval = intervals
+    if abs(interval - announce_interval) > announce_interval / 4:
+        logging.info(f"Tracker pediu anúncios a cada {interval}s (mínimo {min_interval}s)")
+    announce_interval = max(1, interval)
+    min_announce_interval = min_interval
+    return True
+
+def request_availability(udp_sock):
+    """Pede ao tracker (SCRAPE) a disponibilidade de cada pedaço no enxame, no máximo
+    uma vez por `availability_period()` e só enquanto o download não termina.
+    A resposta (SCRAPEINFO) chega ao listener e alimenta `calculate_rarity`.
+    """
+    global availability_requested
+    now = time.monotonic()
+    with state_lock:
+        if len(owned_pieces) >= total_pieces or now - availability_requested < availability_period():
+            return
+        availability_requested = now
+    send_scrape(udp_sock)
+
+def send_scrape(udp_sock):
+    """Envia um SCRAPE do enxame ao tracker (a resposta SCRAPEINFO chega ao listener)."""
+    if tracker_protocol == "binary":
+        message = binary_protocol.encode_scrape(info_hash)
+    else:
+        message = f"SCRAPE swarm={info_hash.hex()}".encode("utf-8")
+    try:
+        expect_reply()
+        udp_sock.sendto(message, tracker_addr)
+    except socket.error as e:
+        logging.error(f"Erro de socket ao enviar SCRAPE para o tracker: {e}")
+
+def parse_trackers(text):
+    """Converte 'host:porta[,host:porta...]' na lista de endereços (IP, porta) dos trackers."""
+    addresses = []
+    for item in text.split(","):
+        host, port = item.strip().rsplit(":", 1)
+        addresses.append((socket.gethostbyname(host), int(port)))
+    return addresses
+
+def preferred_tracker(count):
+    """Posição do tracker preferido deste peer numa lista de `count` trackers.
+    Vem do hash do peer_id: cada peer fica sempre no mesmo tracker (as sequências de
+    HAVE são acompanhadas por tracker) e os peers se espalham pelo cluster.
+    """
+    return zlib.crc32(peer_id.encode("utf-8")) % count
+
+def expect_reply():
+    """Marca que um pedido ao tracker em uso aguarda resposta (JOIN, UPDATE ou SCRAPE)."""
+    global tracker_pending
+    if tracker_pending is None:
+        tracker_pending = time.monotonic()
+
+def tracker_replied(addr):
+    """Registra uma mensagem recebida; só conta se veio do tracker em uso."""
+    global tracker_pending, tracker_heard
+    if addr == tracker_addr:
+        tracker_pending = None
+        tracker_heard = time.monotonic()
+
+def check_tracker(udp_sock):
+    """Passa para o próximo tracker da lista se o atual deixou um pedido sem resposta
+    por mais de TRACKER_FAILOVER_TIMEOUT segundos.
+    O próximo tracker recebe o estado completo (UPDATE, que também vale como JOIN
+    implícito e reinicia a sequência dos HAVEs) e, durante o download, um JOIN.
+    """
+    global tracker_addr, tracker_index, tracker_pending
+    pending = tracker_pending
+    if len(trackers) < 2 or pending is None or time.monotonic() - pending < TRACKER_FAILOVER_TIMEOUT:
+        return
+    old = tracker_addr
+    tracker_index = (tracker_index + 1) % len(trackers)
+    tracker_addr = trackers[tracker_index]
+    tracker_pending = None
+    logging.warning(f"Tracker {old[0]}:{old[1]} não responde. Passando para {tracker_addr[0]}:{tracker_addr[1]}.")
+    send_tracker_update(udp_sock)
+    with state_lock:
+        downloading = len(owned_pieces) < total_pieces
+    if downloading:
+        send_join(udp_sock, tracker_protocol)
+
+def parse_availability(text):
+    """Converte a disponibilidade em texto do SCRAPEINFO ("3,0*120,2") em uma lista."""
+    availability = []
+    text = text.strip("[]")
+    if not text:
+        return availability
+    for token in text.split(","):
+        count, _, length = token.partition("*")
+        availability.extend([int(count)] * (int(length) if length else 1))
+    return availability
+
+def parse_scrape_info(data):
+    """Se o datagrama é um SCRAPEINFO (texto ou binário), retorna a disponibilidade de
+    cada pedaço; caso contrário, None.
+    """
+    if binary_protocol.is_binary(data):
+        msg_type, body = binary_protocol.decode_header(data)
+        if msg_type != binary_protocol.MSG_SCRAPEINFO:
+            return None
+        return binary_protocol.decode_scrapeinfo(body)[3]
+    if not data.startswith(b"SCRAPEINFO "):
+        return None
+    # Formato: SCRAPEINFO seeders=S leechers=L completed=C pieces=N [disponibilidade]
+    return parse_availability(data.decode("utf-8").rsplit(" ", 1)[1])
+
+def handle_tracker_message(data, udp_sock):
+    """Trata uma mensagem recebida do tracker depois do JOIN inicial."""
+    global tracker_availability, availability_updated
+    if apply_interval(data):
+        return
+    availability = parse_scrape_info(data)
+    if availability is not None:
+        with state_lock:
+            tracker_availability = availability
+            availability_updated = time.monotonic()
+        logging.debug(f"Tracker enviou a disponibilidade de {len(availability)} pedaços")
+        return
+    page = parse_peer_page(data)
+    if page is not None:
+        new_peers = page_assembler.add(*page)
+        if new_peers is not None:
+            update_known_peers(new_peers)
+            logging.info(f"Tracker enviou PEERLIST paginada: {len(new_peers)} peers ({page[2]} páginas)")
+        return
+    new_peers = parse_tracker_peer_list(data)
+    if new_peers is not None:
+        update_known_peers(new_peers)
+        logging.info(f"Tracker enviou PEERLIST atualizada: {len(new_peers)} peers")
+        return
+    if binary_protocol.is_binary(data):
+        msg_type, _ = binary_protocol.decode_header(data)
+        resync = msg_type == binary_protocol.MSG_RESYNC
+    else:
+        resync = data.decode("utf-8").strip() == "RESYNC"
+    if resync:
+        logging.info("Tracker pediu RESYNC. Enviando estado completo.")
+        send_tracker_update(udp_sock)
+    else:
+        logging.debug(f"Mensagem do tracker ignorada: {data[:40]!r}")
+
+def tracker_listener_thread(udp_sock):
+    """Função da thread que recebe as mensagens do tracker (ex.: RESYNC)."""
+    logging.info("Thread de escuta do tracker iniciada.")
+    # Acorda pelo menos a cada PAGE_TIMEOUT para pedir páginas perdidas a tempo.
+    udp_sock.settimeout(PAGE_TIMEOUT)
+    while not shutdown_flag.is_set():
+        # Troca de tracker se o atual parou de responder.
+        check_tracker(udp_sock)
+        # Pede as páginas que faltam das PEERLISTs paginadas paradas.
+        page_assembler.request_missing(udp_sock)
+        # Renova a disponibilidade dos pedaços usada pelo escolhedor de pedaços.
+        request_availability(udp_sock)
+        try:
+            data, addr = udp_sock.recvfrom(MAX_DATAGRAM_SIZE)
+        except socket.timeout:
+            continue
+        except OSError as e:
+            if not shutdown_flag.is_set():
+                logging.error(f"Erro de socket ao receber do tracker: {e}")
+                shutdown_flag.wait(1.0)
+            continue
+        tracker_replied(addr)
+        try:
+            handle_tracker_message(data, udp_sock)
+        except Exception as e:
+            logging.error(f"Erro ao tratar mensagem do tracker: {e}", exc_info=True)
+    logging.info("Thread de escuta do tracker parada.")
+
 def handle_peer_connection(conn, addr):
     """Lida com uma conexão TCP de entrada de outro peer solicitando um pedaço.
     Recebe a solicitação, verifica se o pedaço é possuído e o envia de volta.
@@ -145,6 +625,11 @@ def handle_peer_connection(conn, addr):
             logging.warning(f"Nenhum dado recebido de {addr}")
             return
 
+        # Conexão persistente (ver PeerConnection); sem o PIPE, um único pedido como antes.
+        if data.startswith(PIPELINE_HELLO):
+            serve_pipelined(conn, addr, data[len(PIPELINE_HELLO):])
+            return
+
         message = data.decode("utf-8")
         logging.debug(f"Requisição recebida de {addr}: {message}")
         # Se a mensagem for "SIZE", envia o tamanho total do arquivo.
@@ -198,6 +683,105 @@ def handle_peer_connection(conn, addr):
         conn.close()
         logging.debug(f"Conexão de {addr} fechada")
 
+def serve_pipelined(conn, addr, buffered):
+    """Atende uma conexão persistente: lê os pedidos linha a linha e responde na ordem.
+    O outro peer mantém vários GETs em andamento, então o próximo pedido já está aqui
+    quando um bloco termina de sair. `buffered` é o que já chegou depois do PIPE.
+    Antes de cada resposta lê o que já chegou, para que um "CANCEL" (endgame)
+    alcance o GET correspondente ainda na fila: ele é respondido com "CANCELED" em vez
+    dos dados. Um CANCEL de um GET já respondido é ignorado. A fila guarda no máximo
+    MAX_QUEUED_REQUESTS pedidos; cheia, a conexão deixa de ser lida até ela andar.
+    A conexão é fechada depois de PEER_IDLE_TIMEOUT segundos sem pedidos.
+    """
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    conn.settimeout(PEER_IDLE_TIMEOUT)
+    source = None     # Arquivo aberto uma vez por conexão para ler os blocos pedidos.
+    queued = deque()  # Pedidos lidos e ainda não respondidos, na ordem (no máximo MAX_QUEUED_REQUESTS).
+    unread = deque()  # Linhas já recebidas que não couberam na fila.
+    pending = {}      # (pedaço, offset, tamanho) -> GET de bloco na fila, para o CANCEL não percorrer a fila.
+    try:
+        while not shutdown_flag.is_set():
+            buffered = queue_requests(buffered, unread, queued, pending)
+            if len(buffered) > MAX_REQUEST_LINE:
+                logging.warning(f"Pedido longo demais de {addr} na conexão persistente. Fechando.")
+                return
+            # Com a fila vazia, espera o próximo pedido. Com pedidos na fila, lê uma vez só o que
+            # já chegou (para um CANCEL alcançar o seu GET) e responde um pedido por passada.
+            # Com a fila cheia não lê: o TCP segura o outro peer até a fila andar.
+            if not queued or len(queued) < MAX_QUEUED_REQUESTS and select.select([conn], [], [], 0)[0]:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    return # O outro peer fechou a conexão.
+                buffered += chunk
+                if not queued:
+                    continue
+                buffered = queue_requests(buffered, unread, queued, pending)
+            command = queued.popleft()
+            if pending.get(tuple(command[1:])) is command:
+                del pending[tuple(command[1:])]
+            if len(command) == 4 and command[0] == "GET" and all(field.isdigit() for field in command[1:]):
+                piece_index, offset, length = map(int, command[1:])
+                with state_lock:
+                    has_piece = piece_index in owned_pieces
+                block_data = None
+                if has_piece and 0 < length and offset + length <= PIECE_SIZE:
+                    if source is None:
+                        source = open(target_file_path, "rb")
+                    # O bloco não pode passar do fim do pedaço nem do arquivo (último pedaço).
+                    block_data = read_block(piece_index, offset, length, source)
+                if block_data and len(block_data) == length:
+                    logging.debug(f"Enviando bloco {piece_index}:{offset} ({length} bytes) para {addr}")
+                    conn.sendall(f"BLOCK {piece_index} {offset} {length}\n".encode("utf-8") + block_data)
+                else:
+                    logging.warning(f"Não possui o bloco {piece_index}:{offset}+{length} solicitado por {addr}")
+                    conn.sendall(f"NOPIECE {piece_index}\n".encode("utf-8"))
+            elif command[0:1] == ["CANCELED"]:
+                logging.debug(f"Bloco {command[1]}:{command[2]} cancelado por {addr}")
+                conn.sendall((" ".join(command) + "\n").encode("utf-8"))
+            elif len(command) == 2 and command[0] == "GET" and command[1].isdigit():
+                piece_index = int(command[1])
+                with state_lock:
+                    has_piece = piece_index in owned_pieces
+                piece_data = read_piece(piece_index) if has_piece else None
+                if piece_data:
+                    logging.info(f"Enviando pedaço {piece_index} ({len(piece_data)} bytes) para {addr}")
+                    # Cabeçalho e dados num único envio (com TCP_NODELAY, dois envios seriam dois segmentos).
+                    conn.sendall(f"PIECE {piece_index} {len(piece_data)}\n".encode("utf-8") + piece_data)
+                else:
+                    logging.warning(f"Não possui o pedaço {piece_index} solicitado por {addr}")
+                    conn.sendall(f"NOPIECE {piece_index}\n".encode("utf-8"))
+            elif command == ["PING"]:
+                conn.sendall(b"PONG\n")
+            elif command == ["SIZE"]:
+                conn.sendall(f"SIZE {os.path.getsize(target_file_path)}\n".encode("utf-8"))
+            else:
+                logging.warning(f"Comando desconhecido de {addr} na conexão persistente: {' '.join(command)[:64]!r}")
+                return
+    except socket.timeout:
+        logging.debug(f"Conexão persistente de {addr} ociosa. Fechando.")
+    finally:
+        if source is not None:
+            source.close()
+
+def queue_requests(buffered, unread, queued, pending):
+    """Separa as linhas completas de `buffered` e as põe em `queued` enquanto houver espaço;
+    as que não couberem ficam em `unread`. Um "CANCEL" troca o GET correspondente ainda na
+    fila (achado por `pending`) por "CANCELED". Retorna o resto incompleto de `buffered`.
+    """
+    *lines, buffered = buffered.split(b"\n")
+    unread.extend(lines)
+    while unread and len(queued) < MAX_QUEUED_REQUESTS:
+        command = unread.popleft().decode("utf-8", "replace").split()
+        if len(command) == 4 and command[0] == "CANCEL":
+            request = pending.pop(tuple(command[1:]), None)
+            if request is not None:
+                request[0] = "CANCELED"
+        else:
+            queued.append(command)
+            if len(command) == 4 and command[0] == "GET":
+                pending.setdefault(tuple(command[1:]), command)
+    return buffered
+
 def tcp_server_thread():
     """Função da thread para escutar conexões TCP de entrada de outros peers.
     Aceita novas conexões e as delega para threads separadas para lidar com as solicitações.
@@ -242,77 +826,215 @@ def tcp_server_thread():
         server_sock.close()
         logging.info("Socket do servidor TCP fechado.")
 
+# Primeira linha de uma conexão persistente. Peers antigos não a reconhecem e fecham a
+# conexão; esses continuam recebendo um GET por conexão (ver `legacy_peers`).
+PIPELINE_HELLO = b"PIPE\n"
+MAX_REQUEST_LINE = 1024 # Maior linha de pedido ou cabeçalho de resposta aceita numa conexão persistente.
+
+class ProtocolMismatch(ConnectionError):
+    """O peer fechou a conexão ou respondeu algo desconhecido antes de qualquer resposta
+    válida ao PIPE: é um peer antigo, que só aceita um GET por conexão. Erros de
+    transporte (conexão recusada, resetada, timeout) não são isso e podem ser repetidos.
+    """
+
+class PeerConnection:
+    """Conexão TCP persistente com outro peer, com vários pedidos GET em andamento.
+
+    Pedidos: linhas "GET <pedaço> <início> <tamanho>" (um bloco do pedaço), "GET <pedaço>"
+    (o pedaço inteiro), "CANCEL <pedaço> <início> <tamanho>", "PING" e "SIZE". O outro peer
+    responde na ordem dos pedidos: "BLOCK <pedaço> <início> <tamanho>" ou "PIECE <pedaço>
+    <tamanho>" seguido dos dados, "NOPIECE <pedaço>" se não tem o pedaço, "CANCELED <pedaço>
+    <início> <tamanho>" se o GET foi cancelado antes de sair, "PONG" ou "SIZE <bytes>".
+    O CANCEL não tem resposta própria.
+    Só uma thread por vez usa a conexão (ver ConnectionPool); a exceção é `cancel`, que
+    outro worker chama quando recebe primeiro um bloco pedido aos dois (endgame).
+    """
+
+    def __init__(self, peer_addr):
+        self.peer_addr = peer_addr
+        self.sock = socket.create_connection(peer_addr, timeout=REQUEST_TIMEOUT)
+        try:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            self.sock.close()
+            raise
+        # O PIPE sai junto com os primeiros pedidos: um peer antigo lê tudo num único recv
+        # e fecha a conexão normalmente, em vez de resetá-la com pedidos ainda não lidos.
+        self.hello = PIPELINE_HELLO
+        self.reader = self.sock.makefile("rb")
+        self.send_lock = threading.Lock() # Os envios de `cancel` podem vir de outra thread.
+        self.pending = deque()  # Blocos (pedaço, início, tamanho) pedidos e ainda não respondidos, na ordem.
+        self.received = 0       # Respostas recebidas (0: o peer ainda não mostrou que aceita o PIPE).
+        self.last_used = self.last_activity = time.monotonic()
+
+    def request(self, blocks):
+        """Pede vários blocos (pedaço, início, tamanho) num único envio. Ficam em `pending`
+        mesmo se o envio falhar, para quem usa a conexão liberar todos eles.
+        """
+        if not blocks:
+            return
+        self.pending.extend(blocks)
+        with self.send_lock:
+            hello, self.hello = self.hello, b""
+            self.sock.sendall(hello + "".join(f"GET {piece_index} {offset} {length}\n"
+                                              for piece_index, offset, length in blocks).encode("utf-8"))
+
+    def cancel(self, blocks):
+        """Cancela pedidos em andamento. Os que ainda não saíram voltam como "CANCELED";
+        os outros chegam normalmente e são descartados por quem os recebe.
+        """
+        with self.send_lock:
+            self.sock.sendall("".join(f"CANCEL {piece_index} {offset} {length}\n"
+                                      for piece_index, offset, length in blocks).encode("utf-8"))
+
+    def _read_header(self):
+        header = self.reader.readline(MAX_REQUEST_LINE)
+        if not header.endswith(b"\n"):
+            # Antes da primeira resposta, é o peer que não entendeu o PIPE.
+            error = ProtocolMismatch if self.received == 0 else ConnectionError
+            raise error(f"Conexão fechada por {self.peer_addr}" if not header
+                        else f"Cabeçalho inválido de {self.peer_addr}: {header[:64]!r}")
+        self.last_activity = time.monotonic()
+        return header.split()
+
+    def receive(self):
+        """Lê a resposta ao pedido mais antigo e retorna ((pedaço, início, tamanho), dados);
+        dados = None se o peer não tem o pedaço e b"" se o pedido foi cancelado.
+        """
+        fields = self._read_header()
+        # Só sai de `pending` depois de lido: se a leitura falhar, o pedido continua pendente.
+        request = self.pending[0]
+        piece_index, offset, length = request
+        expected = [str(value).encode("utf-8") for value in request]
+        if fields == [b"NOPIECE", expected[0]]:
+            data = None
+        elif fields == [b"CANCELED"] + expected:
+            data = b""
+        elif fields == [b"BLOCK"] + expected:
+            data = self.reader.read(length)
+            if len(data) != length:
+                raise ConnectionError(f"Conexão fechada por {self.peer_addr} no meio do bloco {piece_index}:{offset} "
+                                      f"({len(data)}/{length} bytes)")
+        else:
+            error = ProtocolMismatch if self.received == 0 else ConnectionError
+            raise error(f"Resposta inesperada de {self.peer_addr} ao bloco {piece_index}:{offset}: {fields[:4]}")
+        self.pending.popleft()
+        self.received += 1
+        self.last_used = self.last_activity = time.monotonic()
+        return request, data
+
+    def ping(self):
+        """Mantém a conexão ociosa viva (o outro lado a fecha após PEER_IDLE_TIMEOUT sem pedidos)."""
+        with self.send_lock:
+            self.sock.sendall(b"PING\n")
+        if self._read_header() != [b"PONG"]:
+            raise ConnectionError(f"Resposta inesperada de {self.peer_addr} ao PING")
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+class ConnectionPool:
+    """Conexões persistentes ociosas, uma por peer, guardadas para os próximos downloads.
+    Uma conexão em uso fica fora do pool, então nunca é usada por duas threads ao mesmo tempo.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {} # { (ip, porta_tcp): PeerConnection }
+
+    def acquire(self, peer_addr):
+        """Retorna a conexão ociosa com o peer ou abre uma nova."""
+        with self.lock:
+            conn = self.idle.pop(peer_addr, None)
+        if conn is not None and select.select([conn.sock], [], [], 0)[0]:
+            # Uma conexão ociosa legível foi fechada pelo outro lado.
+            conn.close()
+            conn = None
+        return conn if conn is not None else PeerConnection(peer_addr)
+
+    def release(self, conn):
+        """Devolve ao pool uma conexão sem pedidos pendentes."""
+        if conn.pending:
+            conn.close()
+            return
+        with self.lock:
+            previous = self.idle.get(conn.peer_addr)
+            self.idle[conn.peer_addr] = conn
+        if previous is not None and previous is not conn:
+            previous.close()
+
+    def maintain(self):
+        """Fecha as conexões sem downloads há CONNECTION_REUSE_LIMIT segundos e envia PING
+        nas que estão sem tráfego há KEEPALIVE_INTERVAL.
+        """
+        now = time.monotonic()
+        with self.lock:
+            expired = [addr for addr, conn in self.idle.items() if now - conn.last_used > CONNECTION_REUSE_LIMIT]
+            stale = [addr for addr, conn in self.idle.items() if now - conn.last_activity > KEEPALIVE_INTERVAL]
+            closing = [self.idle.pop(addr) for addr in expired]
+            # Tira do pool durante o PING, para nenhum download pegar a conexão no meio dele.
+            pinging = [self.idle.pop(addr) for addr in stale if addr in self.idle]
+        for conn in closing:
+            logging.debug(f"Fechando a conexão ociosa com {conn.peer_addr}")
+            conn.close()
+        for conn in pinging:
+            try:
+                conn.ping()
+                self.release(conn)
+            except (OSError, ConnectionError) as e:
+                logging.debug(f"Conexão ociosa com {conn.peer_addr} perdida: {e}")
+                conn.close()
+
+    def close_all(self):
+        with self.lock:
+            conns, self.idle = list(self.idle.values()), {}
+        for conn in conns:
+            conn.close()
+
+connection_pool = ConnectionPool()
+legacy_peers = set() # Endereços dos peers que só aceitam um GET por conexão.
+
+def peer_keepalive_thread():
+    """Mantém as conexões persistentes ociosas vivas e fecha as que não são mais usadas."""
+    while not shutdown_flag.wait(KEEPALIVE_INTERVAL / 3):
+        try:
+            connection_pool.maintain()
+        except Exception as e:
+            logging.error(f"Erro na manutenção das conexões com os peers: {e}", exc_info=True)
+    connection_pool.close_all()
+
 def calculate_rarity():
-    """Calcula a raridade de cada pedaço com base nos peers conhecidos.
-    A raridade é o número de peers que possuem um determinado pedaço.
+    """Calcula a raridade de cada pedaço: rarity[i] é o número de peers que possuem o pedaço i.
+    Usa a disponibilidade mantida pelo tracker (SCRAPE), que cobre o enxame inteiro e não
+    custa nada aqui; só quando ela está ausente ou velha recalcula a partir dos peers conhecidos.
     """
-    rarity = {i: 0 for i in range(total_pieces)}
     with state_lock:
+        if (tracker_availability is not None and len(tracker_availability) == total_pieces
+                and time.monotonic() - availability_updated < AVAILABILITY_AGE_FACTOR * availability_period()):
+            return tracker_availability
+        rarity = [0] * total_pieces
         if not known_peers:
              # Se nenhum peer for conhecido, assume que todos os pedaços são igualmente raros (ou inatingíveis).
              # Isso evita divisão por zero ou comportamento estranho se o tracker retornar uma lista vazia inicialmente.
              return rarity
         for peer_data in known_peers.values():
             for piece_index in peer_data["pieces"]:
-                if piece_index in rarity:
+                if piece_index < total_pieces:
                     rarity[piece_index] += 1
     return rarity
 
-def choose_piece_to_download():
-    """Escolhe o próximo pedaço para baixar com base na raridade (o mais raro primeiro).
-    Prioriza pedaços que são possuídos por menos peers.
-    """
-    rarity = calculate_rarity()
-    with state_lock:
-        # Identifica os pedaços que ainda não foram baixados.
-        needed_pieces = list(set(range(total_pieces)) - owned_pieces)
-
-    if not needed_pieces:
-        return None, None # Todos os pedaços foram baixados.
-
-    # Ordena os pedaços necessários por raridade (ascendente), e aleatoriamente para desempate.
-    needed_pieces.sort(key=lambda i: (rarity.get(i, 0), random.random()))
-
-    rarest_needed_piece = needed_pieces[0]
-
-    # Encontra peers que possuem este pedaço.
-    peers_with_piece = []
-    with state_lock:
-        for p_id, data in known_peers.items():
-            if rarest_needed_piece in data["pieces"]:
-                peers_with_piece.append(p_id)
-
-    if not peers_with_piece:
-        logging.warning(f"Nenhum peer conhecido possui o pedaço mais raro necessário {rarest_needed_piece}. Tentando novamente.")
-        return None, None # Não é possível baixar este pedaço agora.
-
-    # Escolhe um peer aleatório entre aqueles que possuem o pedaço.
-    chosen_peer_id = random.choice(peers_with_piece)
-    with state_lock:
-        # Garante que o peer ainda existe (pode ter sido removido entre as verificações).
-        if chosen_peer_id in known_peers:
-             chosen_peer_info = known_peers[chosen_peer_id]
-        else:
-             logging.warning(f"Peer {chosen_peer_id} desapareceu antes da seleção.")
-             return None, None
-
-    logging.info(f"Pedaço escolhido {rarest_needed_piece} (raridade: {rarity.get(rarest_needed_piece, 0)}) do peer {chosen_peer_id}")
-    return rarest_needed_piece, chosen_peer_info
-
-def download_piece(piece_index, peer_info, udp_sock):
-    """Tenta baixar um pedaço específico de um determinado peer.
-    Estabelece uma conexão TCP com o peer, solicita o pedaço e o recebe.
+def fetch_piece(piece_index, peer_addr):
+    """Baixa um pedaço numa conexão TCP própria: conecta, envia "GET n", lê e fecha.
+    É o protocolo original, usado com os peers que não aceitam conexões persistentes.
+    Retorna os dados, ou None em caso de falha.
     """
-    global target_file_path
-
-    peer_addr = (peer_info["ip"], peer_info["tcp_port"])
-    logging.info(f"Tentando baixar o pedaço {piece_index} de {peer_addr}")
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.settimeout(REQUEST_TIMEOUT)
     try:
-        if peer_addr == "127.0.0.1":
-            peer_addr = "0.0.0.0"
-            
         # Conecta-se ao peer.
         sock.connect(peer_addr)
         # Envia a solicitação GET para o pedaço.
@@ -323,8 +1045,7 @@ def download_piece(piece_index, peer_info, udp_sock):
         expected_size = get_piece_size(piece_index)
         while len(received_data) < expected_size:
             # Lê os dados em blocos.
-            chunk = sock.recv(4096) 
-            print("received chunk: ", len(chunk))
+            chunk = sock.recv(4096)
             if not chunk:
                 logging.error(f"Conexão fechada por {peer_addr} durante o download do pedaço {piece_index}. Recebido {len(received_data)}/{expected_size} bytes.")
                 break # Conexão interrompida.
@@ -333,53 +1054,426 @@ def download_piece(piece_index, peer_info, udp_sock):
         if len(received_data) != expected_size:
              logging.warning(f"Dados recebidos ({len(received_data)}) é diferente do esperado ({expected_size}) para o pedaço {piece_index} from {peer_addr}. Truncating.")
              received_data = received_data[:expected_size]
-        logging.info(f"Recebido {len(received_data)} de {expected_size}")
-
         logging.info(f"Pedaço {piece_index} ({len(received_data)} bytes) recebido com sucesso de {peer_addr}")
-
-        # --- Opcional: Verificar o hash do pedaço aqui --- #
-
-        # Escreve o pedaço no arquivo.
-        if write_piece(piece_index, received_data):
-            with state_lock:
-                # Adiciona o pedaço aos pedaços possuídos.
-                owned_pieces.add(piece_index)
-            logging.info(f"Pedaço {piece_index} salvo com sucesso. Possuídos: {len(owned_pieces)}/{total_pieces}")
-            # Informa imediatamente o tracker sobre o novo pedaço.
-            # Considerar fazer isso com menos frequência se causar muito tráfego.
-            send_tracker_update(udp_sock) # Precisa do udp_sock aqui.
-            if len(owned_pieces) == total_pieces:
-                logging.info("Todos os pedaços baixados! Download completo.")
-                # Opcionalmente, enviar uma atualização final para o tracker.
-                # Renomeia o arquivo após o download completo.
-
-                novo_nome = target_file_path.replace("incompleto", "")
-                
-                try:
-                    os.rename(target_file_path, novo_nome)
-                    logging.info(f"Arquivo renomeado para: {novo_nome}")
-                    target_file_path = novo_nome
-                except Exception as e:
-                    logging.error(f"Erro ao renomear arquivo: {e}")
-
-            return True
-        else:
-            logging.error(f"Falha ao escrever o pedaço {piece_index} no arquivo.")
-            return False
+        return received_data
 
     except socket.timeout:
         logging.warning(f"Timeout ao conectar ou baixar de {peer_addr} para o pedaço {piece_index}")
-        return False
+        return None
     except socket.error as e:
         logging.error(f"Erro de socket ao baixar o pedaço {piece_index} de {peer_addr}: {e}")
-        return False
+        return None
     except Exception as e:
         logging.error(f"Erro ao baixar o pedaço {piece_index} de {peer_addr}: {e}", exc_info=True)
-        return False
+        return None
     finally:
         # Fecha o socket.
         sock.close()
 
+def store_piece(piece_index, data, udp_sock):
+    """Grava um pedaço recebido, marca-o como possuído e avisa o tracker (HAVE).
+    Com o último pedaço, renomeia o arquivo (tira o "incompleto" do nome).
+    Com o metainfo, um pedaço que não confere com o hash é descartado (e baixado de novo).
+    """
+    if piece_hashes and hashlib.sha1(data).digest() != piece_hashes[piece_index]:
+        logging.error(f"Pedaço {piece_index} não confere com o hash do metainfo. Descartando.")
+        return False
+
+    # Escreve o pedaço no arquivo.
+    if not write_piece(piece_index, data):
+        logging.error(f"Falha ao escrever o pedaço {piece_index} no arquivo.")
+        return False
+    with state_lock:
+        # Adiciona o pedaço aos pedaços possuídos.
+        owned_pieces.add(piece_index)
+        complete = len(owned_pieces) == total_pieces
+    logging.info(f"Pedaço {piece_index} salvo com sucesso. Possuídos: {len(owned_pieces)}/{total_pieces}")
+    # Informa imediatamente o tracker sobre o novo pedaço (apenas o delta).
+    send_have(udp_sock, [piece_index])
+    if complete:
+        logging.info("Todos os pedaços baixados! Download completo.")
+        rename_completed_file()
+    return True
+
+def rename_completed_file():
+    """Renomeia o arquivo após o download completo (tira o "incompleto" do nome)."""
+    global target_file_path
+    novo_nome = target_file_path.replace("incompleto", "")
+    try:
+        os.rename(target_file_path, novo_nome)
+        logging.info(f"Arquivo renomeado para: {novo_nome}")
+        target_file_path = novo_nome
+    except Exception as e:
+        logging.error(f"Erro ao renomear arquivo: {e}")
+
+def download_piece(piece_index, peer_info, udp_sock):
+    """Baixa um pedaço de um peer numa conexão própria (ver `fetch_piece`) e o grava."""
+    peer_addr = (peer_info["ip"], peer_info["tcp_port"])
+    logging.info(f"Tentando baixar o pedaço {piece_index} de {peer_addr}")
+    data = fetch_piece(piece_index, peer_addr)
+    if data is None:
+        return False
+    return store_piece(piece_index, data, udp_sock)
+
+class PartialPiece:
+    """Pedaço em download: os blocos já recebidos (bitmap), os pedidos e os dados montados.
+    Os blocos recebidos ficam aqui mesmo se a conexão com o peer cair; só os pedidos
+    em andamento com ele voltam a ficar livres.
+    """
+
+    __slots__ = ('size', 'blocks', 'data', 'received', 'requested')
+
+    def __init__(self, size):
+        self.size = size
+        self.blocks = (size + BLOCK_SIZE - 1) // BLOCK_SIZE
+        self.data = bytearray(size)
+        self.received = 0   # Bit i = bloco i recebido.
+        self.requested = {} # { bloco: endereços dos peers a quem foi pedido (mais de um só no endgame) }
+
+    def block_range(self, block):
+        offset = block * BLOCK_SIZE
+        return offset, min(BLOCK_SIZE, self.size - offset)
+
+    def free_blocks(self):
+        return [block for block in range(self.blocks)
+                if not self.received >> block & 1 and block not in self.requested]
+
+    def is_complete(self):
+        return self.received == (1 << self.blocks) - 1
+
+class DownloadScheduler:
+    """Distribui os blocos que faltam entre downloads em paralelo de vários peers.
+
+    Cada peer com algo útil ganha um worker (até `max_workers` ao mesmo tempo), que
+    mantém até `per_peer` pedidos de bloco em andamento na conexão persistente com ele
+    (ver `download_from_peer`). O worker reserva os blocos com `claim`: primeiro os que
+    faltam nos pedaços já começados (de qualquer peer que tenha o pedaço), depois os de
+    pedaços novos, do mais raro para o mais comum. Um bloco reservado só volta a ficar
+    livre quando o pedido falha, então fora do endgame nunca é pedido a dois peers.
+
+    Endgame: quando todos os pedaços que faltam já foram começados e nenhum bloco está
+    livre, o fim do download dependeria do peer mais lento. A partir daí `claim` também
+    entrega blocos já pedidos a outro peer, até `endgame_requests` peers por bloco e
+    ENDGAME_DUPLICATE_LIMIT pedidos duplicados ao todo (o teto da banda gasta à toa).
+    Quando um bloco chega, os pedidos dele aos outros peers são cancelados.
+    Ordem dos locks: `self.lock` antes de `state_lock`.
+    """
+
+    def __init__(self, udp_sock, max_workers=MAX_CONNECTIONS, per_peer=PIPELINE_DEPTH,
+                 endgame_requests=ENDGAME_MAX_REQUESTS, duplicate_limit=ENDGAME_DUPLICATE_LIMIT):
+        self.udp_sock = udp_sock
+        self.max_workers = max_workers
+        self.per_peer = per_peer
+        self.endgame_requests = endgame_requests
+        self.duplicate_limit = duplicate_limit
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock) # Avisado quando um pedaço ou um worker termina.
+        self.partial = {}  # { pedaço: PartialPiece } pedaços começados e ainda não gravados
+        self.workers = {}  # { endereço do peer: thread do worker }
+        self.connections = {} # { endereço do peer: PeerConnection em uso pelo worker } (para os CANCELs)
+        self.retry_at = {} # { endereço do peer: momento (monotonic) em que ele volta a ser usado após uma falha }
+        self.rarity = None
+        self.rarity_updated = 0.0
+        self.duplicates = 0 # Pedidos duplicados em andamento (além do primeiro de cada bloco).
+        # Contadores do endgame.
+        self.endgame_started = None # Momento (monotonic) em que o endgame começou.
+        self.duplicate_requests = 0
+        self.canceled_requests = 0
+        self.wasted_bytes = 0 # Blocos que chegaram depois de já recebidos de outro peer.
+
+    def current_rarity(self):
+        """Raridade dos pedaços, recalculada no máximo a cada RARITY_REFRESH segundos."""
+        now = time.monotonic()
+        if self.rarity is None or now - self.rarity_updated > RARITY_REFRESH:
+            self.rarity = calculate_rarity()
+            self.rarity_updated = now
+        return self.rarity
+
+    def _new_pieces(self, peer_info, abandoned=False):
+        """Pedaços que o peer tem, que faltam aqui e que ainda não foram começados. Com
+        `abandoned`, inclui os começados sem nenhum bloco pedido. Com `self.lock`.
+        """
+        with state_lock:
+            return [piece_index for piece_index in peer_info["pieces"]
+                    if piece_index < total_pieces and piece_index not in owned_pieces
+                    and (piece_index not in self.partial
+                         or abandoned and not self.partial[piece_index].requested
+                         and not self.partial[piece_index].is_complete())]
+
+    def _in_endgame(self):
+        """Todos os pedaços que faltam foram começados e não há blocos livres. Com `self.lock`."""
+        if self.endgame_requests < 2:
+            return False
+        with state_lock:
+            missing = total_pieces - len(owned_pieces)
+            started = sum(1 for piece_index in self.partial if piece_index not in owned_pieces)
+        if started < missing or any(partial.free_blocks() for partial in self.partial.values()):
+            return False
+        if self.endgame_started is None:
+            self.endgame_started = time.monotonic()
+            logging.info(f"Endgame: faltam {missing} pedaços, todos com blocos pedidos. "
+                         f"Pedindo os blocos que faltam a até {self.endgame_requests} peers.")
+        return True
+
+    def _duplicate_candidates(self, peer_addr, peer_info):
+        """Blocos já pedidos a outros peers que este pode mandar no endgame, os com menos
+        pedidos primeiro, como (pedidos, pedaço, bloco). Com `self.lock`.
+        """
+        candidates = []
+        with state_lock:
+            pieces = [(piece_index, partial) for piece_index, partial in self.partial.items()
+                      if piece_index in peer_info["pieces"]]
+        for piece_index, partial in pieces:
+            for block, requesters in partial.requested.items():
+                # Um pedaço pedido inteiro a um peer antigo não é dividido (ver `download_legacy`).
+                if peer_addr in requesters or len(requesters) >= self.endgame_requests \
+                        or not requesters.isdisjoint(legacy_peers):
+                    continue
+                candidates.append((len(requesters), piece_index, block))
+        candidates.sort()
+        return candidates
+
+    def _has_work(self, peer_addr, peer_info):
+        """Indica se há blocos livres (ou, no endgame, duplicáveis) que o peer pode mandar. Com `self.lock`."""
+        if peer_addr in legacy_peers:
+            return bool(self._new_pieces(peer_info, abandoned=True))
+        with state_lock:
+            pieces = peer_info["pieces"]
+            if any(piece_index in pieces and partial.free_blocks() for piece_index, partial in self.partial.items()):
+                return True
+        if self._new_pieces(peer_info):
+            return True
+        return self.duplicates < self.duplicate_limit and self._in_endgame() \
+            and bool(self._duplicate_candidates(peer_addr, peer_info))
+
+    def claim(self, peer_addr, peer_info, count):
+        """Reserva para o peer até `count` blocos e os retorna como (pedaço, início, tamanho)."""
+        if count <= 0:
+            return []
+        rarity = self.current_rarity()
+
+        def by_rarity(piece_index):
+            return (rarity[piece_index] if piece_index < len(rarity) else 0, random.random())
+
+        chosen = []
+        with self.lock:
+            # Primeiro completa os pedaços já começados: um pedaço só é gravado inteiro.
+            with state_lock:
+                started = sorted((piece_index for piece_index in self.partial if piece_index in peer_info["pieces"]),
+                                 key=by_rarity)
+            pieces = [(piece_index, self.partial[piece_index]) for piece_index in started]
+            if sum(len(partial.free_blocks()) for _, partial in pieces) < count:
+                # Depois começa pedaços novos, o suficiente para completar os pedidos.
+                blocks_per_piece = max(1, PIECE_SIZE // BLOCK_SIZE)
+                for piece_index in heapq.nsmallest(-(-count // blocks_per_piece), self._new_pieces(peer_info),
+                                                   key=by_rarity):
+                    partial = self.partial[piece_index] = PartialPiece(get_piece_size(piece_index))
+                    pieces.append((piece_index, partial))
+            for piece_index, partial in pieces:
+                for block in partial.free_blocks()[:count - len(chosen)]:
+                    partial.requested[block] = {peer_addr}
+                    chosen.append((piece_index, *partial.block_range(block)))
+                if len(chosen) == count:
+                    break
+            room = min(count - len(chosen), self.duplicate_limit - self.duplicates)
+            if room > 0 and self._in_endgame():
+                for _, piece_index, block in self._duplicate_candidates(peer_addr, peer_info)[:room]:
+                    partial = self.partial[piece_index]
+                    partial.requested[block].add(peer_addr)
+                    chosen.append((piece_index, *partial.block_range(block)))
+                    self.duplicates += 1
+                    self.duplicate_requests += 1
+        return chosen
+
+    def block_received(self, peer_addr, request, data):
+        """Guarda um bloco recebido do peer e cancela os pedidos dele aos outros peers.
+        Quando o pedaço fica completo, retorna os dados dele (o pedaço continua reservado
+        até `piece_done`); senão, None. `data` = b"" é a resposta a um pedido cancelado.
+        """
+        piece_index, offset, length = request
+        block = offset // BLOCK_SIZE
+        with self.lock:
+            partial = self.partial.get(piece_index)
+            if not data or partial is None or partial.received >> block & 1:
+                # Cancelado, ou chegou depois da cópia de outro peer.
+                if data:
+                    self.wasted_bytes += len(data)
+                else:
+                    self.canceled_requests += 1
+                return None
+            requesters = partial.requested.pop(block, set())
+            self.duplicates -= max(0, len(requesters) - 1)
+            partial.data[offset:offset + length] = data
+            partial.received |= 1 << block
+            piece_data = bytes(partial.data) if partial.is_complete() else None
+            others = [self.connections[addr] for addr in requesters
+                      if addr != peer_addr and addr in self.connections]
+        for conn in others:
+            try:
+                conn.cancel([request])
+            except OSError as e:
+                # A conexão caiu; o worker dela libera os pedidos.
+                logging.debug(f"Falha ao cancelar o bloco {piece_index}:{offset} em {conn.peer_addr}: {e}")
+        return piece_data
+
+    def release(self, peer_addr, requests):
+        """Libera os blocos pedidos ao peer que não chegaram (ele caiu ou não tem o pedaço)."""
+        if not requests:
+            return
+        with self.lock:
+            for piece_index, offset, _ in requests:
+                partial = self.partial.get(piece_index)
+                requesters = partial.requested.get(offset // BLOCK_SIZE) if partial is not None else None
+                if not requesters or peer_addr not in requesters:
+                    continue # Já recebido de outro peer.
+                requesters.discard(peer_addr)
+                if requesters:
+                    self.duplicates -= 1
+                else:
+                    del partial.requested[offset // BLOCK_SIZE]
+            self.changed.notify_all()
+
+    def piece_done(self, piece_index):
+        """Tira o pedaço dos começados depois da tentativa de gravá-lo. Se a gravação
+        falhou, o pedaço volta a faltar e é baixado de novo do zero.
+        """
+        with self.lock:
+            partial = self.partial.pop(piece_index, None)
+            if partial is not None:
+                self.duplicates -= sum(len(requesters) - 1 for requesters in partial.requested.values())
+            self.changed.notify_all()
+
+    def start_workers(self, peers):
+        """Inicia workers para os peers com blocos livres que ainda não têm um, até o limite.
+        `peers` é uma lista de (endereço, informações do peer). Retorna quantos workers estão ativos.
+        """
+        now = time.monotonic()
+        random.shuffle(peers)
+        with self.lock:
+            for peer_addr, peer_info in peers:
+                if len(self.workers) >= self.max_workers:
+                    break
+                if peer_addr in self.workers or self.retry_at.get(peer_addr, 0) > now:
+                    continue
+                if not self._has_work(peer_addr, peer_info):
+                    continue
+                worker = threading.Thread(target=download_from_peer, args=(self, peer_addr, peer_info),
+                                          name=f"Download-{peer_addr[1]}", daemon=True)
+                self.workers[peer_addr] = worker
+                worker.start()
+            return len(self.workers)
+
+    def worker_done(self, peer_addr, failed):
+        with self.lock:
+            del self.workers[peer_addr]
+            if failed:
+                # Espera antes de voltar a baixar deste peer.
+                self.retry_at[peer_addr] = time.monotonic() + PEER_RETRY_DELAY
+            self.changed.notify_all()
+
+    def wait(self, timeout):
+        with self.lock:
+            self.changed.wait(timeout)
+
+    def stats(self):
+        return {"endgame_started": self.endgame_started, "duplicate_requests": self.duplicate_requests,
+                "canceled_requests": self.canceled_requests, "wasted_bytes": self.wasted_bytes}
+
+def download_legacy(scheduler, peer_addr, peer_info):
+    """Worker de um peer antigo: um pedaço inteiro por conexão (ver `fetch_piece`).
+    Reserva de uma vez os blocos livres de um pedaço novo ou de um começado que ninguém
+    está completando. Os blocos que o pedaço já recebeu de outros peers ficam nele: se o
+    download falhar, só a reserva é liberada e o pedaço continua de onde estava.
+    Retorna False se um download falhou.
+    """
+    while not shutdown_flag.is_set():
+        with scheduler.lock:
+            new_pieces = scheduler._new_pieces(peer_info, abandoned=True)
+            if not new_pieces:
+                return True
+            piece_index = min(new_pieces, key=lambda i: scheduler.rarity[i] if scheduler.rarity else 0)
+            partial = scheduler.partial.get(piece_index)
+            if partial is None:
+                partial = scheduler.partial[piece_index] = PartialPiece(get_piece_size(piece_index))
+            blocks = partial.free_blocks()
+            partial.requested.update((block, {peer_addr}) for block in blocks)
+            requests = [(piece_index, *partial.block_range(block)) for block in blocks]
+        stored = False
+        try:
+            stored = download_piece(piece_index, peer_info, scheduler.udp_sock)
+        finally:
+            if stored:
+                scheduler.piece_done(piece_index)
+            else:
+                scheduler.release(peer_addr, requests)
+        if not stored:
+            return False
+    return True
+
+def download_from_peer(scheduler, peer_addr, peer_info):
+    """Worker de um peer: pede os blocos que o escalonador reservar para ele, com até
+    `scheduler.per_peer` pedidos em andamento na conexão persistente, até o peer não ter
+    mais blocos livres. Cada pedaço completo é gravado por quem recebeu o último bloco.
+    A conexão volta ao pool para os próximos downloads.
+    """
+    udp_sock = scheduler.udp_sock
+    failed = False
+    conn = None
+    try:
+        if peer_addr in legacy_peers:
+            failed = not download_legacy(scheduler, peer_addr, peer_info)
+            return
+        logging.info(f"Baixando de {peer_addr} (conexão persistente)")
+        conn = connection_pool.acquire(peer_addr)
+        with scheduler.lock:
+            scheduler.connections[peer_addr] = conn
+        while not shutdown_flag.is_set():
+            # Mantém o pipeline cheio: o peer já tem o próximo pedido quando termina o atual.
+            # Os pedidos saem em lote quando metade deles foi respondida (um envio por bloco
+            # custaria mais que o próprio bloco).
+            if len(conn.pending) <= scheduler.per_peer // 2:
+                conn.request(scheduler.claim(peer_addr, peer_info, scheduler.per_peer - len(conn.pending)))
+            if not conn.pending:
+                break
+            request, data = conn.receive()
+            if data is None:
+                logging.warning(f"Peer {peer_addr} não tem o pedaço {request[0]}.")
+                with state_lock:
+                    peer_info["pieces"].discard(request[0])
+                # Os outros blocos já pedidos deste pedaço voltam quando as respostas chegarem.
+                scheduler.release(peer_addr, [request])
+                continue
+            piece_data = scheduler.block_received(peer_addr, request, data)
+            if piece_data is not None:
+                try:
+                    store_piece(request[0], piece_data, udp_sock)
+                finally:
+                    scheduler.piece_done(request[0])
+        with scheduler.lock:
+            scheduler.connections.pop(peer_addr, None)
+        connection_pool.release(conn)
+    except ProtocolMismatch as e:
+        conn.close()
+        # Não entendeu o PIPE: peer antigo, um GET por conexão.
+        logging.info(f"Peer {peer_addr} não aceita conexões persistentes ({e}). Usando um GET por conexão.")
+        legacy_peers.add(peer_addr)
+    except OSError as e:
+        # Erro de transporte (recusada, resetada, timeout): tenta de novo depois de PEER_RETRY_DELAY.
+        if conn is not None:
+            conn.close()
+        logging.error(f"Erro na conexão com {peer_addr}: {e}")
+        failed = True
+    except Exception as e:
+        logging.error(f"Erro ao baixar de {peer_addr}: {e}", exc_info=True)
+        failed = True
+    finally:
+        if conn is not None:
+            with scheduler.lock:
+                scheduler.connections.pop(peer_addr, None)
+            # Os blocos que ficaram sem resposta voltam a ficar livres; os recebidos ficam.
+            scheduler.release(peer_addr, list(conn.pending))
+        scheduler.worker_done(peer_addr, failed)
+
 def get_piece_size(piece_index):
     """Calcula o tamanho de um pedaço específico, lidando com o último pedaço que pode ser menor.
     """
@@ -396,6 +1490,21 @@ def get_piece_size(piece_index):
         # Retorna o tamanho padrão do pedaço como fallback, pode causar problemas.
         return PIECE_SIZE
 
+def read_block(piece_index, offset, length, f=None):
+    """Lê `length` bytes do pedaço a partir de `offset` (um bloco pedido por outro peer).
+    `f` é o arquivo alvo já aberto; sem ele, o arquivo é aberto só para esta leitura.
+    """
+    try:
+        if f is not None:
+            f.seek(piece_index * PIECE_SIZE + offset)
+            return f.read(length)
+        with open(target_file_path, "rb") as f:
+            f.seek(piece_index * PIECE_SIZE + offset)
+            return f.read(length)
+    except OSError as e:
+        logging.error(f"Erro ao ler o bloco {piece_index}:{offset} de {target_file_path}: {e}")
+        return None
+
 def read_piece(piece_index):
     """Lê um pedaço específico do arquivo alvo.
     Abre o arquivo, busca a posição inicial do pedaço e lê a quantidade de bytes correspondente.
@@ -440,6 +1549,14 @@ def write_piece(piece_index, data):
         logging.error(f"Erro inesperado ao escrever o pedaço {piece_index}: {e}", exc_info=True)
         return False
 
+def verified_pieces():
+    """Pedaços do arquivo alvo que conferem com os hashes do metainfo, calculados em
+    paralelo (ver `metainfo.hash_pieces`).
+    """
+    hashes = metainfo.hash_pieces(target_file_path, PIECE_SIZE)
+    return {piece_index for piece_index, digest in enumerate(hashes)
+            if piece_index < len(piece_hashes) and digest == piece_hashes[piece_index]}
+
 def initialize_output_file(file_size):
     """Cria ou garante que o arquivo de saída exista com o tamanho correto, preenchido com bytes nulos.
     Isso pré-aloca o espaço necessário para o arquivo.
@@ -464,52 +1581,48 @@ def initialize_output_file(file_size):
         return False
     return True
 
-def download_manager(udp_sock):
-    """Lógica principal para gerenciar o processo de download.
-    Em um loop, escolhe um pedaço para baixar, tenta baixá-lo e atualiza o estado.
+def download_all(udp_sock, max_workers=None, endgame=None):
+    """Baixa os pedaços que faltam de todos os peers úteis em paralelo (ver DownloadScheduler).
+    `endgame` é o número de peers por bloco no endgame (padrão: --endgame-requests).
+    Retorna True quando o arquivo está completo, False se o peer está sendo encerrado.
     """
-    logging.info("Gerenciador de download iniciado.")
-    is_seeder = False # Inicializa como não seeder para o loop de download
+    global download_scheduler
+    scheduler = download_scheduler = DownloadScheduler(udp_sock, max_workers or max_connections,
+                                                       endgame_requests=endgame or endgame_requests)
     while not shutdown_flag.is_set():
         with state_lock:
             # Verifica se todos os pedaços foram baixados.
-            if len(owned_pieces) == total_pieces:
-                logging.info("Download completo! Todos os pedaços adquiridos.")
-                
-                is_seeder = True # Se todos os pedaços foram baixados, este peer se torna um seeder.
-                send_tracker_update(udp_sock) # Atualização final para o tracker.
-                logging.info("Enviado pro tracker update")
-                break # Sai do loop de download.
-
-        # Escolhe o próximo pedaço para baixar e o peer de quem baixar.
-        piece_index, peer_info = choose_piece_to_download()
-
-        if piece_index is not None and peer_info is not None:
-            # Tenta baixar o pedaço.
-            if download_piece(piece_index, peer_info, udp_sock):
-                # Sucesso, o loop continuará para escolher o próximo pedaço.
-                # Envia atualização imediatamente após obter um pedaço.
-                send_tracker_update(udp_sock)
-                pass
-            else:
-                # Falha, espera um pouco antes de tentar novamente.
-                logging.warning(f"Falha ao baixar o pedaço {piece_index}. Esperando antes de tentar novamente.")
-                shutdown_flag.wait(5) # Espera 5 segundos antes de tentar o próximo pedaço.
+            needed_count = total_pieces - len(owned_pieces)
+            peers = [((data["ip"], data["tcp_port"]), data) for data in known_peers.values()]
+        if needed_count == 0:
+            if scheduler.endgame_started is not None:
+                logging.info(f"Endgame: {time.monotonic() - scheduler.endgame_started:.2f}s, "
+                             f"{scheduler.duplicate_requests} pedidos duplicados, "
+                             f"{scheduler.canceled_requests} cancelados a tempo, "
+                             f"{scheduler.wasted_bytes // 1024} KiB recebidos em dobro.")
+            return True
+        # Novos peers (JOIN/PEERLIST) e peers liberados ganham workers a cada volta.
+        if scheduler.start_workers(peers):
+            scheduler.wait(1.0)
         else:
-            # Nenhum pedaço disponível ou nenhum peer o possui, espera antes de verificar novamente.
-            with state_lock:
-                 needed_count = total_pieces - len(owned_pieces)
-            if needed_count > 0:
-                 logging.info(f"Nenhum pedaço/peer adequado encontrado. Ainda faltam {needed_count} pedaços. Esperando...")
-                 shutdown_flag.wait(10) # Espera 10 segundos.
-            else:
-                 # Deveria ter sido capturado pela verificação no início do loop.
-                 logging.info("Download parece completo, mas o loop continuou. Saindo.")
-                 break
+            # Nenhum peer conhecido tem pedaços que faltam (ou todos falharam há pouco).
+            logging.info(f"Nenhum pedaço/peer adequado encontrado. Ainda faltam {needed_count} pedaços. Esperando...")
+            shutdown_flag.wait(PEER_RETRY_DELAY)
+    return False
 
+def download_manager(udp_sock):
+    """Lógica principal para gerenciar o processo de download.
+    Baixa o arquivo de vários peers em paralelo e, ao terminar, passa a servir como seeder.
+    """
+    logging.info("Gerenciador de download iniciado.")
+    # Se todos os pedaços foram baixados, este peer se torna um seeder.
+    is_seeder = download_all(udp_sock)
     logging.info("Gerenciador de download parado.")
-    # Se o download foi concluído (peer se tornou seeder), entra no modo seeder.
     if is_seeder:
+        logging.info("Download completo! Todos os pedaços adquiridos.")
+        # O último HAVE já levou o último pedaço; um sinal de vida confirma a sequência.
+        send_have(udp_sock)
+        logging.info("Enviado pro tracker update")
         logging.info("Modo Seeder: servindo até Ctrl+C")
         try:
             while not shutdown_flag.is_set():
@@ -520,13 +1633,58 @@ def download_manager(udp_sock):
 
 
 def main():
-    global total_pieces, target_file_path, my_tcp_port, my_ip, tracker_addr, peer_id, is_seeder
+    global total_pieces, target_file_path, my_tcp_port, my_ip, tracker_addr, peer_id, is_seeder, tracker_protocol, numwant, info_hash, tracker_mtu
+    global trackers, tracker_index, max_connections, endgame_requests, piece_hashes, PIECE_SIZE
 
     parser = argparse.ArgumentParser(description="P2P File Sharing Client (Simulação do BitTorrent).")
     parser.add_argument("target_file", help="Caminho do arquivo alvo pra compartilhar/baixar.")
-    parser.add_argument("--tracker", required=True, help="Tracker IP:PORTA.")
+    parser.add_argument("--tracker", required=True,
+                        help="Tracker IP:PORTA, ou vários separados por vírgula (instâncias de um cluster).")
     parser.add_argument("--listen-port", type=int, required=True, help="Porta TCP para comunicação entre peers.")
+    parser.add_argument("--protocol", choices=["auto", "binary", "text"], default="auto",
+                        help="Protocolo com o tracker. auto: tenta o binário e volta para o texto se o tracker não responder.")
+    parser.add_argument("--numwant", type=int, default=numwant, help="Máximo de peers pedidos ao tracker por JOIN.")
+    parser.add_argument("--info-hash", help="Info-hash do enxame (40 dígitos hex). Padrão: SHA-1 do nome do arquivo.")
+    parser.add_argument("--mtu", type=int, help="Maior datagrama de PEERLIST aceito do tracker (padrão: o do tracker).")
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS,
+                        help="Peers dos quais o download é feito ao mesmo tempo.")
+    parser.add_argument("--metainfo", help="Metainfo do arquivo (metainfo.py make): tamanho, pedaços e hashes. "
+                                           "Sem ele, o leecher pede o SIZE a um peer e não confere os pedaços.")
+    parser.add_argument("--endgame-requests", type=int, default=ENDGAME_MAX_REQUESTS,
+                        help="No fim do download, peers aos quais cada bloco que falta é pedido ao mesmo tempo (1 desliga o endgame).")
     args = parser.parse_args()
+    numwant = args.numwant
+    max_connections = max(1, args.max_connections)
+    endgame_requests = max(1, args.endgame_requests)
+
+    content = None
+    if args.metainfo:
+        try:
+            content = metainfo.Metainfo.load(args.metainfo)
+        except (OSError, metainfo.MetainfoError) as e:
+            logging.critical(f"Não foi possível carregar o metainfo {args.metainfo}: {e}")
+            return
+        # O metainfo define os pedaços de todo o enxame.
+        PIECE_SIZE = content.piece_size
+        total_pieces = content.total_pieces
+        piece_hashes = content.hashes
+        logging.info(f"Metainfo: {content.size} bytes, {total_pieces} pedaços de {PIECE_SIZE // 1024} KiB")
+    tracker_mtu = args.mtu
+
+    # Identifica o enxame deste conteúdo no tracker.
+    if args.info_hash:
+        try:
+            info_hash = bytes.fromhex(args.info_hash)
+        except ValueError:
+            info_hash = b""
+        if len(info_hash) != binary_protocol.INFO_HASH_SIZE:
+            logging.critical(f"Info-hash inválido: {args.info_hash}")
+            return
+    elif content is not None:
+        info_hash = content.content_id
+    else:
+        info_hash = content_info_hash(args.target_file)
+    logging.info(f"Enxame: {info_hash.hex()}")
 
     my_tcp_port = args.listen_port 
     target_file_path = args.target_file
@@ -557,6 +1715,18 @@ def main():
             total_pieces = math.ceil(file_size / PIECE_SIZE)
             logging.info(f"Arquivo local compartilhado: {target_file_path}, Tamanho: {file_size} bytes, Pedaços: {total_pieces}")
 
+            # Com o metainfo, só serve o arquivo se todos os pedaços conferem.
+            if content is not None:
+                if file_size != content.size:
+                    logging.critical(f"O arquivo tem {file_size} bytes e o metainfo, {content.size}.")
+                    return
+                start = time.perf_counter()
+                bad_pieces = total_pieces - len(verified_pieces())
+                if bad_pieces:
+                    logging.critical(f"{bad_pieces} pedaços do arquivo não conferem com o metainfo.")
+                    return
+                logging.info(f"Pedaços conferidos com o metainfo em {time.perf_counter() - start:.2f}s")
+
             # Assim que identifica que é seeder, já manda update pro tracker de quantos pedaços possui.
             # Marca todos os pedaços como possuídos por este seeder.
             owned_pieces.update(range(total_pieces))
@@ -564,14 +1734,25 @@ def main():
             logging.critical(f"Não foi possível encontrar o arquivo alvo: {e}")
             return
 
+    # Com o metainfo, o leecher já sabe o tamanho do arquivo: cria a saída e retoma
+    # os pedaços de um download anterior que conferem com os hashes.
+    if not is_seeder and content is not None:
+        resume = os.path.isfile(target_file_path) and os.path.getsize(target_file_path) == content.size
+        if not initialize_output_file(content.size):
+            logging.critical("Erro ao criar arquivo no leecher.")
+            return
+        if resume:
+            owned_pieces.update(verified_pieces())
+            logging.info(f"Retomando o download: {len(owned_pieces)}/{total_pieces} pedaços já conferem com o metainfo.")
+            if len(owned_pieces) == total_pieces:
+                rename_completed_file()
+
     # Aqui pega a tring de IP:PORTA e faz split da string pra obter ambos em variáveis separadas.
-    # Analisa o endereço do tracker fornecido na linha de comando.
+    # Analisa o(s) endereço(s) do tracker fornecido(s) na linha de comando.
     try:
-        tracker_host, tracker_port_str = args.tracker.split(":")
-        tracker_port = int(tracker_port_str)
-        tracker_addr = (tracker_host, tracker_port)
-    except (ValueError, IndexError):
-        logging.critical(f"Endereço do tracker inválido. Precisa ser HOST:PORT. Retorno: {args.tracker}")
+        trackers = parse_trackers(args.tracker)
+    except (ValueError, IndexError, socket.gaierror):
+        logging.critical(f"Endereço do tracker inválido. Precisa ser HOST:PORT[,HOST:PORT...]. Retorno: {args.tracker}")
         return
 
     # Aqui eu pego o meu ip e a porta 
@@ -579,6 +1760,9 @@ def main():
     my_ip = get_my_ip()
     peer_id = f"{my_ip}:{my_tcp_port}"
     logging.info(f"Peer local (EU) com IP: {peer_id}")
+    # Com vários trackers, cada peer começa pelo seu preferido (os anúncios se espalham pelo cluster).
+    tracker_index = preferred_tracker(len(trackers))
+    tracker_addr = trackers[tracker_index]
     
     # --- Criação do socket UDP para comunicação com o tracker ---
     # Cria um socket UDP para enviar e receber mensagens do tracker.
@@ -587,24 +1771,24 @@ def main():
 
     # --- JOIN inicial com o Tracker ---
     # Envia uma mensagem JOIN para o tracker para se registrar na rede.
-    join_message = f"JOIN {my_ip} {my_tcp_port}"
     try:
-        logging.info(f"TRK1: Enviando JOIN para o tracker {tracker_addr}")
-        udp_sock.sendto(join_message.encode("utf-8"), tracker_addr)
-
-        # aqui entendo que 2048 seja suficiente, sabendo que pode haver muitos peers e dar erro por buffer overflow talvez?
-        # Recebe a resposta do tracker, que deve conter a lista de peers (PEERLIST).
-        data, _ = udp_sock.recvfrom(2048) # Buffer maior para a lista de peers.
-        response = data.decode("utf-8")
-        print("Lista de peeer recebida do trackr ", response)
-        
-        if response.startswith("PEERLIST"):
-            # Analisa a lista de peers recebida e atualiza os peers conhecidos.
-            initial_peers = parse_peer_list(response)
-            update_known_peers(initial_peers)
-            logging.info(f"TRK 2: Tracker respondeu: {len(initial_peers)} peers")
-        else:
-            logging.warning(f"Resposta inesperada do tracker após JOIN: {response}")
+        for attempt in range(len(trackers)):
+            logging.info(f"TRK1: Enviando JOIN para o tracker {tracker_addr}")
+            try:
+                initial_peers = initial_join(udp_sock, args.protocol)
+                break
+            except socket.timeout:
+                if attempt == len(trackers) - 1:
+                    raise
+                # Tracker fora do ar: tenta o próximo da lista.
+                tracker_index = (tracker_index + 1) % len(trackers)
+                logging.warning(f"Tracker {tracker_addr} não respondeu ao JOIN. Tentando {trackers[tracker_index]}.")
+                tracker_addr = trackers[tracker_index]
+        tracker_replied(tracker_addr) # O JOIN foi respondido; limpa o pedido pendente.
+
+        # Atualiza os peers conhecidos com a lista recebida.
+        update_known_peers(initial_peers)
+        logging.info(f"TRK 2: Tracker respondeu: {len(initial_peers)} peers (protocolo {tracker_protocol})")
 
     except socket.timeout:
         logging.error("Timeout esperando a resposta inicial do tracker após JOIN.")
@@ -620,8 +1804,8 @@ def main():
         udp_sock.close()
         return
     
-    # Se não for um seeder, precisa obter o tamanho total do arquivo de um peer.
-    if not is_seeder:
+    # Sem metainfo, o leecher precisa obter o tamanho total do arquivo de um peer.
+    if not is_seeder and content is None:
         # Tenta obter o tamanho do arquivo de um peer disponível.
         first_peer = next(iter(known_peers.values()), None)
         if not first_peer:
@@ -654,9 +1838,8 @@ def main():
               # Se for um seeder, todos os pedaços são marcados como possuídos.
               owned_pieces.update(range(total_pieces))
     else:
-         # TODO: Implementar verificação de pedaços para retomar downloads, se necessário.
-         logging.info("Iniciando download. Assumindo zero pedaços inicialmente.")
-         pass
+         # Só com o metainfo os pedaços já no arquivo são conferidos e retomados (ver acima).
+         logging.info(f"Iniciando download com {len(owned_pieces)} pedaços.")
 
 
     # --- Iniciar Threads ---
@@ -670,12 +1853,23 @@ def main():
         threads.append(tcp_server)
         tcp_server.start()
 
+        # Mantém vivas as conexões persistentes com os outros peers.
+        keepalive = threading.Thread(target=peer_keepalive_thread, name="PeerKeepalive", daemon=True)
+        threads.append(keepalive)
+        keepalive.start()
+
         # Thread de Atualização do Tracker
         # Inicia a thread que periodicamente envia atualizações para o tracker.
         tracker_updater = threading.Thread(target=tracker_update_thread, args=(udp_sock,), name="TrackerUpdate", daemon=True)
         threads.append(tracker_updater)
         tracker_updater.start()
 
+        # Thread de escuta do Tracker
+        # Recebe os pedidos de RESYNC do tracker.
+        tracker_listener = threading.Thread(target=tracker_listener_thread, args=(udp_sock,), name="TrackerListener", daemon=True)
+        threads.append(tracker_listener)
+        tracker_listener.start()
+
         # Gerenciador de Download (executa na thread principal ou em sua própria thread)
         # Running in main thread for simplicity here
         # Se não for um seeder, inicia o gerenciador de download.
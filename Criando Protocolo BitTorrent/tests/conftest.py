@@ -0,0 +1,22 @@
+import logging
+import os
+import sys
+
+import pytest
+
+# Os módulos do projeto ficam na pasta acima de tests/, sem pacote.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tracker_v3
+
+@pytest.fixture
+def tracker():
+    """O módulo do tracker com o estado global (enxames, expiração, cache de páginas) limpo."""
+    logging.disable(logging.CRITICAL)
+    tracker_v3.swarms.clear()
+    tracker_v3.sent_pages.clear()
+    tracker_v3.configure_shards(tracker_v3.peer_shards)
+    yield tracker_v3
+    tracker_v3.swarms.clear()
+    tracker_v3.sent_pages.clear()
+    logging.disable(logging.NOTSET)
@@ -0,0 +1,76 @@
+"""Protocolo binário: cada mensagem codificada volta igual ao ser decodificada."""
+
+import pytest
+
+import binary_protocol as bp
+
+INFO_HASH = bytes(range(20))
+
+def decode(message, msg_type):
+    decoded_type, body = bp.decode_header(message)
+    assert decoded_type == msg_type
+    return body
+
+@pytest.mark.parametrize("optional", [
+    {},
+    {"numwant": 50},
+    {"numwant": 50, "mtu": 1400},
+    {"numwant": 50, "mtu": 1400, "total_pieces": 70000},
+])
+def test_join(optional):
+    body = decode(bp.encode_join(INFO_HASH, 6881, **optional), bp.MSG_JOIN)
+    expected = (optional.get("numwant"), optional.get("mtu"), optional.get("total_pieces"))
+    assert bp.decode_join(body) == (INFO_HASH, 6881, *expected)
+
+def test_update_e_have():
+    bitfield = bp.pieces_to_bitfield({0, 7, 8, 100})
+    assert bp.decode_update(decode(bp.encode_update(INFO_HASH, 6881, bitfield), bp.MSG_UPDATE)) \
+        == (INFO_HASH, 6881, bitfield)
+    assert bp.bitfield_to_pieces(bitfield) == {0, 7, 8, 100}
+    assert bp.decode_have(decode(bp.encode_have(INFO_HASH, 6881, 42, [3, 70000]), bp.MSG_HAVE)) \
+        == (INFO_HASH, 6881, 42, [3, 70000])
+
+def test_peerlist_e_peerpage():
+    entries = [bp.encode_peer_entry("10.0.0.1", 6000, bp.pieces_to_bitfield({1, 2})),
+               bp.encode_peer_entry("10.0.0.2", 6001, b"")]
+    peers = bp.decode_peerlist(decode(bp.encode_peerlist(entries), bp.MSG_PEERLIST))
+    assert peers == [("10.0.0.1", 6000, bp.pieces_to_bitfield({1, 2})), ("10.0.0.2", 6001, b"")]
+    page = bp.decode_peerpage(decode(bp.encode_peerpage(7, 1, 3, entries), bp.MSG_PEERPAGE))
+    assert page == (7, 1, 3, peers)
+
+def test_entrada_maior_que_a_mtu_dividida_com_deslocamento():
+    # Bitfield de 7500 bytes, bem maior que uma MTU de 1400: vai em pedaços com deslocamento.
+    pieces = set(range(0, 60000, 3))
+    bitfield = bp.pieces_to_bitfield(pieces)
+    chunk = 1000
+    received = set()
+    for offset in range(0, len(bitfield), chunk):
+        message = bp.encode_peerpage(1, 0, 1, [bp.encode_peer_entry("10.0.0.1", 6000,
+                                                                    bitfield[offset:offset + chunk], offset)])
+        assert len(message) <= 1400
+        _, _, _, [(ip, port, part)] = bp.decode_peerpage(decode(message, bp.MSG_PEERPAGE))
+        assert (ip, port) == ("10.0.0.1", 6000)
+        received |= bp.bitfield_to_pieces(part)
+    assert received == pieces
+
+def test_resend_scrape_e_interval():
+    assert bp.decode_resend(decode(bp.encode_resend(9, [0, 4, 65535]), bp.MSG_RESEND)) == (9, [0, 4, 65535])
+    assert bp.decode_scrape(decode(bp.encode_scrape(INFO_HASH), bp.MSG_SCRAPE)) == INFO_HASH
+    assert tuple(bp.decode_interval(decode(bp.encode_interval(1800, 900), bp.MSG_INTERVAL))) == (1800, 900)
+
+@pytest.mark.parametrize("availability", [
+    [3, 1, 4, 1, 5, 9, 2, 6],           # Vetor: não compensa RLE.
+    [0] * 70000 + [2] * 10 + [1] * 500,  # RLE, com uma sequência maior que MAX_RUN.
+])
+def test_scrapeinfo(availability):
+    body = decode(bp.encode_scrapeinfo(4, 10, 25, availability), bp.MSG_SCRAPEINFO)
+    assert bp.decode_scrapeinfo(body) == (4, 10, 25, availability)
+
+def test_cabecalho_invalido_e_rejeitado():
+    message = bp.encode_scrape(INFO_HASH)
+    with pytest.raises(bp.ProtocolError):
+        bp.decode_header(bytes([0]) + message[1:])
+    with pytest.raises(bp.ProtocolError):
+        bp.decode_header(message[:1] + bytes([bp.VERSION + 1]) + message[2:])
+    with pytest.raises(bp.ProtocolError):
+        bp.decode_peerlist(bp.encode_peerlist([bp.encode_peer_entry("10.0.0.1", 6000, b"\xff" * 8)])[3:-1])
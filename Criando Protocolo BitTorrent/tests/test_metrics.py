@@ -0,0 +1,29 @@
+"""Métricas por thread, somadas na coleta."""
+
+import threading
+
+import tracker_metrics
+
+def test_contadores_de_varias_threads_sao_somados_na_coleta():
+    metrics = tracker_metrics.Metrics()
+
+    def worker():
+        for _ in range(100):
+            metrics.observe_message("HAVE", 0.0002)
+            metrics.count_response(10)
+        metrics.count_parse_error("JOIN")
+        metrics.observe_lock_wait(0.001)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert metrics.totals()[0] == 400
+    assert metrics.lock_wait_totals()[0] == 4
+    text = metrics.render()
+    assert 'tracker_messages_total{command="HAVE"} 400' in text
+    assert 'tracker_parse_errors_total{command="JOIN"} 4' in text
+    assert "tracker_responses_total 400" in text
+    assert "tracker_response_bytes_total 4000" in text
@@ -0,0 +1,23 @@
+"""Download de peers antigos (um pedaço inteiro por conexão) junto com o escalonador de blocos."""
+
+import peer_v3
+
+PEER = ("10.0.0.2", 6001)
+
+def test_falha_de_peer_antigo_mantem_blocos_de_outros_peers(monkeypatch):
+    monkeypatch.setattr(peer_v3, "total_pieces", 1)
+    monkeypatch.setattr(peer_v3, "owned_pieces", set())
+    monkeypatch.setattr(peer_v3, "get_piece_size", lambda piece_index: peer_v3.PIECE_SIZE)
+    monkeypatch.setattr(peer_v3, "download_piece", lambda *args: False)
+    scheduler = peer_v3.DownloadScheduler(udp_sock=None)
+    # O pedaço 0 já tem o bloco 0 recebido de outro peer, que caiu (nada pedido).
+    partial = scheduler.partial[0] = peer_v3.PartialPiece(peer_v3.PIECE_SIZE)
+    partial.data[:peer_v3.BLOCK_SIZE] = b"x" * peer_v3.BLOCK_SIZE
+    partial.received = 0b1
+
+    peer_info = {"ip": PEER[0], "tcp_port": PEER[1], "pieces": {0}}
+    assert peer_v3.download_legacy(scheduler, PEER, peer_info) is False
+    assert scheduler.partial[0] is partial
+    assert partial.received == 0b1
+    assert partial.data[:peer_v3.BLOCK_SIZE] == b"x" * peer_v3.BLOCK_SIZE
+    assert not partial.requested
@@ -0,0 +1,75 @@
+"""PEERLIST paginada: páginas dentro da MTU e entradas grandes divididas e juntadas."""
+
+import pytest
+
+import peer_v3
+
+INFO_HASH = bytes(20)
+MTU = 1400
+
+def seeder_swarm(tracker, total_pieces):
+    """Enxame com um seeder de `total_pieces` pedaços e um leecher que pede a lista."""
+    swarm = tracker.get_swarm(INFO_HASH)
+    seeder = tracker.register_peer(swarm, "10.0.0.1", 6000, total_pieces)
+    tracker.update_peer_pieces(swarm, seeder, (1 << total_pieces) - 1)
+    leecher = tracker.register_peer(swarm, "10.0.0.2", 6001, total_pieces)
+    return swarm, leecher
+
+def assemble(datagrams):
+    """Junta as páginas como o peer faz e retorna o dicionário de peers."""
+    assembler = peer_v3.PeerlistAssembler()
+    peers = None
+    for datagram in datagrams:
+        page = peer_v3.parse_peer_page(datagram)
+        assert page is not None
+        peers = assembler.add(*page) or peers
+    return peers
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_entrada_maior_que_a_mtu_e_dividida_sem_perder_pedacos(tracker, binary):
+    total_pieces = 60000 # Bitfield de 7500 bytes; em texto, ~350 KB.
+    swarm, leecher = seeder_swarm(tracker, total_pieces)
+    response_id, datagrams = tracker.build_peer_list(swarm, leecher, binary=binary, mtu=MTU)
+    assert response_id is not None
+    assert all(len(datagram) <= MTU for datagram in datagrams)
+    peers = assemble(datagrams)
+    assert peers["10.0.0.1:6000"]["pieces"] == set(range(total_pieces))
+
+class FakeSocket:
+    """Socket UDP que só guarda o que foi enviado."""
+
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append((data, addr))
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_pagina_perdida_e_pedida_de_novo_com_resend(tracker, monkeypatch, binary):
+    total_pieces = 30000 # Várias páginas também no binário.
+    swarm, leecher = seeder_swarm(tracker, total_pieces)
+    peer_addr = ("10.0.0.2", 7001)
+    tracker_sock = FakeSocket()
+    tracker.send_peer_list(tracker_sock, peer_addr, swarm, leecher, 50, binary=binary, mtu=MTU)
+    datagrams = [data for data, _ in tracker_sock.sent]
+    assert len(datagrams) >= 3
+
+    # A página 1 se perde; as outras chegam e a resposta fica incompleta.
+    assembler = peer_v3.PeerlistAssembler()
+    for index, datagram in enumerate(datagrams):
+        if index != 1:
+            assert assembler.add(*peer_v3.parse_peer_page(datagram)) is None
+
+    monkeypatch.setattr(peer_v3, "PAGE_TIMEOUT", 0.0)
+    monkeypatch.setattr(peer_v3, "tracker_addr", ("10.0.0.100", 5000))
+    peer_sock = FakeSocket()
+    assert assembler.request_missing(peer_sock)
+    [(resend, _)] = peer_sock.sent
+
+    tracker_sock.sent.clear()
+    tracker.process_datagram(resend, peer_addr, tracker_sock)
+    [(page, addr)] = tracker_sock.sent
+    assert addr == peer_addr and page == datagrams[1]
+    peers = assembler.add(*peer_v3.parse_peer_page(page))
+    assert peers["10.0.0.1:6000"]["pieces"] == set(range(total_pieces))
+    assert not assembler.request_missing(peer_sock)
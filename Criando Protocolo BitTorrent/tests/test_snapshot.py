@@ -0,0 +1,57 @@
+"""Snapshot do tracker: log em disco e restauração na inicialização."""
+
+import tracker_snapshot
+
+def test_snapshot_invalido_e_guardado_em_vez_de_sobrescrito(tracker, tmp_path, monkeypatch):
+    monkeypatch.setattr(tracker, "snapshot_thread", lambda log: None)
+    path = tmp_path / "estado.snap"
+    path.write_bytes(b"arquivo do usuario, nao um snapshot")
+    tracker.start_snapshot(str(path))
+    try:
+        corrupt = tmp_path / ("estado.snap" + tracker.SNAPSHOT_CORRUPT_SUFFIX)
+        assert corrupt.read_bytes() == b"arquivo do usuario, nao um snapshot"
+        assert path.read_bytes().startswith(tracker_snapshot.MAGIC)
+    finally:
+        tracker.stop_snapshot()
+        tracker.snapshot_log = None
+
+def test_log_acrescentado_e_compactado_volta_ao_mesmo_estado(tracker, tmp_path, monkeypatch):
+    log = tracker_snapshot.SnapshotLog(str(tmp_path / "estado.snap"))
+    monkeypatch.setattr(tracker, "snapshot_log", log) # Liga a marcação dos peers alterados.
+    monkeypatch.setattr(tracker, "dirty_peers", set())
+    info_hash = bytes(20)
+    swarm = tracker.get_swarm(info_hash)
+    seeder = tracker.register_peer(swarm, "10.0.0.1", 6000, total_pieces=8)
+    tracker.update_peer_pieces(swarm, seeder, 0xFF)
+    leecher = tracker.register_peer(swarm, "10.0.0.2", 6001, total_pieces=8)
+    tracker.update_peer_pieces(swarm, leecher, 0b101)
+    gone = tracker.register_peer(swarm, "10.0.0.3", 6002, total_pieces=8)
+    try:
+        tracker.write_snapshot(log)
+        swarm.remove_peer(gone)
+        tracker.mark_dirty(info_hash, gone)
+        tracker.write_snapshot(log)
+        expected = {(info_hash, "10.0.0.1", 6000): 0xFF, (info_hash, "10.0.0.2", 6001): 0b101}
+        assert tracker_snapshot.read_log(log.path)[0] == expected
+
+        appended_size = log.size()
+        tracker.compact_snapshot(log)
+        assert log.size() < appended_size
+        state, swarm_info = tracker_snapshot.read_log(log.path)
+        assert state == expected
+        assert swarm_info == {info_hash: (8, swarm.completed)}
+
+        # Depois da compactação o log continua recebendo alterações.
+        tracker.update_peer_pieces(swarm, leecher, 0b111)
+        tracker.write_snapshot(log)
+    finally:
+        log.close()
+    expected[(info_hash, "10.0.0.2", 6001)] = 0b111
+    assert tracker_snapshot.read_log(log.path)[0] == expected
+
+    tracker.swarms.clear()
+    assert tracker.load_snapshot(log.path) == 2
+    restored = tracker.get_swarm(info_hash, create=False)
+    assert restored.get_peer(seeder).pieces == 0xFF
+    assert restored.get_peer(leecher).pieces == 0b111
+    assert restored.get_peer(gone) is None
@@ -0,0 +1,26 @@
+"""Expiração dos peers com o prazo do intervalo adaptativo."""
+
+import time
+
+INFO_HASH = bytes(20)
+
+def test_prazo_reduzido_vale_para_peers_ja_agendados(tracker, monkeypatch):
+    monkeypatch.setattr(tracker.interval_controller, "timeout", 600.0)
+    swarm = tracker.get_swarm(INFO_HASH)
+    peer_id = tracker.register_peer(swarm, "10.0.0.1", 6000)
+    now = time.time()
+    assert tracker.expire_peers(now + 120) == 0
+
+    # O intervalo de anúncio caiu: o peer que não anuncia há 120 s já passou do prazo.
+    monkeypatch.setattr(tracker.interval_controller, "timeout", 60.0)
+    assert tracker.expire_peers(now + 120) == 1
+    assert swarm.get_peer(peer_id) is None
+
+def test_peer_que_anunciou_e_reagendado(tracker, monkeypatch):
+    monkeypatch.setattr(tracker.interval_controller, "timeout", 60.0)
+    swarm = tracker.get_swarm(INFO_HASH)
+    peer_id = tracker.register_peer(swarm, "10.0.0.1", 6000)
+    now = time.time()
+    swarm.get_peer(peer_id).last_update = now + 50
+    assert tracker.expire_peers(now + 100) == 0
+    assert tracker.expire_peers(now + 111) == 1
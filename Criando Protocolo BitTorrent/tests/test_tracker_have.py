@@ -0,0 +1,45 @@
+"""Sequência dos HAVEs: pedaços novos, sinais de vida e buracos (RESYNC)."""
+
+INFO_HASH = bytes(20)
+
+def join(tracker, port=6000):
+    swarm = tracker.get_swarm(INFO_HASH)
+    return swarm, tracker.register_peer(swarm, "10.0.0.1", port, total_pieces=8)
+
+def test_have_em_sequencia_aplica_os_pedacos(tracker):
+    swarm, peer_id = join(tracker)
+    assert tracker.apply_have(INFO_HASH, peer_id, 1, 0b1) == tracker.HAVE_OK
+    assert tracker.apply_have(INFO_HASH, peer_id, 2, 0b110) == tracker.HAVE_OK
+    record = swarm.get_peer(peer_id)
+    assert record.pieces == 0b111
+    assert record.seq == 2
+
+def test_sinal_de_vida_com_a_sequencia_atual_nao_pede_resync(tracker):
+    swarm, peer_id = join(tracker)
+    tracker.apply_have(INFO_HASH, peer_id, 1, 0b1)
+    assert tracker.apply_have(INFO_HASH, peer_id, 1, 0) != tracker.HAVE_RESYNC
+    assert swarm.get_peer(peer_id).seq == 1
+
+def test_have_perdido_seguido_de_sinal_de_vida_pede_resync(tracker):
+    # O HAVE 2 se perdeu; o sinal de vida seguinte repete a sequência 2 sem pedaços.
+    swarm, peer_id = join(tracker)
+    assert tracker.apply_have(INFO_HASH, peer_id, 1, 0b1) == tracker.HAVE_OK
+    assert tracker.apply_have(INFO_HASH, peer_id, 2, 0) == tracker.HAVE_RESYNC
+    record = swarm.get_peer(peer_id)
+    assert record.pieces == 0b1
+    assert record.seq == 1
+
+def test_buraco_com_pedacos_pede_resync(tracker):
+    swarm, peer_id = join(tracker)
+    tracker.apply_have(INFO_HASH, peer_id, 1, 0b1)
+    assert tracker.apply_have(INFO_HASH, peer_id, 3, 0b100) == tracker.HAVE_RESYNC
+    assert swarm.get_peer(peer_id).pieces == 0b1
+
+def test_have_repetido_e_ignorado(tracker):
+    swarm, peer_id = join(tracker)
+    tracker.apply_have(INFO_HASH, peer_id, 1, 0b1)
+    assert tracker.apply_have(INFO_HASH, peer_id, 1, 0b1) == tracker.HAVE_OK
+    assert swarm.get_peer(peer_id).seq == 1
+
+def test_have_de_peer_desconhecido_pede_resync(tracker):
+    assert tracker.apply_have(INFO_HASH, "10.0.0.9:1", 1, 0b1) == tracker.HAVE_RESYNC
@@ -0,0 +1,942 @@
+#!/usr/bin/env python3
+
+import socket
+import threading
+import time
+import argparse
+import random
+import logging
+import asyncio
+import os
+import sys
+import selectors
+import subprocess
+import multiprocessing
+import tracemalloc
+import tempfile
+from collections import deque
+
+import tracker_v3
+import binary_protocol
+import tracker_snapshot
+import tracker_ratelimit
+import tracker_interval
+
+# --- Configuração ---
+BENCH_HOST = '127.0.0.1' # O tracker do benchmark escuta apenas localmente.
+DRAIN_TIMEOUT = 2.0      # Segundos sem novas mensagens processadas para considerar a fila esvaziada.
+RESPONSE_TIMEOUT = 1.0   # Segundos até considerar uma requisição do teste de escala perdida.
+# ---------------------
+
+def free_udp_port():
+    """Obtém uma porta UDP livre pedindo ao sistema operacional uma porta efêmera."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind((BENCH_HOST, 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def populate_swarm(num_peers, num_pieces, info_hash=tracker_v3.DEFAULT_INFO_HASH):
+    """Preenche diretamente um enxame do tracker com peers simulados e o retorna.
+    Evita passar N JOINs pela rede só para montar o enxame inicial.
+    """
+    now = time.time()
+    swarm = tracker_v3.Swarm(info_hash)
+    swarm.set_total_pieces(num_pieces)
+    items = []
+    for i in range(num_peers):
+        port = 20000 + i
+        owned = random.sample(range(num_pieces), random.randint(0, num_pieces))
+        items.append((f"{BENCH_HOST}:{port}", tracker_v3.PeerRecord(
+            BENCH_HOST, port, binary_protocol.pieces_to_mask(owned), now)))
+    swarm.add_peers(items)
+    with tracker_v3.swarms_lock:
+        tracker_v3.swarms[info_hash] = swarm
+    return swarm
+
+class LatencyProbe:
+    """Mede o tempo entre o envio de um UPDATE e o fim do seu processamento no tracker.
+    Envolve `tracker_v3.handle_udp_message`, que os dois modos chamam pelo nome do módulo.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent_at = {}    # { datagrama: deque(instantes de envio) }
+        self.latencies = []
+        self.last_done = 0.0
+        self.original = tracker_v3.handle_udp_message
+
+    def record_send(self, data):
+        with self.lock:
+            self.sent_at.setdefault(data, deque()).append(time.perf_counter())
+
+    def wrapped_handler(self, data, addr, sock):
+        self.original(data, addr, sock)
+        done = time.perf_counter()
+        with self.lock:
+            pending = self.sent_at.get(data)
+            if pending:
+                self.latencies.append(done - pending.popleft())
+            self.last_done = done
+
+    def install(self):
+        tracker_v3.handle_udp_message = self.wrapped_handler
+
+    def uninstall(self):
+        tracker_v3.handle_udp_message = self.original
+
+def start_tracker_thread(mode, port, workers):
+    """Executa o tracker no modo escolhido em uma thread daemon."""
+    if mode == "asyncio":
+        target = lambda: asyncio.run(tracker_v3.serve_async(BENCH_HOST, port, workers))
+    else:
+        target = lambda: tracker_v3.start_tracker(BENCH_HOST, port)
+    thread = threading.Thread(target=target, name="BenchTracker", daemon=True)
+    thread.start()
+    time.sleep(0.5) # Dá tempo para o socket ser vinculado.
+    return thread
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+def run_benchmark(args):
+    """Envia anúncios ao tracker e mede vazão sustentada e latência de processamento."""
+    # Os logs por mensagem do tracker distorceriam a medição.
+    logging.disable(logging.CRITICAL)
+    populate_swarm(args.peers, args.pieces)
+    probe = LatencyProbe()
+    probe.install()
+    port = free_udp_port()
+    start_tracker_thread(args.mode, port, args.async_workers)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    tracker_addr = (BENCH_HOST, port)
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    next_join_port = 20000 + args.peers
+    updates_sent = 0
+    joins_sent = 0
+
+    start = time.perf_counter()
+    for i in range(args.announces):
+        if random.random() < args.join_ratio:
+            # JOIN de um peer novo: força o tracker a montar a lista de peers inteira.
+            message = f"JOIN {BENCH_HOST} {next_join_port}".encode("utf-8")
+            next_join_port += 1
+            joins_sent += 1
+        else:
+            # UPDATE de um peer já conhecido, com o estado de pedaços um pouco diferente a cada vez.
+            port_index = random.randrange(args.peers)
+            owned = random.sample(range(args.pieces), random.randint(0, min(args.pieces, 20)))
+            pieces_str = ",".join(map(str, sorted(owned)))
+            message = f"UPDATE {20000 + port_index} [{pieces_str}]".encode("utf-8")
+            probe.record_send(message)
+            updates_sent += 1
+        sock.sendto(message, tracker_addr)
+        if interval:
+            # Mantém a taxa de envio alvo sem acumular atraso.
+            delay = start + (i + 1) * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    send_done = time.perf_counter()
+
+    # Espera o tracker terminar de processar o que ainda está na fila.
+    while True:
+        time.sleep(0.2)
+        with probe.lock:
+            idle = time.perf_counter() - max(probe.last_done, send_done)
+        if idle > DRAIN_TIMEOUT:
+            break
+    probe.uninstall()
+    sock.close()
+
+    with probe.lock:
+        latencies = sorted(probe.latencies)
+        elapsed = max(probe.last_done, send_done) - start
+    processed = len(latencies)
+    print(f"Modo: {args.mode} | Peers: {args.peers} | Pedaços: {args.pieces}")
+    print(f"Enviados: {updates_sent} UPDATE, {joins_sent} JOIN em {send_done - start:.2f}s")
+    print(f"UPDATEs processados: {processed} ({updates_sent - processed} perdidos)")
+    print(f"Vazão sustentada: {processed / elapsed:.0f} anúncios/s")
+    print(f"Latência p50: {percentile(latencies, 0.50) * 1000:.2f} ms | "
+          f"p99: {percentile(latencies, 0.99) * 1000:.2f} ms | "
+          f"máx: {(latencies[-1] if latencies else 0.0) * 1000:.2f} ms")
+
+def scale_client(port, num_peers, first_tcp_port, duration, results):
+    """Processo cliente do teste de escala.
+    Cada peer virtual tem seu próprio socket UDP (porta de origem distinta, o que faz o
+    SO_REUSEPORT espalhar os peers entre os processos do tracker) e mantém exatamente
+    um JOIN em andamento por vez.
+    """
+    tracker_addr = (BENCH_HOST, port)
+    selector = selectors.DefaultSelector()
+    sent_at = {}
+    for i in range(num_peers):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        message = f"JOIN {BENCH_HOST} {first_tcp_port + i}".encode("utf-8")
+        selector.register(sock, selectors.EVENT_READ, message)
+        sock.sendto(message, tracker_addr)
+        sent_at[sock] = time.perf_counter()
+
+    responses = 0
+    lost = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        for key, _ in selector.select(timeout=0.1):
+            sock = key.fileobj
+            try:
+                sock.recvfrom(65535)
+            except OSError:
+                continue
+            responses += 1
+            sock.sendto(key.data, tracker_addr)
+            sent_at[sock] = time.perf_counter()
+        # Reenvia as requisições cuja resposta não chegou a tempo.
+        now = time.perf_counter()
+        for sock, sent in sent_at.items():
+            if now - sent > RESPONSE_TIMEOUT:
+                lost += 1
+                sock.sendto(selector.get_key(sock).data, tracker_addr)
+                sent_at[sock] = now
+    results.put((responses, lost))
+
+def run_scale_benchmark(args):
+    """Mede a vazão de JOINs respondidos pelo tracker rodando com --workers N."""
+    port = free_udp_port()
+    tracker_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tracker_v3.py")
+    tracker = subprocess.Popen([sys.executable, tracker_script, "--host", BENCH_HOST, "--port", str(port),
+                                "--workers", str(args.workers), "--mode", args.mode, "--log-level", "ERROR",
+                                # Todos os peers virtuais saem de BENCH_HOST; aqui se mede a vazão sem limite.
+                                "--rate-limit-ip", "0", "--rate-limit-global", "0"])
+    try:
+        time.sleep(1.0) # Dá tempo para os processos vincularem a porta.
+        results = multiprocessing.Queue()
+        clients = []
+        for c in range(args.clients):
+            first_tcp_port = 20000 + c * args.peers_per_client
+            client = multiprocessing.Process(target=scale_client,
+                                             args=(port, args.peers_per_client, first_tcp_port, args.duration, results))
+            client.start()
+            clients.append(client)
+        totals = [results.get() for _ in clients]
+        for client in clients:
+            client.join()
+    finally:
+        tracker.terminate()
+        tracker.wait()
+
+    responses = sum(r for r, _ in totals)
+    lost = sum(l for _, l in totals)
+    print(f"Processos do tracker: {args.workers} | Modo: {args.mode} | "
+          f"Peers virtuais: {args.clients * args.peers_per_client}")
+    print(f"JOINs respondidos: {responses} em {args.duration:.0f}s ({lost} sem resposta)")
+    print(f"Vazão: {responses / args.duration:.0f} anúncios/s")
+
+def time_call(func, *args, repeat=5):
+    """Retorna o menor tempo (em segundos) entre `repeat` execuções de func(*args)."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def run_protocol_benchmark(args):
+    """Compara o protocolo de texto e o binário: bytes no fio e tempo de análise no peer."""
+    import peer_v3
+    logging.disable(logging.CRITICAL)
+
+    swarm = populate_swarm(args.peers, args.pieces)
+    text_list = tracker_v3.format_peer_list(swarm).encode("utf-8")
+    binary_list = tracker_v3.format_binary_peer_list(swarm)
+    _, binary_body = binary_protocol.decode_header(binary_list)
+
+    seeder = range(args.pieces)
+    text_update = f"UPDATE 6001 [{','.join(map(str, seeder))}]".encode("utf-8")
+    binary_update = binary_protocol.encode_update(swarm.info_hash, 6001, binary_protocol.pieces_to_bitfield(seeder))
+
+    text_parse = time_call(lambda: peer_v3.parse_peer_list(text_list.decode("utf-8")))
+    binary_parse = time_call(peer_v3.parse_binary_peer_list, binary_body)
+    text_format = time_call(tracker_v3.format_peer_list, swarm)
+    binary_format = time_call(tracker_v3.format_binary_peer_list, swarm)
+
+    print(f"Peers: {args.peers} | Pedaços: {args.pieces}")
+    print(f"{'':22}{'texto':>14}{'binário':>14}")
+    print(f"{'UPDATE de seeder':22}{len(text_update):>12} B{len(binary_update):>12} B")
+    print(f"{'PEERLIST':22}{len(text_list):>12} B{len(binary_list):>12} B")
+    print(f"{'Montagem (tracker)':22}{text_format * 1000:>11.2f} ms{binary_format * 1000:>11.2f} ms")
+    print(f"{'Análise (peer)':22}{text_parse * 1000:>11.2f} ms{binary_parse * 1000:>11.2f} ms")
+
+def random_owned_pieces(num_pieces, fill):
+    """Pedaços de um peer simulado: cada pedaço presente com probabilidade `fill`."""
+    return [i for i in range(num_pieces) if random.random() < fill]
+
+def measure_swarm_memory(num_peers, build_entry, num_pieces, fill):
+    """Bytes alocados por peer (tracemalloc) para montar uma tabela de peers com `build_entry`."""
+    # Os pedaços dos peers são gerados antes da medição para contar só a estrutura final.
+    owned = [random_owned_pieces(num_pieces, fill) for _ in range(min(num_peers, 1000))]
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    db = {}
+    for i in range(num_peers):
+        port = 20000 + i % 40000
+        ip = f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+        db[f"{ip}:{port}"] = build_entry(ip, port, owned[i % len(owned)])
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before) / num_peers
+
+def legacy_entry(ip, port, owned):
+    """Registro no formato antigo: dict com set de ints."""
+    return {'ip': ip, 'tcp_port': port, 'pieces': set(owned), 'last_update': time.time()}
+
+def record_entry(ip, port, owned):
+    """Registro atual: PeerRecord com máscara de bits."""
+    return tracker_v3.PeerRecord(ip, port, binary_protocol.pieces_to_mask(owned), time.time())
+
+def run_memory_benchmark(args):
+    """Compara a memória por peer do registro antigo (dict + set) e do PeerRecord."""
+    print(f"Pedaços: {args.pieces} | Preenchimento médio: {args.fill:.0%}")
+    print(f"{'peers':>8}{'dict+set (B/peer)':>20}{'PeerRecord (B/peer)':>22}")
+    for num_peers in args.peer_counts:
+        new = measure_swarm_memory(num_peers, record_entry, args.pieces, args.fill)
+        if num_peers <= args.legacy_max_peers:
+            old = f"{measure_swarm_memory(num_peers, legacy_entry, args.pieces, args.fill):.0f}"
+        else:
+            old = "-" # O formato antigo não cabe na memória com tantos peers.
+        print(f"{num_peers:>8}{old:>20}{new:>22.0f}")
+
+    # Operações em massa sobre as máscaras.
+    records = [record_entry("10.0.0.1", 20000 + i, random_owned_pieces(args.pieces, args.fill))
+               for i in range(1000)]
+    union = time_call(tracker_v3.pieces_union, records)
+    popcount = time_call(lambda: sum(r.piece_count() for r in records))
+    diff = time_call(lambda: [tracker_v3.pieces_missing(r, records[0]) for r in records])
+    print(f"1000 peers: união {union * 1000:.2f} ms | popcount {popcount * 1000:.2f} ms | "
+          f"diferença {diff * 1000:.2f} ms")
+
+def clear_fragment_cache(swarm):
+    """Descarta as entradas serializadas da PEERLIST de todos os peers do enxame."""
+    for _, record in swarm.records():
+        record.text_fragment = None
+        record.binary_fragment = None
+
+def run_peerlist_benchmark(args):
+    """Custo de montar a PEERLIST de um JOIN com e sem as entradas em cache.
+    Sem cache cada JOIN serializa os pedaços de todos os peers (O(peers x pedaços));
+    com cache só concatena as entradas prontas dos peers que não mudaram.
+    """
+    logging.disable(logging.CRITICAL)
+    print(f"Pedaços: {args.pieces} | JOINs por medição: {args.joins}")
+    print(f"{'peers':>8}{'sem cache (ms/JOIN)':>22}{'com cache (ms/JOIN)':>22}")
+    for num_peers in args.peer_counts:
+        swarm = populate_swarm(num_peers, args.pieces)
+        format_list = tracker_v3.format_binary_peer_list if args.binary else tracker_v3.format_peer_list
+
+        def cold_joins():
+            for _ in range(args.joins):
+                clear_fragment_cache(swarm)
+                format_list(swarm)
+
+        def warm_joins():
+            for _ in range(args.joins):
+                format_list(swarm)
+
+        format_list(swarm) # Preenche o cache.
+        cold = time_call(cold_joins, repeat=1) / args.joins
+        warm = time_call(warm_joins, repeat=1) / args.joins
+        print(f"{num_peers:>8}{cold * 1000:>22.2f}{warm * 1000:>22.2f}")
+
+def legacy_scan(swarm, now):
+    """Limpeza antiga: varre todos os peers do enxame a cada verificação, sob o lock de cada partição."""
+    removed = 0
+    for shard in swarm.shards:
+        with shard.lock:
+            inactive_peers = [peer_id for peer_id, record in shard.peers.items()
+                              if now - record.last_update > tracker_v3.interval_controller.peer_timeout()]
+            for peer_id in inactive_peers:
+                del shard.peers[peer_id]
+            removed += len(inactive_peers)
+    return removed
+
+def build_expiry_swarm(num_peers, now, schedule):
+    """Enxame com os anúncios espalhados uniformemente pela última janela de PEER_TIMEOUT."""
+    tracker_v3.swarms.clear()
+    tracker_v3.configure_shards(tracker_v3.peer_shards)
+    swarm = tracker_v3.get_swarm(tracker_v3.DEFAULT_INFO_HASH)
+    for i in range(num_peers):
+        record = tracker_v3.PeerRecord(BENCH_HOST, 20000 + i, 0, now - random.uniform(0, tracker_v3.interval_controller.peer_timeout()))
+        peer_id = f"{BENCH_HOST}:{20000 + i}"
+        swarm.add_peer(peer_id, record)
+        if schedule:
+            tracker_v3.schedule_expiry(swarm, peer_id, record)
+    return swarm
+
+def run_expiry_benchmark(args):
+    """Varredura completa a cada PEER_TIMEOUT/2 vs heap de expiração a cada EXPIRY_TICK.
+    Simula uma janela de PEER_TIMEOUT segundos; uma fração `alive` dos peers continua
+    anunciando (o heap precisa reagendá-los), o resto morre e precisa ser removido.
+    """
+    logging.disable(logging.CRITICAL)
+    timeout = tracker_v3.interval_controller.peer_timeout()
+    tick = tracker_v3.EXPIRY_TICK
+    now = time.time()
+    print(f"Peers: {args.peers} | Vivos: {args.alive:.0%} | prazo: {timeout:.0f}s | EXPIRY_TICK: {tick}s")
+
+    # Varredura: cada verificação percorre a tabela inteira segurando os locks das partições.
+    swarm = build_expiry_swarm(args.peers, now, schedule=False)
+    alive = random.sample([record for _, record in swarm.records()], int(args.peers * args.alive))
+    scans = []
+    for step in range(1, 3):
+        at = now + step * timeout / 2
+        for record in alive:
+            record.last_update = at
+        start = time.perf_counter()
+        removed = legacy_scan(swarm, at)
+        scans.append((time.perf_counter() - start, removed))
+    scan_time = max(elapsed for elapsed, _ in scans)
+    print(f"{'varredura':>10}: {len(scans)} verificações, {sum(r for _, r in scans)} removidos, "
+          f"lock seguro por {scan_time * 1000:.1f} ms em cada, peer morto fica até {timeout * 1.5:.0f}s")
+
+    # Heap: cada verificação só toca as entradas vencidas.
+    swarm = build_expiry_swarm(args.peers, now, schedule=True)
+    alive = random.sample([record for _, record in swarm.records()], int(args.peers * args.alive))
+    for record in alive:
+        record.last_update = now # Entradas do heap ficam obsoletas e precisam ser reagendadas.
+    ticks = []
+    for step in range(1, int(timeout / tick) + 1):
+        at = now + step * tick
+        for record in alive[step % 10::10]: # Os vivos anunciam em rodízio.
+            record.last_update = at
+        start = time.perf_counter()
+        removed = tracker_v3.expire_peers(at)
+        ticks.append((time.perf_counter() - start, removed))
+    worst = max(elapsed for elapsed, _ in ticks)
+    mean = sum(elapsed for elapsed, _ in ticks) / len(ticks)
+    print(f"{'heap':>10}: {len(ticks)} verificações, {sum(r for _, r in ticks)} removidos, "
+          f"{mean * 1000:.1f} ms em média (pior {worst * 1000:.1f} ms) com o lock segurado "
+          f"por entrada, peer morto fica até {timeout + tick:.0f}s")
+
+def run_snapshot_benchmark(args):
+    """Custo do snapshot em disco: gravação incremental, compactação e recarga no reinício."""
+    logging.disable(logging.CRITICAL)
+    per_swarm = args.peers // args.swarms
+    tracker_v3.swarms.clear()
+    tracker_v3.configure_shards(tracker_v3.peer_shards)
+    hashes = [i.to_bytes(binary_protocol.INFO_HASH_SIZE, "big") for i in range(args.swarms)]
+    for info_hash in hashes:
+        populate_swarm(per_swarm, args.pieces, info_hash)
+    total = per_swarm * args.swarms
+    print(f"Peers: {total} | Enxames: {args.swarms} | Pedaços: {args.pieces}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "tracker.snap")
+        log = tracker_snapshot.SnapshotLog(path)
+        tracker_v3.snapshot_log = log
+        compact = time_call(tracker_v3.compact_snapshot, log, repeat=1)
+        print(f"Compactação: {compact * 1000:.0f} ms, {log.size() / 1e6:.1f} MB")
+
+        # Gravação incremental: uma fração dos peers anunciou desde a última gravação.
+        for info_hash in hashes:
+            swarm = tracker_v3.swarms[info_hash]
+            for peer_id in random.sample([peer_id for peer_id, _ in swarm.records()], int(per_swarm * args.dirty)):
+                tracker_v3.mark_dirty(info_hash, peer_id)
+        dirty = len(tracker_v3.dirty_peers)
+        append = time_call(tracker_v3.write_snapshot, log, repeat=1)
+        print(f"Gravação de {dirty} peers alterados: {append * 1000:.0f} ms")
+        log.close()
+        tracker_v3.snapshot_log = None
+
+        tracker_v3.swarms.clear()
+        tracker_v3.configure_shards(tracker_v3.peer_shards)
+        start = time.perf_counter()
+        restored = tracker_v3.load_snapshot(path)
+        print(f"Recarga no reinício: {restored} peers em {(time.perf_counter() - start) * 1000:.0f} ms")
+
+def recompute_scrape(swarm):
+    """SCRAPE sem estatísticas incrementais: percorre todos os peers a cada pedido."""
+    records = [record for _, record in swarm.records()]
+    full = (1 << swarm.total_pieces) - 1
+    seeders = sum(1 for record in records if record.pieces == full)
+    availability = [0] * swarm.total_pieces
+    for record in records:
+        for index in binary_protocol.mask_to_pieces(record.pieces):
+            availability[index] += 1
+    return seeders, len(records) - seeders, availability
+
+def run_scrape_benchmark(args):
+    """Custo de um SCRAPE recalculado a cada pedido vs estatísticas incrementais, e o
+    custo extra que as estatísticas adicionam a cada HAVE.
+    """
+    logging.disable(logging.CRITICAL)
+    sock = CountingSocket()
+    print(f"Pedaços: {args.pieces}")
+    print(f"{'peers':>8}{'recalculado (ms)':>18}{'incremental (ms)':>18}{'em cache (us)':>15}{'HAVE (us)':>11}")
+    for num_peers in args.peer_counts:
+        swarm = populate_swarm(num_peers, args.pieces)
+        message = f"SCRAPE swarm={swarm.info_hash.hex()}".encode("utf-8")
+        recompute = time_call(recompute_scrape, swarm, repeat=1)
+
+        def changed_scrape():
+            swarm.total_version += 1 # Força a montagem da resposta, como depois de um anúncio.
+            tracker_v3.handle_udp_message(message, (BENCH_HOST, 9999), sock)
+
+        incremental = time_call(changed_scrape)
+        cached = time_call(lambda: [tracker_v3.handle_udp_message(message, (BENCH_HOST, 9999), sock)
+                                    for _ in range(1000)]) / 1000
+
+        # HAVE de um pedaço por peer: inclui o ajuste da disponibilidade.
+        peer_ids = [peer_id for peer_id, _ in swarm.records()]
+        haves = [(f"HAVE {peer_id.rsplit(':', 1)[1]} 1 [{random.randrange(args.pieces)}] "
+                  f"swarm={swarm.info_hash.hex()}").encode("utf-8") for peer_id in peer_ids[:1000]]
+        start = time.perf_counter()
+        for have in haves:
+            tracker_v3.handle_udp_message(have, (BENCH_HOST, 9999), sock)
+        have_cost = (time.perf_counter() - start) / len(haves)
+        print(f"{num_peers:>8}{recompute * 1000:>18.2f}{incremental * 1000:>18.3f}"
+              f"{cached * 1e6:>15.1f}{have_cost * 1e6:>11.1f}")
+
+def run_rarity_benchmark(args):
+    """Escolha de pedaço no peer: raridade recalculada a partir dos peers conhecidos vs
+    a disponibilidade servida pelo tracker, e o tamanho do SCRAPEINFO que a transporta.
+    """
+    import peer_v3
+    logging.disable(logging.CRITICAL)
+    peer_v3.total_pieces = args.pieces
+    print(f"Pedaços: {args.pieces}")
+    print(f"{'peers':>8}{'recalculada (ms)':>18}{'do tracker (ms)':>17}"
+          f"{'vetor (B)':>11}{'RLE (B)':>9}{'texto (B)':>11}")
+    for num_peers in args.peer_counts:
+        swarm = populate_swarm(num_peers, args.pieces)
+        peer_v3.known_peers = {
+            peer_id: {"ip": record.ip, "tcp_port": record.tcp_port,
+                      "pieces": binary_protocol.mask_to_pieces(record.pieces)}
+            for peer_id, record in swarm.records()}
+
+        peer_v3.tracker_availability = None
+        recompute = time_call(peer_v3.calculate_rarity)
+        peer_v3.tracker_availability = swarm.stats()[3][:args.pieces]
+        peer_v3.availability_updated = time.monotonic()
+        served = time_call(peer_v3.calculate_rarity)
+
+        # Tamanhos da resposta: a codificação binária escolhe a menor entre vetor e RLE.
+        availability = swarm.stats()[3][:args.pieces]
+        vector = binary_protocol.HEADER.size + binary_protocol.SCRAPE_INFO.size + 2 * len(availability)
+        rle = (binary_protocol.HEADER.size + binary_protocol.SCRAPE_INFO.size + binary_protocol.COUNT_RUNS.size
+               + binary_protocol.RUN.size * len(binary_protocol.availability_runs(availability)))
+        text = len(tracker_v3.scrape_response(swarm.info_hash))
+        print(f"{num_peers:>8}{recompute * 1000:>18.2f}{served * 1000:>17.4f}"
+              f"{vector:>11}{rle:>9}{text:>11}")
+
+def run_ratelimit_benchmark(args):
+    """Limitador de taxa: um IP inundando o tracker junto com peers bem-comportados
+    (tempo simulado), o custo de cada verificação e a memória com origens sempre novas.
+    """
+    limiter = tracker_ratelimit.RateLimiter(args.per_ip, 2 * args.per_ip, args.global_rate,
+                                            2 * args.global_rate, args.max_sources)
+    # Tempo simulado: o inundador manda args.flood datagramas/s e cada peer normal, 1/s.
+    events = [(i / args.flood, "flood", "10.0.0.1") for i in range(int(args.flood * args.duration))]
+    for peer in range(args.peers):
+        ip = f"10.1.{peer >> 8}.{peer & 255}"
+        events.extend((second + random.random(), "peer", ip) for second in range(int(args.duration)))
+    events.sort()
+    accepted = {"flood": 0, "peer": 0}
+    sent = {"flood": 0, "peer": 0}
+    for now, kind, ip in events:
+        sent[kind] += 1
+        accepted[kind] += limiter.allow(ip, now)
+    print(f"Duração simulada: {args.duration:.0f}s | limite por IP: {args.per_ip}/s | global: {args.global_rate}/s")
+    for kind in ("flood", "peer"):
+        print(f"  {kind:>6}: {accepted[kind]}/{sent[kind]} aceitos")
+    print(f"  contadores: {limiter.stats()}")
+
+    # Custo por verificação: a mesma origem e origens sempre novas (LRU cheia, com despejo).
+    limiter = tracker_ratelimit.RateLimiter(1e9, 1e9, 1e9, 1e9, args.max_sources)
+    count = 200000
+    same = time_call(lambda: [limiter.allow("10.0.0.1") for _ in range(count)], repeat=1) / count
+    ips = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(count * 2)]
+    fresh = time_call(lambda: [limiter.allow(ip) for ip in ips], repeat=1) / len(ips)
+    print(f"Verificação: {same * 1e6:.2f} us (mesma origem), {fresh * 1e6:.2f} us (origens novas) | "
+          f"IPs guardados: {len(limiter.sources)} (máximo {args.max_sources}), esquecidos: {limiter.evicted}")
+
+def run_metrics_benchmark(args):
+    """Custo das métricas no caminho quente: o mesmo HAVE tratado direto e pelo
+    `process_datagram` (latência por comando + locks medidos), e o custo de uma coleta.
+    """
+    logging.disable(logging.CRITICAL)
+    sock = CountingSocket()
+    swarm = populate_swarm(args.peers, args.pieces)
+    peer_ids = [peer_id for peer_id, _ in swarm.records()][:args.messages]
+    haves = [(f"HAVE {peer_id.rsplit(':', 1)[1]} 0 [] swarm={swarm.info_hash.hex()}").encode("utf-8")
+             for peer_id in peer_ids]
+    addr = (BENCH_HOST, 9999)
+
+    def direct():
+        for have in haves:
+            tracker_v3.handle_udp_message(have, addr, sock)
+
+    def metered():
+        for have in haves:
+            tracker_v3.process_datagram(have, addr, sock)
+
+    plain = time_call(direct) / len(haves)
+    measured = time_call(metered) / len(haves)
+    render = time_call(tracker_v3.metrics.render)
+    print(f"HAVE sem métricas: {plain * 1e6:.2f} us | com métricas: {measured * 1e6:.2f} us "
+          f"(+{(measured - plain) * 1e6:.2f} us) | coleta de /metrics: {render * 1000:.2f} ms")
+
+def simulate_announces(controller, num_peers, duration, ramp, cost, adapt_period):
+    """Simula `num_peers` peers que entram nos primeiros `ramp` segundos e anunciam no
+    intervalo que o controlador informa (tempo simulado, resolução de 1s). Cada segundo
+    guarda quantos peers anunciam nele; os que anunciam recebem o intervalo atual com
+    jitter e são espalhados pelos segundos correspondentes.
+    Retorna [(segundo, anúncios nesse segundo, intervalo)].
+    """
+    horizon = int(duration + controller.max_interval * (1 + controller.jitter)) + 2
+    wheel = [0] * horizon
+    for _ in range(num_peers):
+        wheel[int(random.uniform(0, ramp))] += 1
+    messages = 0
+    busy = 0.0
+    timeline = []
+    next_adapt = 0.0
+    for second in range(int(duration)):
+        announcing = wheel[second]
+        messages += announcing
+        busy += announcing * cost
+        if second >= next_adapt:
+            controller.update(second, messages, busy, num_peers)
+            next_adapt += adapt_period
+        low = controller.interval * (1 - controller.jitter)
+        high = controller.interval * (1 + controller.jitter)
+        for _ in range(announcing):
+            wheel[second + max(1, int(random.uniform(low, high)))] += 1
+        timeline.append((second, announcing, controller.interval))
+    return timeline
+
+def run_interval_benchmark(args):
+    """Intervalo fixo vs adaptativo com muitos peers: taxa de anúncios (média e pico por
+    segundo) a cada janela, em tempo simulado.
+    """
+    random.seed(1)
+    results = {}
+    for name, min_interval, max_interval in (("fixo", tracker_v3.MIN_ANNOUNCE_INTERVAL, tracker_v3.MIN_ANNOUNCE_INTERVAL),
+                                             ("adaptativo", tracker_v3.MIN_ANNOUNCE_INTERVAL, tracker_v3.MAX_ANNOUNCE_INTERVAL)):
+        controller = tracker_interval.IntervalController(args.target_rate, min_interval, max_interval,
+                                                         tracker_v3.TARGET_UTILIZATION, tracker_v3.ANNOUNCE_JITTER)
+        results[name] = simulate_announces(controller, args.peers, args.duration, args.ramp, args.cost,
+                                           tracker_v3.INTERVAL_ADAPT_PERIOD)
+    capacity = tracker_v3.TARGET_UTILIZATION / args.cost
+    print(f"Peers: {args.peers} | taxa alvo: {args.target_rate:.0f} msg/s | custo: {args.cost * 1e6:.0f} us/msg "
+          f"(capacidade a {tracker_v3.TARGET_UTILIZATION:.0%}: {capacity:.0f} msg/s) | entrada em {args.ramp:.0f}s")
+    print(f"{'janela (s)':>12}{'fixo média':>12}{'fixo pico':>11}{'adapt. média':>14}{'adapt. pico':>13}{'intervalo (s)':>15}")
+    for start in range(0, int(args.duration), int(args.window)):
+        row = f"{f'{start}-{start + int(args.window)}':>12}"
+        for name in ("fixo", "adaptativo"):
+            window = results[name][start:start + int(args.window)]
+            counts = [count for _, count, _ in window]
+            row += f"{sum(counts) / len(counts):>12.0f}{max(counts):>11}" if name == "fixo" else \
+                   f"{sum(counts) / len(counts):>14.0f}{max(counts):>13}{window[-1][2]:>15.0f}"
+        print(row)
+
+class LossySocket:
+    """Socket UDP do cliente que descarta uma fração das páginas recebidas (perda simulada)."""
+
+    def __init__(self, sock, loss):
+        self.sock = sock
+        self.loss = loss
+        self.received = 0
+        self.dropped = 0
+
+    def recvfrom(self, size):
+        while True:
+            data, addr = self.sock.recvfrom(size)
+            self.received += 1
+            if self.loss and random.random() < self.loss:
+                self.dropped += 1
+                continue
+            return data, addr
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+def run_pages_benchmark(args):
+    """JOIN em um enxame grande: a PEERLIST não cabe em um datagrama e vem paginada.
+    O cliente é o próprio `peer_v3.join_tracker`, com perda de pacotes simulada para
+    exercitar o RESEND.
+    """
+    import peer_v3
+
+    logging.disable(logging.CRITICAL)
+    swarm = populate_swarm(args.peers, args.pieces)
+    tracker_v3.peerlist_mtu = args.mtu
+    port = free_udp_port()
+    start_tracker_thread("thread", port, 0)
+
+    peer_v3.tracker_addr = (BENCH_HOST, port)
+    peer_v3.my_ip = BENCH_HOST
+    peer_v3.info_hash = swarm.info_hash
+    peer_v3.numwant = args.numwant
+    print(f"Peers: {args.peers} | Pedaços: {args.pieces} | numwant: {args.numwant} | "
+          f"MTU: {args.mtu} | Perda: {args.loss:.0%}")
+    print(f"{'protocolo':>10}{'peers':>8}{'datagramas':>12}{'perdidos':>10}{'bytes':>10}{'ms/JOIN':>10}")
+    for protocol in ("binary", "text"):
+        received = dropped = peers = 0
+        size = len(b"".join(tracker_v3.build_peer_list(swarm, None, args.numwant, protocol == "binary")[1]))
+        start = time.perf_counter()
+        for i in range(args.joins):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            sock.settimeout(5.0) # Mesmo timeout do JOIN no peer_v3.
+            lossy = LossySocket(sock, args.loss)
+            peer_v3.my_tcp_port = 30000 + i
+            try:
+                peers += len(peer_v3.join_tracker(lossy, protocol))
+            except socket.timeout:
+                pass # Resposta perdida por completo: conta como JOIN sem peers.
+            received += lossy.received
+            dropped += lossy.dropped
+            sock.close()
+        elapsed = (time.perf_counter() - start) / args.joins
+        print(f"{protocol:>10}{peers / args.joins:>8.0f}{received / args.joins:>12.1f}"
+              f"{dropped / args.joins:>10.1f}{size:>10}{elapsed * 1000:>10.1f}")
+
+class CountingSocket:
+    """Socket falso que só conta as respostas do tracker (sem passar pela rede)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.responses = 0
+        self.bytes = 0
+
+    def sendto(self, data, addr):
+        with self.lock:
+            self.responses += 1
+            self.bytes += len(data)
+
+def run_swarms_benchmark(args):
+    """Um enxame grande vs o mesmo número de peers dividido em vários enxames pequenos.
+    Threads chamam `handle_udp_message` diretamente com anúncios (JOIN + UPDATEs); o
+    tamanho das respostas cai com o enxame e os anúncios de enxames diferentes não
+    disputam o mesmo lock.
+    """
+    logging.disable(logging.CRITICAL)
+    print(f"Peers: {args.peers} | Pedaços: {args.pieces} | Threads: {args.threads} | "
+          f"Anúncios por thread: {args.announces}")
+    print(f"{'enxames':>8}{'anúncios/s':>14}{'B/resposta':>14}")
+    for num_swarms in args.swarm_counts:
+        tracker_v3.swarms.clear()
+        hashes = [i.to_bytes(binary_protocol.INFO_HASH_SIZE, "big") for i in range(num_swarms)]
+        for info_hash in hashes:
+            populate_swarm(args.peers // num_swarms, args.pieces, info_hash)
+        sock = CountingSocket()
+        per_swarm = args.peers // num_swarms
+
+        def announcer(seed):
+            rng = random.Random(seed)
+            for _ in range(args.announces):
+                info_hash = rng.choice(hashes)
+                port = 20000 + rng.randrange(per_swarm)
+                if rng.random() < args.join_ratio:
+                    message = f"JOIN {BENCH_HOST} {port} swarm={info_hash.hex()}"
+                else:
+                    owned = rng.sample(range(args.pieces), rng.randint(0, min(args.pieces, 20)))
+                    message = f"UPDATE {port} [{','.join(map(str, sorted(owned)))}] swarm={info_hash.hex()}"
+                tracker_v3.handle_udp_message(message.encode("utf-8"), (BENCH_HOST, port), sock)
+
+        threads = [threading.Thread(target=announcer, args=(i,)) for i in range(args.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        per_response = sock.bytes / sock.responses if sock.responses else 0
+        print(f"{num_swarms:>8}{args.threads * args.announces / elapsed:>14.0f}{per_response:>14.0f}")
+
+def run_contention_benchmark(args):
+    """Disputa pelos locks de um enxame grande com várias threads de tratamento.
+    Com uma partição, toda montagem de PEERLIST (JOIN) segura o lock do enxame enquanto
+    copia todos os peers, e os UPDATEs e HAVEs das outras threads esperam; com várias,
+    a cópia segura uma partição de cada vez e um anúncio só espera se cair nela.
+    """
+    logging.disable(logging.CRITICAL)
+    print(f"Peers: {args.peers} | Pedaços: {args.pieces} | Threads: {args.threads} | "
+          f"Mensagens por thread: {args.messages} | JOIN: {args.join_ratio:.0%} | HAVE: {args.have_ratio:.0%}")
+    print(f"{'partições':>10}{'msg/s':>10}{'p50 (us)':>10}{'p99 (us)':>10}"
+          f"{'esperas':>10}{'espera (ms)':>13}")
+    for shards in args.shard_counts:
+        tracker_v3.swarms.clear()
+        tracker_v3.configure_shards(shards)
+        swarm = populate_swarm(args.peers, args.pieces)
+        # Num tracker real os peers entram ao longo do tempo e os registros ficam espalhados
+        # na memória; realoca-os em ordem aleatória para a partição única não ganhar com a
+        # localidade artificial dos registros alocados em sequência.
+        items = swarm.records()
+        copies = {peer_id: record.copy() for peer_id, record in random.sample(items, len(items))}
+        tracker_v3.swarms.clear()
+        swarm = tracker_v3.get_swarm(swarm.info_hash)
+        swarm.set_total_pieces(args.pieces)
+        swarm.add_peers((peer_id, copies[peer_id]) for peer_id, _ in items)
+        suffix = f"swarm={swarm.info_hash.hex()}"
+        sock = CountingSocket()
+        latencies = [[] for _ in range(args.threads)] # Latência dos UPDATEs e HAVEs, por thread.
+
+        def handler(index):
+            rng = random.Random(index)
+            handle = tracker_v3.handle_udp_message
+            for _ in range(args.messages):
+                port = 20000 + rng.randrange(args.peers)
+                draw = rng.random()
+                if draw < args.join_ratio:
+                    handle(f"JOIN {BENCH_HOST} {port} {suffix}".encode("utf-8"), (BENCH_HOST, port), sock)
+                    continue
+                if draw < args.join_ratio + args.have_ratio:
+                    message = f"HAVE {port} 0 [] {suffix}"
+                else:
+                    owned = rng.sample(range(args.pieces), rng.randint(0, min(args.pieces, 20)))
+                    message = f"UPDATE {port} [{','.join(map(str, sorted(owned)))}] {suffix}"
+                start = time.perf_counter()
+                handle(message.encode("utf-8"), (BENCH_HOST, port), sock)
+                latencies[index].append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=handler, args=(i,)) for i in range(args.threads)]
+        waits, waited = tracker_v3.metrics.lock_wait_totals()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        total_waits, total_waited = tracker_v3.metrics.lock_wait_totals()
+        merged = sorted(latency for per_thread in latencies for latency in per_thread)
+        print(f"{shards:>10}{args.threads * args.messages / elapsed:>10.0f}"
+              f"{percentile(merged, 0.5) * 1e6:>10.0f}{percentile(merged, 0.99) * 1e6:>10.0f}"
+              f"{total_waits - waits:>10}{(total_waited - waited) * 1000:>13.1f}")
+    tracker_v3.configure_shards()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do tracker.")
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+
+    latency = subparsers.add_parser("latency", help="Loop bloqueante vs asyncio com um enxame grande.")
+    latency.add_argument("--mode", choices=["thread", "asyncio"], default="thread")
+    latency.add_argument("--peers", type=int, default=10000, help="Peers simulados no enxame.")
+    latency.add_argument("--pieces", type=int, default=100, help="Pedaços do arquivo simulado.")
+    latency.add_argument("--announces", type=int, default=20000, help="Total de anúncios enviados.")
+    latency.add_argument("--join-ratio", type=float, default=0.002, help="Fração dos anúncios que são JOIN.")
+    latency.add_argument("--rate", type=float, default=5000, help="Anúncios por segundo (0 = sem limite).")
+    latency.add_argument("--async-workers", type=int, default=tracker_v3.ASYNC_WORKERS)
+    latency.set_defaults(func=run_benchmark)
+
+    scale = subparsers.add_parser("scale", help="Vazão com vários processos do tracker (--workers).")
+    scale.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processos do tracker.")
+    scale.add_argument("--mode", choices=["thread", "asyncio"], default="thread")
+    scale.add_argument("--clients", type=int, default=4, help="Processos geradores de carga.")
+    scale.add_argument("--peers-per-client", type=int, default=50, help="Peers virtuais por cliente.")
+    scale.add_argument("--duration", type=float, default=10.0, help="Duração do teste em segundos.")
+    scale.set_defaults(func=run_scale_benchmark)
+
+    protocol = subparsers.add_parser("protocol", help="Protocolo de texto vs binário (tamanho e tempo de análise).")
+    protocol.add_argument("--peers", type=int, default=50, help="Peers na PEERLIST.")
+    protocol.add_argument("--pieces", type=int, default=10000, help="Pedaços do arquivo (1 GB / 100 KB = ~10k).")
+    protocol.set_defaults(func=run_protocol_benchmark)
+
+    memory = subparsers.add_parser("memory", help="Memória por peer na tabela de peers.")
+    memory.add_argument("--peer-counts", type=int, nargs="+", default=[1000, 10000, 100000])
+    memory.add_argument("--pieces", type=int, default=10000, help="Pedaços do arquivo.")
+    memory.add_argument("--fill", type=float, default=0.5, help="Fração média de pedaços que cada peer possui.")
+    memory.add_argument("--legacy-max-peers", type=int, default=1000,
+                        help="Maior enxame medido no formato antigo (dict + set).")
+    memory.set_defaults(func=run_memory_benchmark)
+
+    peerlist = subparsers.add_parser("peerlist", help="Montagem da PEERLIST com e sem cache de entradas.")
+    peerlist.add_argument("--peer-counts", type=int, nargs="+", default=[1000, 5000, 10000])
+    peerlist.add_argument("--pieces", type=int, default=1000, help="Pedaços do arquivo.")
+    peerlist.add_argument("--joins", type=int, default=5, help="JOINs simulados por medição.")
+    peerlist.add_argument("--binary", action="store_true", help="Mede a PEERLIST binária em vez da de texto.")
+    peerlist.set_defaults(func=run_peerlist_benchmark)
+
+    swarms = subparsers.add_parser("swarms", help="Um enxame grande vs vários enxames pequenos.")
+    swarms.add_argument("--peers", type=int, default=10000, help="Total de peers somando todos os enxames.")
+    swarms.add_argument("--swarm-counts", type=int, nargs="+", default=[1, 10, 100])
+    swarms.add_argument("--pieces", type=int, default=200, help="Pedaços de cada arquivo.")
+    swarms.add_argument("--threads", type=int, default=8, help="Threads anunciando em paralelo.")
+    swarms.add_argument("--announces", type=int, default=2000, help="Anúncios por thread.")
+    swarms.add_argument("--join-ratio", type=float, default=0.05, help="Fração dos anúncios que são JOIN.")
+    swarms.set_defaults(func=run_swarms_benchmark)
+
+    expiry = subparsers.add_parser("expiry", help="Varredura completa vs heap de expiração de peers.")
+    expiry.add_argument("--peers", type=int, default=100000, help="Peers no enxame.")
+    expiry.add_argument("--alive", type=float, default=0.8, help="Fração dos peers que continuam anunciando.")
+    expiry.set_defaults(func=run_expiry_benchmark)
+
+    pages = subparsers.add_parser("pages", help="PEERLIST paginada (MTU + RESEND) em um enxame grande.")
+    pages.add_argument("--peers", type=int, default=5000, help="Peers no enxame.")
+    pages.add_argument("--pieces", type=int, default=10000, help="Pedaços do arquivo.")
+    pages.add_argument("--numwant", type=int, default=tracker_v3.MAX_NUMWANT, help="Peers pedidos no JOIN.")
+    pages.add_argument("--mtu", type=int, default=tracker_v3.PEERLIST_MTU, help="MTU das páginas.")
+    pages.add_argument("--loss", type=float, default=0.0, help="Fração das páginas descartadas no cliente.")
+    pages.add_argument("--joins", type=int, default=10, help="JOINs medidos por protocolo.")
+    pages.set_defaults(func=run_pages_benchmark)
+
+    snapshot = subparsers.add_parser("snapshot", help="Snapshot em disco: gravação, compactação e recarga.")
+    snapshot.add_argument("--peers", type=int, default=100000, help="Total de peers.")
+    snapshot.add_argument("--swarms", type=int, default=100, help="Enxames.")
+    snapshot.add_argument("--pieces", type=int, default=1000, help="Pedaços de cada arquivo.")
+    snapshot.add_argument("--dirty", type=float, default=0.1, help="Fração dos peers alterados entre gravações.")
+    snapshot.set_defaults(func=run_snapshot_benchmark)
+
+    scrape = subparsers.add_parser("scrape", help="SCRAPE recalculado vs estatísticas incrementais.")
+    scrape.add_argument("--peer-counts", type=int, nargs="+", default=[1000, 10000, 50000])
+    scrape.add_argument("--pieces", type=int, default=1000, help="Pedaços do arquivo.")
+    scrape.set_defaults(func=run_scrape_benchmark)
+
+    rarity = subparsers.add_parser("rarity", help="Raridade recalculada no peer vs servida pelo tracker.")
+    rarity.add_argument("--peer-counts", type=int, nargs="+", default=[50, 200, 1000])
+    rarity.add_argument("--pieces", type=int, default=1000, help="Pedaços do arquivo.")
+    rarity.set_defaults(func=run_rarity_benchmark)
+
+    ratelimit = subparsers.add_parser("ratelimit", help="Limitador de taxa por IP e global.")
+    ratelimit.add_argument("--per-ip", type=float, default=tracker_v3.RATE_LIMIT_PER_IP)
+    ratelimit.add_argument("--global-rate", type=float, default=tracker_v3.RATE_LIMIT_GLOBAL)
+    ratelimit.add_argument("--max-sources", type=int, default=tracker_v3.RATE_LIMIT_SOURCES)
+    ratelimit.add_argument("--flood", type=float, default=50000, help="Datagramas/s do IP inundador.")
+    ratelimit.add_argument("--peers", type=int, default=5000, help="Peers bem-comportados (1 datagrama/s).")
+    ratelimit.add_argument("--duration", type=float, default=10.0, help="Segundos simulados.")
+    ratelimit.set_defaults(func=run_ratelimit_benchmark)
+
+    metrics = subparsers.add_parser("metrics", help="Custo das métricas por mensagem.")
+    metrics.add_argument("--peers", type=int, default=10000, help="Peers no enxame.")
+    metrics.add_argument("--pieces", type=int, default=1000, help="Pedaços do arquivo.")
+    metrics.add_argument("--messages", type=int, default=10000, help="HAVEs tratados por medição.")
+    metrics.set_defaults(func=run_metrics_benchmark)
+
+    interval = subparsers.add_parser("interval", help="Intervalo de anúncio fixo vs adaptativo (simulado).")
+    interval.add_argument("--peers", type=int, default=100000)
+    interval.add_argument("--target-rate", type=float, default=1000, help="Mensagens/s que o tracker deve manter.")
+    interval.add_argument("--cost", type=float, default=0.0001, help="Segundos de CPU por mensagem.")
+    interval.add_argument("--ramp", type=float, default=10.0, help="Segundos em que todos os peers entram.")
+    interval.add_argument("--duration", type=float, default=1200.0, help="Segundos simulados.")
+    interval.add_argument("--window", type=float, default=60.0, help="Segundos por linha da tabela.")
+    interval.set_defaults(func=run_interval_benchmark)
+
+    contention = subparsers.add_parser("contention", help="Disputa pelos locks do enxame com e sem partições.")
+    contention.add_argument("--peers", type=int, default=20000, help="Peers no enxame.")
+    contention.add_argument("--pieces", type=int, default=200, help="Pedaços do arquivo.")
+    contention.add_argument("--threads", type=int, default=8, help="Threads de tratamento em paralelo.")
+    contention.add_argument("--messages", type=int, default=2000, help="Mensagens por thread.")
+    contention.add_argument("--join-ratio", type=float, default=0.02, help="Fração das mensagens que são JOIN.")
+    contention.add_argument("--have-ratio", type=float, default=0.5, help="Fração das mensagens que são HAVE.")
+    contention.add_argument("--shard-counts", type=int, nargs="+", default=[1, tracker_v3.PEER_SHARDS])
+    contention.set_defaults(func=run_contention_benchmark)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""Captura e reprodução do tráfego recebido pelo tracker.
+
+Com --capture, o tracker grava cada datagrama recebido (antes do limitador de taxa)
+num arquivo de trace; este script reenvia um trace contra um tracker local em 1×,
+N× ou na velocidade máxima, para reproduzir offline a forma da carga de produção.
+
+Formato do arquivo:
+
+    MAGIC (8 bytes) | início da captura (double, segundos desde a época)
+    registro: intervalo desde o registro anterior (uint32, microssegundos) |
+              ip de origem (4 bytes) | porta de origem (uint16) | tamanho (uint16) | dados
+
+São 12 bytes por datagrama além dos dados. Um intervalo maior que o uint32 (~71 min)
+é gravado saturado. Um registro incompleto no final (tracker morto no meio de uma
+escrita) é ignorado.
+
+Na reprodução, cada endereço de origem do trace ganha um socket UDP próprio (até
+--sockets; acima disso os endereços dividem os sockets), então o tracker continua
+vendo fontes distintas e a ordem dos datagramas de cada fonte é mantida. Todos saem
+do mesmo IP: rode o tracker sem limite de taxa (--spawn já faz isso).
+
+Exemplos:
+    python tracker_v3.py --capture prod.trace
+    python tracker_capture.py info prod.trace
+    python tracker_capture.py replay prod.trace --spawn --speed 4 --json replay.json
+"""
+
+import argparse
+import json
+import logging
+import selectors
+import socket
+import struct
+import threading
+import time
+
+import binary_protocol
+import tracker_loadgen
+
+MAGIC = b"TRKCAP01"
+HEADER = struct.Struct("!d")
+RECORD = struct.Struct("!I4sHH")
+MAX_DELTA = 0xFFFFFFFF
+
+# --- Configuração ---
+LOCAL_HOST = '127.0.0.1'
+CAPTURE_BUFFER = 1 << 20  # Bytes acumulados em memória antes de cada escrita no arquivo.
+REPLAY_SOCKETS = 256      # Sockets UDP usados na reprodução (um por endereço de origem, até este limite).
+DRAIN_TIMEOUT = 2.0       # Segundos esperando as últimas respostas depois do último envio.
+MAX_DATAGRAM_SIZE = 65535
+# ---------------------
+
+# Nome de cada tipo de mensagem binária no resumo.
+BINARY_NAMES = {binary_protocol.MSG_JOIN: 'JOIN', binary_protocol.MSG_UPDATE: 'UPDATE',
+                binary_protocol.MSG_PEERLIST: 'PEERLIST', binary_protocol.MSG_HAVE: 'HAVE',
+                binary_protocol.MSG_RESYNC: 'RESYNC', binary_protocol.MSG_PEERPAGE: 'PEERPAGE',
+                binary_protocol.MSG_RESEND: 'RESEND', binary_protocol.MSG_SCRAPE: 'SCRAPE',
+                binary_protocol.MSG_SCRAPEINFO: 'SCRAPEINFO', binary_protocol.MSG_INTERVAL: 'INTERVAL'}
+
+class TraceError(ValueError):
+    """Arquivo que não é um trace deste formato."""
+
+def message_name(data):
+    """Tipo da mensagem (texto ou binária), usado nos resumos: 'JOIN', 'bin:HAVE', ..."""
+    if binary_protocol.is_binary(data):
+        return "bin:" + BINARY_NAMES.get(data[2] if len(data) > 2 else None, "other")
+    name = data.split(b" ", 1)[0][:16]
+    return name.decode("ascii") if name.isalpha() and name.isupper() else "other"
+
+class TraceWriter:
+    """Grava os datagramas recebidos num trace. `record` é chamado no caminho quente:
+    só empacota o cabeçalho e acrescenta ao buffer do arquivo, sob um lock sem disputa
+    no modo tradicional (uma thread de recepção). Ao passar de `max_bytes` (0 = sem
+    limite) a captura para sozinha.
+    """
+
+    def __init__(self, path, max_bytes=0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.file = open(path, "wb", buffering=CAPTURE_BUFFER)
+        self.file.write(MAGIC + HEADER.pack(time.time()))
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.last = 0 # Microssegundos desde `origin` do último registro gravado.
+        self.size = len(MAGIC) + HEADER.size
+        self.records = 0
+        self.active = True
+
+    def record(self, data, addr):
+        now = int((time.perf_counter() - self.origin) * 1e6)
+        with self.lock:
+            if not self.active:
+                return
+            delta = min(now - self.last, MAX_DELTA)
+            self.last += delta
+            self.file.write(RECORD.pack(delta, socket.inet_aton(addr[0]), addr[1], len(data)))
+            self.file.write(data)
+            self.records += 1
+            self.size += RECORD.size + len(data)
+            if self.max_bytes and self.size >= self.max_bytes:
+                self.active = False
+                self.file.flush()
+                logging.warning(f"Captura {self.path} atingiu {self.size} bytes ({self.records} datagramas). "
+                                f"Captura encerrada.")
+
+    def flush(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.active = False
+            if not self.file.closed:
+                self.file.close()
+
+class TraceReader:
+    """Lê um trace: `started_at` é o início da captura e a iteração gera
+    (segundos desde o início, (ip, porta) de origem, dados) em ordem.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(len(MAGIC) + HEADER.size)
+        if len(header) < len(MAGIC) + HEADER.size or not header.startswith(MAGIC):
+            raise TraceError(f"{path} não é um trace do tracker")
+        self.started_at = HEADER.unpack_from(header, len(MAGIC))[0]
+
+    def __iter__(self):
+        elapsed = 0
+        inet_ntoa = socket.inet_ntoa
+        with open(self.path, "rb") as f:
+            f.seek(len(MAGIC) + HEADER.size)
+            while True:
+                head = f.read(RECORD.size)
+                if len(head) < RECORD.size:
+                    return
+                delta, packed_ip, port, size = RECORD.unpack(head)
+                data = f.read(size)
+                if len(data) < size:
+                    return # Registro truncado no final: o tracker parou no meio da escrita.
+                elapsed += delta
+                yield elapsed / 1e6, (inet_ntoa(packed_ip), port), data
+
+def summarize_trace(path):
+    """Resumo de um trace: datagramas, duração, fontes, bytes e mistura de mensagens."""
+    reader = TraceReader(path)
+    kinds = {}
+    sources = set()
+    count = size = 0
+    duration = 0.0
+    for duration, source, data in reader:
+        count += 1
+        size += len(data)
+        sources.add(source)
+        kind = message_name(data)
+        kinds[kind] = kinds.get(kind, 0) + 1
+    return {"path": path, "started_at": reader.started_at, "datagrams": count, "bytes": size,
+            "duration": duration, "rate": count / duration if duration else 0.0,
+            "sources": len(sources), "source_ips": len({ip for ip, _ in sources}), "messages": kinds}
+
+class Replayer:
+    """Reenvia um trace para `tracker_addr` respeitando os intervalos originais divididos
+    por `speed` (0 = sem espera, o mais rápido possível) e conta as respostas do tracker.
+    """
+
+    def __init__(self, tracker_addr, speed=1.0, sockets=REPLAY_SOCKETS):
+        self.tracker_addr = tracker_addr
+        self.speed = speed
+        self.max_sockets = sockets
+        self.selector = selectors.DefaultSelector()
+        self.sockets = []
+        self.by_source = {} # { (ip, porta) de origem no trace: socket }
+        self.sent = 0
+        self.sent_bytes = 0
+        self.send_retries = 0
+        self.replies = {}   # { tipo da resposta: [quantidade, bytes] }
+        self.lags = []      # Atraso de cada envio em relação ao horário previsto (segundos).
+
+    def socket_for(self, source):
+        sock = self.by_source.get(source)
+        if sock is None:
+            if len(self.sockets) < self.max_sockets:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+                sock.setblocking(False)
+                sock.bind((LOCAL_HOST if self.tracker_addr[0] == LOCAL_HOST else '0.0.0.0', 0))
+                self.selector.register(sock, selectors.EVENT_READ)
+                self.sockets.append(sock)
+            else:
+                sock = self.sockets[len(self.by_source) % len(self.sockets)]
+            self.by_source[source] = sock
+        return sock
+
+    def receive(self, timeout):
+        for key, _ in self.selector.select(timeout=timeout):
+            sock = key.fileobj
+            while True:
+                try:
+                    data = sock.recv(MAX_DATAGRAM_SIZE)
+                except BlockingIOError:
+                    break
+                counts = self.replies.setdefault(message_name(data), [0, 0])
+                counts[0] += 1
+                counts[1] += len(data)
+
+    def send(self, sock, data):
+        while True:
+            try:
+                sock.sendto(data, self.tracker_addr)
+                break
+            except BlockingIOError:
+                # Buffer de envio cheio (comum em --speed max): espera esvaziar.
+                self.send_retries += 1
+                self.receive(0.001)
+        self.sent += 1
+        self.sent_bytes += len(data)
+
+    def run(self, records, limit=0):
+        start = time.perf_counter()
+        trace_time = 0.0
+        for trace_time, source, data in records:
+            if limit and self.sent >= limit:
+                break
+            sock = self.socket_for(source)
+            if self.speed:
+                due = start + trace_time / self.speed
+                now = time.perf_counter()
+                while now < due:
+                    self.receive(due - now)
+                    now = time.perf_counter()
+                self.lags.append(now - due)
+            elif self.sent % 64 == 0:
+                self.receive(0)
+            self.send(sock, data)
+        send_done = time.perf_counter()
+
+        # Espera as últimas respostas até o tracker ficar quieto por DRAIN_TIMEOUT.
+        received = -1
+        while received != sum(count for count, _ in self.replies.values()):
+            received = sum(count for count, _ in self.replies.values())
+            self.receive(DRAIN_TIMEOUT)
+        for sock in self.sockets:
+            sock.close()
+        return self.report(send_done - start, trace_time)
+
+    def report(self, elapsed, trace_time):
+        lags = sorted(self.lags)
+        replies = sum(count for count, _ in self.replies.values())
+        return {
+            "tracker": f"{self.tracker_addr[0]}:{self.tracker_addr[1]}",
+            "speed": self.speed or "max",
+            "sent": self.sent,
+            "sent_bytes": self.sent_bytes,
+            "sources": len(self.by_source),
+            "sockets": len(self.sockets),
+            "trace_duration": trace_time,
+            "elapsed": elapsed,
+            "target_rate": self.sent * self.speed / trace_time if self.speed and trace_time else None,
+            "send_rate": self.sent / elapsed if elapsed else 0.0,
+            "lag": {"p50": lags[len(lags) // 2] if lags else 0.0,
+                    "p99": lags[min(len(lags) - 1, int(0.99 * len(lags)))] if lags else 0.0,
+                    "max": lags[-1] if lags else 0.0},
+            "send_retries": self.send_retries,
+            "replies": replies,
+            "reply_ratio": replies / self.sent if self.sent else 0.0,
+            "replies_by_type": {kind: {"count": count, "bytes": size}
+                                for kind, (count, size) in sorted(self.replies.items())},
+        }
+
+def print_summary(summary):
+    started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(summary["started_at"]))
+    print(f"Trace {summary['path']}: capturado em {started}")
+    print(f"  {summary['datagrams']} datagramas ({summary['bytes'] / 1024:.0f} KiB) em {summary['duration']:.1f}s "
+          f"({summary['rate']:.0f}/s) de {summary['sources']} endereços ({summary['source_ips']} IPs)")
+    for kind, count in sorted(summary["messages"].items(), key=lambda item: -item[1]):
+        print(f"  {kind:>12}: {count} ({count / summary['datagrams']:.1%})")
+
+def print_report(report):
+    target = f" (alvo: {report['target_rate']:.0f}/s)" if report["target_rate"] else ""
+    print(f"Reproduzidos {report['sent']} datagramas ({report['sent_bytes'] / 1024:.0f} KiB) de "
+          f"{report['sources']} endereços em {report['elapsed']:.1f}s, velocidade {report['speed']}: "
+          f"{report['send_rate']:.0f}/s{target}")
+    lag = report["lag"]
+    print(f"  Atraso do envio: p50 {lag['p50'] * 1000:.2f} ms, p99 {lag['p99'] * 1000:.2f} ms, "
+          f"máx {lag['max'] * 1000:.2f} ms | buffer de envio cheio: {report['send_retries']} vezes")
+    print(f"  Respostas: {report['replies']} ({report['reply_ratio']:.2f} por datagrama)")
+    for kind, stats in report["replies_by_type"].items():
+        print(f"  {kind:>12}: {stats['count']} ({stats['bytes'] / 1024:.0f} KiB)")
+
+def parse_speed(text):
+    """'max' (ou 0) reenvia sem esperar; senão, o fator de aceleração (1 = tempo real)."""
+    if text == "max":
+        return 0.0
+    speed = float(text)
+    if speed < 0:
+        raise argparse.ArgumentTypeError("a velocidade deve ser positiva ou 'max'")
+    return speed
+
+def main():
+    parser = argparse.ArgumentParser(description="Captura e reprodução do tráfego do tracker.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    info = subparsers.add_parser("info", help="Resumo de um trace gravado com tracker_v3.py --capture.")
+    info.add_argument("trace", help="Arquivo de trace.")
+    info.add_argument("--json", metavar="ARQUIVO", help="Grava o resumo em JSON.")
+
+    replay = subparsers.add_parser("replay", help="Reenvia um trace contra um tracker.")
+    replay.add_argument("trace", help="Arquivo de trace.")
+    replay.add_argument("--tracker", default=f"{LOCAL_HOST}:10000", help="Endereço do tracker (ip:porta).")
+    replay.add_argument("--spawn", action="store_true",
+                        help="Inicia um tracker_v3.py local (sem limite de taxa) em vez de usar --tracker.")
+    replay.add_argument("--tracker-args", default="", help="Argumentos extras para o tracker iniciado com --spawn.")
+    replay.add_argument("--speed", type=parse_speed, default=1.0,
+                        help="Fator de aceleração (1 = tempo real, 4 = 4× mais rápido) ou 'max'.")
+    replay.add_argument("--sockets", type=int, default=REPLAY_SOCKETS,
+                        help="Máximo de sockets UDP (um por endereço de origem do trace).")
+    replay.add_argument("--limit", type=int, default=0, help="Reenvia só os N primeiros datagramas (0 = todos).")
+    replay.add_argument("--json", metavar="ARQUIVO", help="Grava o relatório em JSON.")
+    args = parser.parse_args()
+
+    try:
+        reader = TraceReader(args.trace)
+    except (OSError, TraceError) as e:
+        parser.error(str(e))
+    if args.command == "info":
+        result = summarize_trace(args.trace)
+        print_summary(result)
+    else:
+        process = None
+        if args.spawn:
+            process, tracker_addr = tracker_loadgen.spawn_tracker(args.tracker_args.split())
+        else:
+            host, port = args.tracker.rsplit(":", 1)
+            tracker_addr = (host, int(port))
+        try:
+            result = Replayer(tracker_addr, args.speed, args.sockets).run(reader, args.limit)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+        print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""Modo cluster do tracker: várias instâncias trocam o estado dos peers por gossip UDP.
+
+Cada instância aplica localmente os anúncios que recebe e publica o resultado
+(`GossipNode.publish`). As alterações pendentes saem em lote a cada `interval`
+segundos para `fanout` membros sorteados do cluster; quem recebe aplica e repassa
+só o que era novidade para ele (boato), então uma alteração chega a todos em poucas
+rodadas e para de circular sozinha. Várias alterações do mesmo peer dentro de um lote
+viram uma só. De tempos em tempos (`anti_entropy_interval`) cada instância envia o
+seu estado inteiro a um membro sorteado, o que corrige datagramas perdidos e atualiza
+instâncias que acabaram de (re)entrar no cluster.
+
+A consistência é eventual, com a versão mais recente vencendo: cada registro leva o
+'last_update' do peer, e um registro mais antigo que o estado local é ignorado (ver
+`tracker_v3.apply_replicated_state`). Os relógios das instâncias precisam estar
+razoavelmente sincronizados (no mesmo host, são o mesmo relógio).
+
+Formato do datagrama:
+
+    MAGIC (2 bytes) | versão (uint8) | quantidade de registros (uint16) | registros
+    registro: operação (uint8) | info_hash (20 bytes) | ip (4 bytes) | porta_tcp (uint16) |
+              last_update (double) | tamanho (uint32) | dados
+    PUT   dados = máscara de pedaços (int little-endian)
+    TOUCH sem dados: o peer deu sinal de vida (só renova o 'last_update')
+    DEL   sem dados: o peer com este 'last_update' expirou
+    SWARM dados = total de pedaços (uint32); ip, porta e last_update zerados
+
+Só são aceitos datagramas vindos dos endereços dos membros configurados.
+"""
+
+import logging
+import random
+import socket
+import struct
+import threading
+import time
+
+MAGIC = b"TG"
+VERSION = 1
+
+OP_PUT = 1
+OP_TOUCH = 2
+OP_DEL = 3
+OP_SWARM = 4
+
+HEADER = struct.Struct("!2sBH")
+RECORD = struct.Struct("!B20s4sHdI")
+TOTAL = struct.Struct("!I")
+NO_IP = bytes(4)
+
+GOSSIP_INTERVAL = 0.2          # Segundos entre os envios das alterações pendentes.
+GOSSIP_FANOUT = 2              # Membros sorteados que recebem cada lote.
+ANTI_ENTROPY_INTERVAL = 30.0   # Segundos entre os envios do estado inteiro a um membro sorteado.
+MAX_GOSSIP_DATAGRAM = 8192     # Tamanho máximo de cada datagrama (um registro maior vai sozinho).
+
+class GossipError(ValueError):
+    """Datagrama de gossip malformado ou de outra versão."""
+
+def encode_update(update):
+    """Codifica uma alteração no formato das tuplas de replicação do tracker:
+    ('put', info_hash, peer_id, ip, porta, pedaços, last_update),
+    ('touch', info_hash, peer_id, ip, porta, last_update),
+    ('del', info_hash, peer_id, ip, porta, last_update) ou ('swarm', info_hash, total).
+    """
+    kind = update[0]
+    if kind == 'put':
+        _, info_hash, _, ip, tcp_port, pieces, last_update = update
+        mask = pieces.to_bytes((pieces.bit_length() + 7) >> 3, "little")
+        return RECORD.pack(OP_PUT, info_hash, socket.inet_aton(ip), tcp_port, last_update, len(mask)) + mask
+    if kind in ('touch', 'del'):
+        _, info_hash, _, ip, tcp_port, last_update = update
+        op = OP_TOUCH if kind == 'touch' else OP_DEL
+        return RECORD.pack(op, info_hash, socket.inet_aton(ip), tcp_port, last_update, 0)
+    if kind == 'swarm':
+        _, info_hash, total_pieces = update
+        return RECORD.pack(OP_SWARM, info_hash, NO_IP, 0, 0.0, TOTAL.size) + TOTAL.pack(total_pieces)
+    raise GossipError(f"Alteração desconhecida: {kind}")
+
+def update_key(update):
+    """Chave que junta as alterações do mesmo peer (ou enxame) dentro de um lote."""
+    if update[0] == 'swarm':
+        return ('swarm', update[1])
+    return (update[0], update[1], update[2])
+
+def decode_datagram(data):
+    """Retorna a lista de (alteração, registro codificado) de um datagrama de gossip."""
+    if len(data) < HEADER.size:
+        raise GossipError("Datagrama curto demais")
+    magic, version, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise GossipError(f"Cabeçalho inválido: {magic!r} versão {version}")
+    updates = []
+    offset = HEADER.size
+    for _ in range(count):
+        if offset + RECORD.size > len(data):
+            raise GossipError("Registro truncado")
+        op, info_hash, packed_ip, tcp_port, last_update, size = RECORD.unpack_from(data, offset)
+        end = offset + RECORD.size + size
+        if end > len(data):
+            raise GossipError("Dados do registro truncados")
+        payload = data[offset + RECORD.size:end]
+        ip = socket.inet_ntoa(packed_ip)
+        peer_id = f"{ip}:{tcp_port}"
+        if op == OP_PUT:
+            update = ('put', info_hash, peer_id, ip, tcp_port, int.from_bytes(payload, "little"), last_update)
+        elif op == OP_TOUCH:
+            update = ('touch', info_hash, peer_id, ip, tcp_port, last_update)
+        elif op == OP_DEL:
+            update = ('del', info_hash, peer_id, ip, tcp_port, last_update)
+        elif op == OP_SWARM:
+            update = ('swarm', info_hash, TOTAL.unpack(payload)[0])
+        else:
+            raise GossipError(f"Operação desconhecida ({op})")
+        updates.append((update, data[offset:end]))
+        offset = end
+    return updates
+
+def pack_datagrams(records, max_size=MAX_GOSSIP_DATAGRAM):
+    """Agrupa registros codificados em datagramas de no máximo `max_size` bytes."""
+    datagrams = []
+    batch = []
+    used = HEADER.size
+    for record in records:
+        if batch and (used + len(record) > max_size or len(batch) == 0xFFFF):
+            datagrams.append(HEADER.pack(MAGIC, VERSION, len(batch)) + b"".join(batch))
+            batch = []
+            used = HEADER.size
+        batch.append(record)
+        used += len(record)
+    if batch:
+        datagrams.append(HEADER.pack(MAGIC, VERSION, len(batch)) + b"".join(batch))
+    return datagrams
+
+def parse_address(text):
+    """Converte 'host:porta' em (ip, porta), resolvendo o nome."""
+    host, port = text.rsplit(":", 1)
+    return socket.gethostbyname(host), int(port)
+
+class GossipNode:
+    """Uma instância do cluster: recebe e repassa alterações e publica as locais.
+
+    `apply(alteração)` aplica uma alteração recebida e retorna True se ela era novidade
+    (só essas são repassadas); `full_state()` retorna as alterações que reconstroem o
+    estado local inteiro, usadas na antientropia.
+    """
+
+    def __init__(self, bind_addr, members, apply, full_state, fanout=GOSSIP_FANOUT,
+                 interval=GOSSIP_INTERVAL, anti_entropy_interval=ANTI_ENTROPY_INTERVAL,
+                 max_datagram=MAX_GOSSIP_DATAGRAM):
+        self.members = [member for member in members if member != bind_addr]
+        self.allowed = set(self.members)
+        self.apply = apply
+        self.full_state = full_state
+        self.fanout = fanout
+        self.interval = interval
+        self.anti_entropy_interval = anti_entropy_interval
+        self.max_datagram = max_datagram
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(bind_addr)
+        self.lock = threading.Lock()
+        self.pending = {} # { chave: registro codificado } (ver `update_key`)
+        # Contadores para as métricas.
+        self.sent_datagrams = 0
+        self.sent_records = 0
+        self.received_records = 0
+        self.applied_records = 0
+        self.rejected_datagrams = 0
+
+    def publish(self, update):
+        """Enfileira uma alteração local para o próximo lote."""
+        record = encode_update(update)
+        with self.lock:
+            self.pending[update_key(update)] = record
+
+    def start(self):
+        threading.Thread(target=self._receive_loop, name="GossipReceive", daemon=True).start()
+        threading.Thread(target=self._send_loop, name="GossipSend", daemon=True).start()
+
+    def flush(self):
+        """Envia as alterações pendentes a `fanout` membros sorteados."""
+        with self.lock:
+            if not self.pending:
+                return
+            records, self.pending = list(self.pending.values()), {}
+        targets = random.sample(self.members, min(self.fanout, len(self.members)))
+        for datagram in pack_datagrams(records, self.max_datagram):
+            for member in targets:
+                self._send(datagram, member)
+        self.sent_records += len(records) * len(targets)
+
+    def push_state(self, member):
+        """Antientropia: envia o estado local inteiro para `member`."""
+        records = [encode_update(update) for update in self.full_state()]
+        for datagram in pack_datagrams(records, self.max_datagram):
+            self._send(datagram, member)
+        self.sent_records += len(records)
+        logging.debug(f"Gossip: estado inteiro ({len(records)} registros) enviado para {member}")
+
+    def _send(self, datagram, member):
+        try:
+            self.sock.sendto(datagram, member)
+            self.sent_datagrams += 1
+        except OSError as e:
+            logging.warning(f"Gossip: falha ao enviar para {member}: {e}")
+
+    def _send_loop(self):
+        next_anti_entropy = time.monotonic() + self.anti_entropy_interval
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+                if self.members and time.monotonic() >= next_anti_entropy:
+                    next_anti_entropy += self.anti_entropy_interval
+                    self.push_state(random.choice(self.members))
+            except Exception as e:
+                logging.error(f"Erro no envio do gossip: {e}", exc_info=True)
+
+    def _receive_loop(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(65535)
+            except OSError as e:
+                logging.warning(f"Gossip: erro ao receber: {e}")
+                continue
+            if addr not in self.allowed:
+                self.rejected_datagrams += 1
+                if self.rejected_datagrams % 1000 == 1:
+                    logging.warning(f"Gossip: datagrama de {addr}, que não é membro do cluster. Ignorando.")
+                continue
+            try:
+                updates = decode_datagram(data)
+            except GossipError as e:
+                self.rejected_datagrams += 1
+                logging.warning(f"Gossip: datagrama inválido de {addr}: {e}")
+                continue
+            fresh = {}
+            for update, record in updates:
+                self.received_records += 1
+                try:
+                    if self.apply(update):
+                        fresh[update_key(update)] = record
+                except Exception as e:
+                    logging.error(f"Erro ao aplicar gossip de {addr}: {e}", exc_info=True)
+            if fresh:
+                # Boato: repassa o que era novidade aqui.
+                self.applied_records += len(fresh)
+                with self.lock:
+                    self.pending.update(fresh)
+
+    def stats(self):
+        return {"sent_datagrams": self.sent_datagrams, "sent_records": self.sent_records,
+                "received_records": self.received_records, "applied_records": self.applied_records,
+                "rejected_datagrams": self.rejected_datagrams, "pending": len(self.pending)}
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Intervalo de anúncio adaptativo do tracker.
+
+Com um intervalo fixo, a carga do tracker cresce linearmente com o número de peers.
+O controlador escolhe o intervalo que os peers devem usar entre anúncios a partir da
+carga medida:
+
+    taxa alvo  = min(taxa configurada, utilização alvo / custo de CPU por mensagem)
+    mensagens por peer a cada intervalo = taxa medida * intervalo em uso / peers (>= 1)
+    intervalo  = peers * mensagens por peer / taxa alvo
+
+limitado a [min_interval, max_interval]. Taxa e custo são médias móveis exponenciais.
+Os peers só adotam um intervalo novo no anúncio seguinte, então quem anuncia agora
+recebeu o intervalo I no momento t com t + I <= agora: o "intervalo em uso" é o mais
+recente desses, não o atual (usar o atual realimentaria o próprio aumento enquanto
+a taxa medida ainda não respondeu). Além disso, o intervalo muda no máximo por um
+fator MAX_STEP a cada atualização. Cada resposta sai
+com um jitter de ±jitter para os peers não se sincronizarem em rajadas.
+
+O controlador também informa o prazo de expiração dos peers: um peer vivo pode ter
+recebido qualquer intervalo anunciado dentro do próprio prazo, então o prazo cobre o
+maior intervalo recente (ver `peer_timeout`).
+"""
+
+import random
+from collections import deque
+
+MAX_STEP = 1.5          # Maior fator de mudança do intervalo por atualização.
+SMOOTHING = 0.3         # Peso da medição mais recente nas médias móveis.
+MAX_MESSAGES_PER_PEER = 20 # Teto para a estimativa de mensagens por peer a cada intervalo.
+
+class IntervalController:
+    """Calcula o intervalo de anúncio a partir dos totais de mensagens e de tempo ocupado."""
+
+    def __init__(self, target_rate, min_interval, max_interval, utilization=0.5, jitter=0.1,
+                 timeout_factor=2.0, min_timeout=0.0):
+        self.target_rate = target_rate   # Mensagens por segundo que o tracker deve sustentar.
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.utilization = utilization   # Fração do tempo de CPU que as mensagens podem ocupar.
+        self.jitter = jitter
+        self.timeout_factor = timeout_factor
+        self.min_timeout = min_timeout
+        self.interval = float(min_interval)
+        self.rate = None                 # Mensagens por segundo (média móvel).
+        self.cost = None                 # Segundos de CPU por mensagem (média móvel).
+        self.last = None                 # (momento, mensagens, tempo ocupado) da última atualização.
+        self.advertised = deque()        # (momento, intervalo): intervalos anunciados recentemente.
+        self.timeout = max(min_timeout, timeout_factor * self.interval * (1 + jitter))
+
+    def update(self, now, messages, busy, peers):
+        """Recalcula o intervalo. `messages` e `busy` são totais acumulados desde o início
+        (mensagens tratadas e segundos gastos nelas); `peers` é quantos peers anunciam aqui.
+        """
+        last, self.last = self.last, (now, messages, busy)
+        if last is None or now <= last[0]:
+            return self.interval
+        elapsed = now - last[0]
+        handled = messages - last[1]
+        rate = handled / elapsed
+        self.rate = rate if self.rate is None else self.rate + SMOOTHING * (rate - self.rate)
+        if handled:
+            cost = (busy - last[2]) / handled
+            self.cost = cost if self.cost is None else self.cost + SMOOTHING * (cost - self.cost)
+
+        target = self.target_rate
+        if self.cost:
+            target = min(target, self.utilization / self.cost)
+        if peers:
+            in_use = self.min_interval
+            for moment, interval in self.advertised:
+                if moment + interval <= now:
+                    in_use = interval
+            per_peer = min(MAX_MESSAGES_PER_PEER, max(1.0, self.rate * in_use / peers))
+            wanted = peers * per_peer / target
+        else:
+            wanted = self.min_interval
+        wanted = min(max(wanted, self.interval / MAX_STEP), self.interval * MAX_STEP)
+        self.interval = min(max(wanted, self.min_interval), self.max_interval)
+
+        # Prazo de expiração: cobre o maior intervalo anunciado dentro do próprio prazo.
+        self.advertised.append((now, self.interval))
+        while self.advertised and self.advertised[0][0] < now - max(self.timeout, self.interval):
+            self.advertised.popleft()
+        longest = max(interval for _, interval in self.advertised)
+        self.timeout = max(self.min_timeout, self.timeout_factor * longest * (1 + self.jitter))
+        return self.interval
+
+    def announce_interval(self):
+        """(intervalo, intervalo mínimo) para uma resposta, em segundos inteiros, com jitter."""
+        interval = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(1, round(interval)), max(1, round(self.interval / 2))
+
+    def peer_timeout(self):
+        return self.timeout
+
+    def is_stale(self, gap):
+        """Indica se um peer que anunciou `gap` segundos depois do anúncio anterior está
+        usando um intervalo diferente do atual (fora da faixa de jitter, com folga).
+        """
+        return abs(gap - self.interval) > (self.jitter + 0.1) * self.interval
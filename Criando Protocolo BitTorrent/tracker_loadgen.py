@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""Gerador de carga para o tracker UDP (protocolo de texto).
+
+Simula N peers virtuais em um único processo. Cada peer entra com JOIN e depois anuncia
+em carga aberta (intervalos exponenciais, independentes das respostas), com HAVEs de um
+pedaço novo, UPDATEs completos e novos JOINs na proporção configurada. Com --churn, uma
+fração dos peers por segundo sai do enxame e é substituída por um peer novo.
+
+As respostas são casadas com as requisições para medir a latência: o JOIN é respondido
+pela PEERLIST (ou pela primeira PEERPAGE) seguida de um INTERVAL, e o UPDATE por um
+INTERVAL. Cada socket UDP é compartilhado por vários peers virtuais e o tracker responde
+na ordem em que recebeu, então a primeira requisição pendente do tipo certo no socket é
+a respondida. Uma requisição sem resposta em RESPONSE_TIMEOUT conta como perdida.
+
+O relatório (vazão, percentis de latência por comando, tamanhos das respostas e perdas)
+pode ser gravado em JSON com --json, para servir de linha de base: com a mesma --seed e os
+mesmos parâmetros, a carga gerada é a mesma.
+
+Exemplo, com um tracker próprio (sem limite de taxa, já que todos os peers saem do mesmo IP):
+    python tracker_loadgen.py --spawn --peers 5000 --rate 2 --duration 30 --json base.json
+"""
+
+import argparse
+import heapq
+import json
+import os
+import random
+import selectors
+import socket
+import subprocess
+import sys
+import time
+from collections import deque
+
+# --- Configuração ---
+LOCAL_HOST = '127.0.0.1'
+RESPONSE_TIMEOUT = 2.0   # Segundos até considerar uma requisição sem resposta como perdida.
+FIRST_TCP_PORT = 20000   # Porta TCP (anunciada) do primeiro peer virtual.
+MAX_DATAGRAM_SIZE = 65535
+# ---------------------
+
+class VirtualPeer:
+    """Estado de um peer virtual: porta anunciada, pedaços e sequência de HAVE."""
+    __slots__ = ('tcp_port', 'pieces', 'seq', 'joined', 'sock')
+
+    def __init__(self, tcp_port, pieces, sock):
+        self.tcp_port = tcp_port
+        self.pieces = pieces   # set dos pedaços possuídos.
+        self.seq = 0
+        self.joined = False
+        self.sock = sock
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+def summarize(values):
+    """Resumo (p50/p90/p99/máximo/média) de uma lista de valores."""
+    values = sorted(values)
+    return {"count": len(values), "p50": percentile(values, 0.50), "p90": percentile(values, 0.90),
+            "p99": percentile(values, 0.99), "max": values[-1] if values else 0.0,
+            "mean": sum(values) / len(values) if values else 0.0}
+
+class LoadGenerator:
+    """Envia a carga e casa as respostas do tracker com as requisições pendentes."""
+
+    def __init__(self, tracker_addr, args):
+        self.tracker_addr = tracker_addr
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.swarm = bytes(self.random.randrange(256) for _ in range(20)).hex()
+        self.selector = selectors.DefaultSelector()
+        self.sockets = []
+        for _ in range(args.sockets):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+            sock.setblocking(False)
+            sock.bind((LOCAL_HOST if tracker_addr[0] == LOCAL_HOST else '0.0.0.0', 0))
+            self.selector.register(sock, selectors.EVENT_READ)
+            self.sockets.append(sock)
+        # Por socket: requisições aguardando resposta, em ordem de envio: (comando, enviado_em).
+        self.pending = {sock: deque() for sock in self.sockets}
+        # Por socket: INTERVALs que ainda vão chegar depois de PEERLISTs já recebidas.
+        self.join_intervals = {sock: 0 for sock in self.sockets}
+        self.next_tcp_port = FIRST_TCP_PORT
+        self.peers = [self.new_peer(i) for i in range(args.peers)]
+
+        self.sent = {"JOIN": 0, "UPDATE": 0, "HAVE": 0}
+        self.sent_bytes = 0
+        self.latencies = {"JOIN": [], "UPDATE": []}
+        self.lost = {"JOIN": 0, "UPDATE": 0}
+        self.response_sizes = {}  # { tipo de resposta: [tamanhos] }
+        self.resyncs = 0
+        self.churned = 0
+        self.max_lag = 0.0
+
+    def new_peer(self, index):
+        pieces = {piece for piece in range(self.args.pieces) if self.random.random() < self.args.fill}
+        peer = VirtualPeer(self.next_tcp_port, pieces, self.sockets[index % len(self.sockets)])
+        self.next_tcp_port += 1
+        return peer
+
+    def send(self, peer, command, message, expects_reply):
+        peer.sock.sendto(message, self.tracker_addr)
+        self.sent[command] += 1
+        self.sent_bytes += len(message)
+        if expects_reply:
+            self.pending[peer.sock].append((command, time.perf_counter()))
+
+    def announce(self, peer):
+        """Próximo anúncio do peer: JOIN na entrada ou pela --join-ratio; HAVE de um pedaço
+        novo pela --have-ratio (enquanto houver pedaços faltando); senão, UPDATE completo.
+        """
+        args = self.args
+        swarm = f"swarm={self.swarm}"
+        if not peer.joined or self.random.random() < args.join_ratio:
+            peer.joined = True
+            message = f"JOIN {LOCAL_HOST} {peer.tcp_port} numwant={args.numwant} total={args.pieces} {swarm}"
+            self.send(peer, "JOIN", message.encode("utf-8"), True)
+        elif self.random.random() < args.have_ratio and len(peer.pieces) < args.pieces:
+            missing = self.random.randrange(args.pieces)
+            while missing in peer.pieces:
+                missing = (missing + 1) % args.pieces
+            peer.pieces.add(missing)
+            peer.seq += 1
+            self.send(peer, "HAVE", f"HAVE {peer.tcp_port} {peer.seq} [{missing}] {swarm}".encode("utf-8"), False)
+        else:
+            pieces_str = ",".join(map(str, sorted(peer.pieces)))
+            peer.seq = 0
+            self.send(peer, "UPDATE", f"UPDATE {peer.tcp_port} [{pieces_str}] {swarm}".encode("utf-8"), True)
+
+    def match(self, sock, command, now):
+        """Tira da fila do socket a primeira requisição pendente do comando e mede a latência."""
+        pending = self.pending[sock]
+        for position, (pending_command, sent_at) in enumerate(pending):
+            if pending_command == command:
+                del pending[position]
+                self.latencies[command].append(now - sent_at)
+                return True
+        return False
+
+    def receive(self, sock):
+        while True:
+            try:
+                data = sock.recv(MAX_DATAGRAM_SIZE)
+            except BlockingIOError:
+                return
+            now = time.perf_counter()
+            kind = data.split(b" ", 1)[0].decode("utf-8", "replace")
+            self.response_sizes.setdefault(kind, []).append(len(data))
+            if kind == "PEERLIST" or (kind == "PEERPAGE" and data.split(b" ", 3)[2] == b"0"):
+                if self.match(sock, "JOIN", now):
+                    self.join_intervals[sock] += 1
+            elif kind == "INTERVAL":
+                if self.join_intervals[sock]:
+                    self.join_intervals[sock] -= 1 # INTERVAL que acompanha a resposta de um JOIN.
+                else:
+                    self.match(sock, "UPDATE", now)
+            elif kind == "RESYNC":
+                self.resyncs += 1
+
+    def expire(self, now):
+        for pending in self.pending.values():
+            while pending and now - pending[0][1] > RESPONSE_TIMEOUT:
+                command, _ = pending.popleft()
+                self.lost[command] += 1
+
+    def run(self):
+        args = self.args
+        rate = args.rate
+        start = time.perf_counter()
+        end = start + args.duration
+        # Agenda de anúncios: (momento, desempate, índice do peer). Todos entram ao longo de --ramp.
+        schedule = [(start + self.random.uniform(0, args.ramp), i, i) for i in range(len(self.peers))]
+        heapq.heapify(schedule)
+        tiebreak = len(self.peers)
+        next_churn = start + (self.random.expovariate(args.churn * len(self.peers)) if args.churn else args.duration + 1)
+        now = start
+        while now < end:
+            while schedule and schedule[0][0] <= now:
+                due, _, index = heapq.heappop(schedule)
+                self.max_lag = max(self.max_lag, now - due)
+                self.announce(self.peers[index])
+                tiebreak += 1
+                heapq.heappush(schedule, (due + self.random.expovariate(rate), tiebreak, index))
+            while next_churn <= now:
+                # Um peer sai (para de anunciar e expira no tracker) e outro entra no lugar.
+                index = self.random.randrange(len(self.peers))
+                self.peers[index] = self.new_peer(index)
+                self.churned += 1
+                next_churn += self.random.expovariate(args.churn * len(self.peers))
+            timeout = max(0.0, min(schedule[0][0] if schedule else end, end) - time.perf_counter())
+            for key, _ in self.selector.select(timeout=min(timeout, 0.01)):
+                self.receive(key.fileobj)
+            now = time.perf_counter()
+            self.expire(now)
+        send_done = time.perf_counter()
+
+        # Espera as últimas respostas; o que não chegar até lá conta como perdido.
+        while any(self.pending.values()) and time.perf_counter() - send_done < RESPONSE_TIMEOUT:
+            for key, _ in self.selector.select(timeout=0.05):
+                self.receive(key.fileobj)
+        self.expire(float("inf"))
+        for sock in self.sockets:
+            sock.close()
+        return self.report(send_done - start)
+
+    def report(self, elapsed):
+        args = self.args
+        sent = sum(self.sent.values())
+        replies = sum(len(sizes) for sizes in self.response_sizes.values())
+        return {
+            "parameters": {key: value for key, value in vars(args).items() if key not in ("json", "tracker_args")},
+            "elapsed": elapsed,
+            "sent": dict(self.sent),
+            "sent_bytes": self.sent_bytes,
+            "offered_rate": args.peers * args.rate,
+            "send_rate": sent / elapsed,
+            "reply_rate": replies / elapsed,
+            "max_generator_lag": self.max_lag,
+            "latency": {command: summarize(values) for command, values in self.latencies.items()},
+            "lost": dict(self.lost),
+            "responses": {kind: {"count": len(sizes), "bytes": sum(sizes), "mean": sum(sizes) / len(sizes),
+                                 "max": max(sizes)} for kind, sizes in self.response_sizes.items()},
+            "resyncs": self.resyncs,
+            "churned": self.churned,
+        }
+
+def print_report(report):
+    sent = report["sent"]
+    print(f"Duração: {report['elapsed']:.1f}s | Peers virtuais: {report['parameters']['peers']} | "
+          f"Pedaços: {report['parameters']['pieces']} | Churn: {report['churned']} peers substituídos")
+    print(f"Enviados: {sent['JOIN']} JOIN, {sent['UPDATE']} UPDATE, {sent['HAVE']} HAVE "
+          f"({report['sent_bytes'] / 1024:.0f} KiB)")
+    print(f"Vazão: {report['send_rate']:.0f} msg/s enviadas (oferecidas: {report['offered_rate']:.0f}), "
+          f"{report['reply_rate']:.0f} respostas/s | atraso máximo do gerador: {report['max_generator_lag'] * 1000:.1f} ms")
+    for command, stats in report["latency"].items():
+        total = stats["count"] + report["lost"][command]
+        loss = report["lost"][command] / total if total else 0.0
+        print(f"  {command:>6}: {stats['count']} respondidos, {report['lost'][command]} perdidos ({loss:.1%}) | "
+              f"p50 {stats['p50'] * 1000:.2f} ms, p90 {stats['p90'] * 1000:.2f} ms, "
+              f"p99 {stats['p99'] * 1000:.2f} ms, máx {stats['max'] * 1000:.2f} ms")
+    for kind, stats in sorted(report["responses"].items()):
+        print(f"  {kind:>10}: {stats['count']} respostas, {stats['bytes'] / 1024:.0f} KiB "
+              f"(média {stats['mean']:.0f} B, máx {stats['max']} B)")
+    if report["resyncs"]:
+        print(f"  RESYNCs recebidos: {report['resyncs']}")
+
+def free_udp_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind((LOCAL_HOST, 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def spawn_tracker(extra_args):
+    """Inicia um tracker_v3.py local numa porta livre, sem limite de taxa (os peers virtuais
+    saem todos do mesmo IP), e retorna (processo, endereço).
+    """
+    port = free_udp_port()
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tracker_v3.py")
+    command = [sys.executable, script, "--host", LOCAL_HOST, "--port", str(port), "--log-level", "ERROR",
+               "--rate-limit-ip", "0", "--rate-limit-global", "0"] + extra_args
+    process = subprocess.Popen(command)
+    time.sleep(1.0) # Dá tempo para o socket ser vinculado.
+    return process, (LOCAL_HOST, port)
+
+def main():
+    parser = argparse.ArgumentParser(description="Gerador de carga para o tracker UDP (protocolo de texto).")
+    parser.add_argument("--tracker", default=f"{LOCAL_HOST}:10000", help="Endereço do tracker (ip:porta).")
+    parser.add_argument("--spawn", action="store_true",
+                        help="Inicia um tracker_v3.py local (sem limite de taxa) em vez de usar --tracker.")
+    parser.add_argument("--tracker-args", default="", help="Argumentos extras para o tracker iniciado com --spawn.")
+    parser.add_argument("--peers", type=int, default=1000, help="Peers virtuais.")
+    parser.add_argument("--pieces", type=int, default=1000, help="Pedaços do arquivo.")
+    parser.add_argument("--fill", type=float, default=0.5, help="Fração dos pedaços que cada peer já tem ao entrar.")
+    parser.add_argument("--rate", type=float, default=1.0, help="Anúncios por segundo de cada peer.")
+    parser.add_argument("--have-ratio", type=float, default=0.8, help="Fração dos anúncios que são HAVE.")
+    parser.add_argument("--join-ratio", type=float, default=0.05, help="Fração dos anúncios que são novos JOINs.")
+    parser.add_argument("--numwant", type=int, default=50, help="Peers pedidos em cada JOIN.")
+    parser.add_argument("--churn", type=float, default=0.0, help="Fração dos peers substituída por segundo.")
+    parser.add_argument("--ramp", type=float, default=1.0, help="Segundos em que os peers fazem o primeiro JOIN.")
+    parser.add_argument("--duration", type=float, default=10.0, help="Segundos de carga.")
+    parser.add_argument("--sockets", type=int, default=64, help="Sockets UDP compartilhados pelos peers virtuais.")
+    parser.add_argument("--seed", type=int, default=1, help="Semente da carga (mesma semente, mesma carga).")
+    parser.add_argument("--json", metavar="ARQUIVO", help="Grava o relatório em JSON (linha de base para comparações).")
+    args = parser.parse_args()
+
+    process = None
+    if args.spawn:
+        process, tracker_addr = spawn_tracker(args.tracker_args.split())
+    else:
+        host, port = args.tracker.rsplit(":", 1)
+        tracker_addr = (host, int(port))
+    try:
+        report = LoadGenerator(tracker_addr, args).run()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
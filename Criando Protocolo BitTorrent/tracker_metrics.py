@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""Métricas do tracker no formato de texto do Prometheus, servidas por HTTP (GET /metrics).
+
+O caminho quente só incrementa contadores e histogramas em memória, cada thread nos
+seus (sem lock); a soma das threads e a formatação acontecem apenas quando o endpoint
+é lido.
+Valores que já existem em outras estruturas (peers nos enxames, descartes do
+limitador de taxa, ...) não são duplicados: funções registradas com `add_collector`
+os leem no momento da coleta.
+"""
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Limites superiores dos baldes dos histogramas, em segundos.
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+LOCK_WAIT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+
+class Histogram:
+    """Histograma com baldes fixos; `observe` é uma busca binária e dois incrementos."""
+
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # O último balde é o +Inf.
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def merge(self, other):
+        """Soma as observações de `other` (mesmos baldes) a este histograma."""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+
+    def render(self, name, labels=""):
+        lines = []
+        cumulative = 0
+        separator = "," if labels else ""
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {cumulative}")
+        return lines
+
+class ThreadCounters:
+    """Contadores de uma thread do tracker. Só a própria thread escreve neles; a leitura
+    (`Metrics.render`) copia cada estrutura de uma vez, o que o GIL torna atômico.
+    """
+
+    __slots__ = ('messages', 'parse_errors', 'dropped', 'response_bytes', 'responses', 'lock_wait')
+
+    def __init__(self):
+        self.messages = {}       # { comando: Histogram da latência de tratamento }
+        self.parse_errors = {}   # { comando: mensagens inválidas }
+        self.dropped = {}        # { motivo: datagramas descartados antes do tratamento }
+        self.response_bytes = 0
+        self.responses = 0
+        self.lock_wait = Histogram(LOCK_WAIT_BUCKETS)
+
+class Metrics:
+    """Contadores e histogramas do tracker. Os métodos `observe_*`/`count_*` são os do
+    caminho quente: cada thread escreve nos seus `ThreadCounters`, sem lock, e a leitura
+    soma as threads (ver `merged`).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock() # Protege a lista de `ThreadCounters` (não os contadores).
+        self.local = threading.local()
+        self.threads = []            # ThreadCounters de todas as threads que já registraram algo.
+        self.collectors = []
+
+    def counters(self):
+        """Contadores da thread atual, criados no primeiro uso."""
+        try:
+            return self.local.counters
+        except AttributeError:
+            counters = self.local.counters = ThreadCounters()
+            with self.lock:
+                self.threads.append(counters)
+            return counters
+
+    def observe_message(self, command, seconds):
+        messages = self.counters().messages
+        histogram = messages.get(command)
+        if histogram is None:
+            histogram = messages[command] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(seconds)
+
+    def count_parse_error(self, command):
+        parse_errors = self.counters().parse_errors
+        parse_errors[command] = parse_errors.get(command, 0) + 1
+
+    def count_dropped(self, reason):
+        dropped = self.counters().dropped
+        dropped[reason] = dropped.get(reason, 0) + 1
+
+    def count_response(self, size):
+        counters = self.counters()
+        counters.responses += 1
+        counters.response_bytes += size
+
+    def observe_lock_wait(self, seconds):
+        self.counters().lock_wait.observe(seconds)
+
+    def merged(self):
+        """ThreadCounters com a soma de todas as threads."""
+        with self.lock:
+            threads = list(self.threads)
+        total = ThreadCounters()
+        for counters in threads:
+            for command, histogram in dict(counters.messages).items():
+                total.messages.setdefault(command, Histogram(LATENCY_BUCKETS)).merge(histogram)
+            for command, count in dict(counters.parse_errors).items():
+                total.parse_errors[command] = total.parse_errors.get(command, 0) + count
+            for reason, count in dict(counters.dropped).items():
+                total.dropped[reason] = total.dropped.get(reason, 0) + count
+            total.responses += counters.responses
+            total.response_bytes += counters.response_bytes
+            total.lock_wait.merge(counters.lock_wait)
+        return total
+
+    def totals(self):
+        """(mensagens tratadas, segundos gastos nelas) somando todos os comandos."""
+        messages = self.merged().messages.values()
+        return sum(sum(h.counts) for h in messages), sum(h.sum for h in messages)
+
+    def lock_wait_totals(self):
+        """(aquisições disputadas, segundos de espera) somando todos os locks medidos."""
+        lock_wait = self.merged().lock_wait
+        return sum(lock_wait.counts), lock_wait.sum
+
+    def add_collector(self, collector):
+        """Registra uma função que retorna [(nome, tipo, ajuda, [(rótulos, valor)])] na hora da coleta."""
+        self.collectors.append(collector)
+
+    def render(self):
+        """Todas as métricas no formato de texto do Prometheus (versão 0.0.4)."""
+        total = self.merged()
+        messages = {command: (h.counts, h.sum) for command, h in total.messages.items()}
+        parse_errors, dropped, lock_wait = total.parse_errors, total.dropped, total.lock_wait
+        response_bytes, responses = total.response_bytes, total.responses
+
+        lines = ["# HELP tracker_messages_total Mensagens tratadas, por comando.",
+                 "# TYPE tracker_messages_total counter"]
+        for command, (counts, _) in sorted(messages.items()):
+            lines.append(f'tracker_messages_total{{command="{command}"}} {sum(counts)}')
+        lines += ["# HELP tracker_message_seconds Tempo de tratamento de cada mensagem, por comando.",
+                  "# TYPE tracker_message_seconds histogram"]
+        for command, (counts, total) in sorted(messages.items()):
+            histogram = Histogram(LATENCY_BUCKETS)
+            histogram.counts, histogram.sum = counts, total
+            lines += histogram.render("tracker_message_seconds", f'command="{command}"')
+        lines += ["# HELP tracker_parse_errors_total Mensagens inválidas, por comando.",
+                  "# TYPE tracker_parse_errors_total counter"]
+        lines += [f'tracker_parse_errors_total{{command="{command}"}} {count}'
+                  for command, count in sorted(parse_errors.items())]
+        lines += ["# HELP tracker_datagrams_dropped_total Datagramas descartados antes do tratamento, por motivo.",
+                  "# TYPE tracker_datagrams_dropped_total counter"]
+        lines += [f'tracker_datagrams_dropped_total{{reason="{reason}"}} {count}'
+                  for reason, count in sorted(dropped.items())]
+        lines += ["# HELP tracker_responses_total Datagramas enviados aos peers.",
+                  "# TYPE tracker_responses_total counter",
+                  f"tracker_responses_total {responses}",
+                  "# HELP tracker_response_bytes_total Bytes enviados aos peers.",
+                  "# TYPE tracker_response_bytes_total counter",
+                  f"tracker_response_bytes_total {response_bytes}",
+                  "# HELP tracker_lock_wait_seconds Espera pelos locks dos enxames (só aquisições disputadas).",
+                  "# TYPE tracker_lock_wait_seconds histogram"]
+        lines += lock_wait.render("tracker_lock_wait_seconds")
+        for collector in self.collectors:
+            for name, kind, help_text, samples in collector():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                for labels, value in samples:
+                    labels = "{" + ",".join(f'{key}="{val}"' for key, val in labels.items()) + "}" if labels else ""
+                    lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+class TimedLock:
+    """Lock que mede a espera nas aquisições disputadas.
+    A aquisição sem disputa (o caso comum) é só uma tentativa não bloqueante; o relógio
+    só é lido quando o lock já está com outra thread.
+    """
+
+    __slots__ = ('lock', 'metrics')
+
+    def __init__(self, metrics):
+        self.lock = threading.Lock()
+        self.metrics = metrics
+
+    def __enter__(self):
+        if not self.lock.acquire(False):
+            start = time.perf_counter()
+            self.lock.acquire()
+            self.metrics.observe_lock_wait(time.perf_counter() - start)
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+def start_metrics_server(metrics, host, port):
+    """Serve `metrics.render()` em http://host:port/metrics numa thread daemon e retorna o servidor."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # Não polui o log do tracker a cada coleta.
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="Metrics", daemon=True).start()
+    return server
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Limitação de taxa dos datagramas recebidos pelo tracker (token buckets).
+
+Cada datagrama passa por dois baldes antes de ser analisado: o do IP de origem e o
+global. Um balde acumula `rate` fichas por segundo até `burst`; cada datagrama gasta
+uma ficha e, sem fichas, é descartado. O balde do IP vem primeiro, então um peer que
+inunda o tracker esgota apenas o próprio balde e não as fichas globais dos demais.
+
+Os baldes são atualizados de forma preguiçosa (as fichas são repostas no momento da
+consulta, pelo tempo decorrido), então cada verificação é O(1) e não há thread de
+reposição. Os baldes por IP ficam em um OrderedDict usado como LRU com no máximo
+`max_sources` entradas: o IP menos recente é esquecido (e volta com o balde cheio),
+o que limita a memória mesmo sob datagramas com origens forjadas.
+"""
+
+import time
+from collections import OrderedDict
+
+class RateLimiter:
+    """Baldes por IP e global. `allow` é chamado só pela thread que recebe os datagramas."""
+
+    def __init__(self, source_rate, source_burst, global_rate, global_burst, max_sources=65536):
+        self.source_rate = source_rate   # Fichas por segundo de cada IP (0 = sem limite por IP).
+        self.source_burst = source_burst
+        self.global_rate = global_rate   # Fichas por segundo do tracker inteiro (0 = sem limite global).
+        self.global_burst = global_burst
+        self.max_sources = max_sources
+        self.sources = OrderedDict()     # { ip: [fichas, momento da última reposição] }
+        self.global_tokens = float(global_burst)
+        self.global_updated = None       # Momento da última reposição do balde global.
+        # Contadores do que foi aceito e descartado, para relatórios.
+        self.allowed = 0
+        self.dropped_source = 0
+        self.dropped_global = 0
+        self.evicted = 0
+
+    def allow(self, ip, now=None):
+        """Gasta uma ficha do balde do IP e uma do global; False se o datagrama deve ser descartado."""
+        if now is None:
+            now = time.monotonic()
+        if self.source_rate:
+            bucket = self.sources.get(ip)
+            if bucket is None:
+                if len(self.sources) >= self.max_sources:
+                    self.sources.popitem(last=False)
+                    self.evicted += 1
+                bucket = self.sources[ip] = [float(self.source_burst), now]
+            else:
+                self.sources.move_to_end(ip)
+                bucket[0] = min(self.source_burst, bucket[0] + (now - bucket[1]) * self.source_rate)
+                bucket[1] = now
+            if bucket[0] < 1.0:
+                self.dropped_source += 1
+                return False
+        if self.global_rate:
+            if self.global_updated is not None:
+                self.global_tokens = min(self.global_burst,
+                                         self.global_tokens + (now - self.global_updated) * self.global_rate)
+            self.global_updated = now
+            if self.global_tokens < 1.0:
+                self.dropped_global += 1
+                return False
+            self.global_tokens -= 1.0
+        if self.source_rate:
+            bucket[0] -= 1.0
+        self.allowed += 1
+        return True
+
+    def dropped(self):
+        return self.dropped_source + self.dropped_global
+
+    def stats(self):
+        return {"allowed": self.allowed, "dropped_source": self.dropped_source,
+                "dropped_global": self.dropped_global, "tracked_sources": len(self.sources),
+                "evicted_sources": self.evicted}
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Snapshot do estado do tracker em disco, para reinícios sem perder os enxames.
+
+O arquivo é um log só de acréscimo: um cabeçalho seguido de registros
+
+    PUT   tipo (uint8) | info_hash (20 bytes) | ip (4 bytes) | porta_tcp (uint16) |
+          tamanho_máscara (uint32) | máscara de pedaços (int little-endian)
+    DEL   tipo (uint8) | info_hash (20 bytes) | ip (4 bytes) | porta_tcp (uint16) | 0 (uint32)
+    SWARM tipo (uint8) | info_hash (20 bytes) | 0 (4 bytes) | 0 (uint16) | 8 (uint32) |
+          total de pedaços (uint32) | downloads concluídos (uint32)
+
+O estado é o resultado de aplicar os registros em ordem (vale o último PUT de um
+peer e o último SWARM de um enxame; um DEL remove o peer). De tempos em tempos o log
+é compactado: o estado atual é escrito em um arquivo novo, que substitui o antigo com
+os.replace (atômico). Um registro incompleto no final (tracker morto no meio de uma
+escrita) é ignorado.
+"""
+
+import os
+import socket
+import struct
+
+MAGIC = b"TRKSNAP1"
+
+OP_PUT = 1
+OP_DEL = 2
+OP_SWARM = 3
+
+RECORD = struct.Struct("!B20s4sHI")
+SWARM_INFO = struct.Struct("!II")
+NO_IP = bytes(4)
+
+class SnapshotError(ValueError):
+    """Arquivo de snapshot que não é deste formato."""
+
+def encode_put(info_hash, ip, tcp_port, pieces):
+    mask = pieces.to_bytes((pieces.bit_length() + 7) >> 3, "little")
+    return RECORD.pack(OP_PUT, info_hash, socket.inet_aton(ip), tcp_port, len(mask)) + mask
+
+def encode_del(info_hash, ip, tcp_port):
+    return RECORD.pack(OP_DEL, info_hash, socket.inet_aton(ip), tcp_port, 0)
+
+def encode_swarm(info_hash, total_pieces, completed):
+    return RECORD.pack(OP_SWARM, info_hash, NO_IP, 0, SWARM_INFO.size) + SWARM_INFO.pack(total_pieces, completed)
+
+def read_log(path):
+    """Lê o log e retorna o estado final como (peers, enxames):
+    peers = { (info_hash, ip, porta_tcp): máscara } e
+    enxames = { info_hash: (total de pedaços, downloads concluídos) }.
+    Um arquivo inexistente é um estado vazio.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return {}, {}
+    if not data.startswith(MAGIC):
+        raise SnapshotError(f"{path} não é um snapshot do tracker")
+
+    state = {}
+    swarm_info = {}
+    offset = len(MAGIC)
+    unpack_from = RECORD.unpack_from
+    inet_ntoa = socket.inet_ntoa
+    from_bytes = int.from_bytes
+    end = len(data)
+    while offset + RECORD.size <= end:
+        op, info_hash, packed_ip, tcp_port, mask_len = unpack_from(data, offset)
+        offset += RECORD.size
+        if offset + mask_len > end:
+            break # Registro truncado no final: o tracker parou no meio da escrita.
+        if op == OP_PUT:
+            state[(info_hash, inet_ntoa(packed_ip), tcp_port)] = from_bytes(data[offset:offset + mask_len], "little")
+        elif op == OP_DEL:
+            state.pop((info_hash, inet_ntoa(packed_ip), tcp_port), None)
+        elif op == OP_SWARM:
+            swarm_info[info_hash] = SWARM_INFO.unpack_from(data, offset)
+        else:
+            raise SnapshotError(f"Registro desconhecido ({op}) na posição {offset - RECORD.size}")
+        offset += mask_len
+    return state, swarm_info
+
+class SnapshotLog:
+    """Arquivo de log aberto para acréscimo, com compactação."""
+
+    def __init__(self, path):
+        self.path = path
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self.file = open(path, "ab")
+        if not exists:
+            self.file.write(MAGIC)
+            self.file.flush()
+        self.compacted_size = self.file.tell() # Tamanho logo após a última compactação.
+
+    def size(self):
+        return self.file.tell()
+
+    def append(self, records):
+        """Acrescenta registros já codificados e força a escrita no disco."""
+        if not records:
+            return
+        self.file.write(b"".join(records))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def compact(self, records):
+        """Substitui o log por um contendo só `records` (PUTs do estado atual)."""
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(b"".join(records))
+            f.flush()
+            os.fsync(f.fileno())
+        self.file.close()
+        os.replace(temp_path, self.path)
+        self.file = open(self.path, "ab")
+        self.compacted_size = self.file.tell()
+
+    def close(self):
+        self.file.close()
@@ -4,12 +4,61 @@ import socket
 import threading
 import time
 import logging
+import argparse
+import asyncio
+import contextlib
+import heapq
+import itertools
+import operator
+import random
+import struct
+import os
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import binary_protocol
+import tracker_snapshot
+import tracker_ratelimit
+import tracker_metrics
+import tracker_interval
+import tracker_gossip
+import tracker_capture
 
 # --- Configuração ---
 TRACKER_HOST = '0.0.0.0' # O tracker escutará em todas as interfaces disponíveis.
 TRACKER_PORT = 10000      # Porta UDP para o servidor do tracker.
-PEER_TIMEOUT = 60       # Tempo em segundos antes de considerar um peer inativo e removê-lo.
+PEER_TIMEOUT = 60       # Prazo mínimo em segundos antes de considerar um peer inativo e removê-lo.
+EXPIRY_TICK = 1.0        # Intervalo em segundos entre as verificações de peers vencidos.
 LOG_LEVEL = logging.INFO # Nível de log para exibição de mensagens.
+ASYNC_WORKERS = 4        # Threads que processam mensagens no modo asyncio.
+MAX_PENDING_DATAGRAMS = 10000 # Máximo de mensagens aguardando processamento no modo asyncio.
+DEFAULT_NUMWANT = 50     # Peers devolvidos num JOIN quando o peer não informa numwant.
+MAX_NUMWANT = 200        # Limite superior para o numwant pedido pelo peer.
+RANDOM_PEER_FRACTION = 0.2 # Fração da PEERLIST preenchida com peers aleatórios (diversidade).
+MAX_DATAGRAM_SIZE = 65535 # Maior datagrama UDP aceito (um bitfield de 10k pedaços já passa de 1 KB).
+MAX_PIECES = 65536       # Maior total de pedaços (e índice + 1) aceito dos peers (6,4 GB com pedaços de 100 KB).
+MAX_TOTAL_CANDIDATES = 8 # Totais diferentes de pedaços contados por enxame quando os peers discordam.
+PEERLIST_MTU = 1400      # Tamanho máximo de cada datagrama de PEERLIST; listas maiores vão em páginas.
+MIN_PEERLIST_MTU = 512   # Menor MTU aceita no JOIN (evita respostas com milhares de páginas).
+PAGE_CACHE_TTL = 10.0    # Segundos que as páginas de uma resposta ficam guardadas para RESEND.
+PAGE_CACHE_SIZE = 1024   # Máximo de respostas paginadas guardadas para RESEND.
+SNAPSHOT_INTERVAL = 5.0  # Segundos entre as gravações das alterações no snapshot (--snapshot).
+SNAPSHOT_CORRUPT_SUFFIX = ".corrupt" # Sufixo com que um snapshot inválido é guardado antes de começar um novo.
+COMPACT_MIN_BYTES = 1 << 20 # O log do snapshot só é compactado acima deste tamanho...
+COMPACT_FACTOR = 2       # ...e quando passa deste múltiplo do tamanho após a última compactação.
+RATE_LIMIT_PER_IP = 100  # Datagramas por segundo aceitos de cada IP (rajadas de até o dobro; 0 = sem limite).
+RATE_LIMIT_GLOBAL = 20000 # Datagramas por segundo aceitos pelo tracker inteiro (rajadas de até o dobro; 0 = sem limite).
+RATE_LIMIT_SOURCES = 65536 # Máximo de IPs com balde próprio (os menos recentes são esquecidos).
+MIN_ANNOUNCE_INTERVAL = 30 # Intervalo de anúncio pedido aos peers com o tracker folgado (segundos).
+MAX_ANNOUNCE_INTERVAL = 1800 # Maior intervalo de anúncio pedido sob carga.
+TARGET_MESSAGE_RATE = 5000 # Mensagens por segundo que o intervalo adaptativo tenta manter.
+TARGET_UTILIZATION = 0.5 # Fração da CPU de tratamento que as mensagens podem ocupar.
+ANNOUNCE_JITTER = 0.1    # Variação aleatória (±) do intervalo em cada resposta, contra rajadas sincronizadas.
+INTERVAL_ADAPT_PERIOD = 5.0 # Segundos entre os recálculos do intervalo de anúncio.
+PEER_SHARDS = 16         # Partições (cada uma com o seu lock) do índice de peers e do de expiração.
+CLUSTER_PORT_OFFSET = 100 # No modo cluster, o gossip usa por padrão a porta do tracker + este valor.
+CAPTURE_FLUSH_INTERVAL = 1.0 # Segundos entre as descargas do trace (--capture) no arquivo.
 # ---------------------
 
 # --- Configuração de Log ---
@@ -18,168 +67,1453 @@ logging.basicConfig(level=LOG_LEVEL,
 # ---------------------
 
 # --- Estrutura de Dados Global ---
-# Armazena informações dos peers: { 'peer_id': {'ip': str, 'tcp_port': int, 'pieces': set(int), 'last_update': float} }
-# 'peer_id' é uma string no formato 'IP:porta_tcp'.
-# 'ip' é o endereço IP do peer.
-# 'tcp_port' é a porta TCP que o peer está escutando.
-# 'pieces' é um conjunto de índices dos pedaços de arquivo que o peer possui.
-# 'last_update' é o timestamp da última vez que o peer se comunicou com o tracker.
-peers_db = {}
-# Lock para proteger o acesso a 'peers_db' de múltiplas threads, garantindo a segurança dos dados.
-db_lock = threading.Lock() 
+class PeerRecord:
+    """Registro de um peer no tracker.
+    Usa __slots__ (sem __dict__ por instância) e guarda os pedaços como máscara de bits
+    em um int: o bit i ligado significa que o peer possui o pedaço i. Um seeder de
+    10k pedaços ocupa ~1,3 KB, contra ~10k ints em um set.
+
+    Também guarda a entrada já serializada do peer na PEERLIST (texto e binário), junto
+    com a máscara a partir da qual ela foi gerada. A entrada continua válida enquanto
+    `pieces` for o mesmo objeto; `update_peer_pieces` só troca o objeto quando os
+    pedaços realmente mudam.
+    """
+    __slots__ = ('ip', 'tcp_port', 'pieces', 'last_update', 'seq', 'text_fragment', 'binary_fragment')
+
+    def __init__(self, ip, tcp_port, pieces=0, last_update=0.0):
+        self.ip = ip                   # Endereço IP do peer.
+        self.tcp_port = tcp_port       # Porta TCP que o peer está escutando.
+        self.pieces = pieces           # Máscara (int) dos pedaços que o peer possui.
+        self.last_update = last_update # Timestamp da última comunicação com o tracker.
+        self.seq = 0                   # Sequência do último HAVE aplicado (0 após um UPDATE completo).
+        self.text_fragment = None      # (máscara, "ip:porta:[p1,p2]") ou None.
+        self.binary_fragment = None    # (máscara, entrada binária) ou None.
+
+    def text_entry(self, pieces):
+        """Entrada de texto do peer na PEERLIST para a máscara `pieces`, usando o cache."""
+        cached = self.text_fragment
+        if cached is not None and cached[0] is pieces:
+            return cached[1]
+        # Converte a máscara de pedaços para uma string separada por vírgulas (já sai ordenada).
+        pieces_str = ','.join(map(str, binary_protocol.mask_to_pieces(pieces)))
+        entry = f"{self.ip}:{self.tcp_port}:[{pieces_str}]"
+        self.text_fragment = (pieces, entry)
+        return entry
+
+    def binary_entry(self, pieces):
+        """Entrada binária do peer na PEERLIST para a máscara `pieces`, usando o cache."""
+        cached = self.binary_fragment
+        if cached is not None and cached[0] is pieces:
+            return cached[1]
+        entry = binary_protocol.encode_peer_entry(self.ip, self.tcp_port, binary_protocol.mask_to_bitfield(pieces))
+        self.binary_fragment = (pieces, entry)
+        return entry
+
+    def piece_count(self):
+        return self.pieces.bit_count()
+
+    def has_piece(self, piece_index):
+        return (self.pieces >> piece_index) & 1 == 1
+
+    def copy(self):
+        return PeerRecord(self.ip, self.tcp_port, self.pieces, self.last_update)
+
+def pieces_union(records):
+    """Máscara com todos os pedaços disponíveis em pelo menos um dos registros."""
+    union = 0
+    for record in records:
+        union |= record.pieces
+    return union
+
+def pieces_missing(wanted_from, owned_by):
+    """Máscara dos pedaços que `wanted_from` tem e `owned_by` ainda não tem."""
+    return wanted_from.pieces & ~owned_by.pieces
+
+def add_bit_planes(planes, other):
+    """Soma, no lugar, os contadores fatiados por bit `other` a `planes`
+    (somador com propagação de vai-um, uma fatia por vez).
+    """
+    carry = 0
+    for k in range(max(len(planes), len(other))):
+        a = planes[k] if k < len(planes) else 0
+        b = other[k] if k < len(other) else 0
+        partial = a ^ b
+        total = partial ^ carry
+        carry = (a & b) | (carry & partial)
+        if k < len(planes):
+            planes[k] = total
+        else:
+            planes.append(total)
+    if carry:
+        planes.append(carry)
+
+class PeerShard:
+    """Partição do índice de peers de um enxame, com o seu próprio lock.
+    O peer_id decide a partição (ver `Swarm.shard`), então anúncios de peers em
+    partições diferentes do mesmo enxame não disputam o mesmo lock. Cada partição
+    também guarda as estatísticas do SCRAPE dos seus peers, somadas na leitura (ver
+    `Swarm.stats`), para que os anúncios não passem por um lock único do enxame.
+    """
+    __slots__ = ('peers', 'lock', 'seeders', 'completed', 'availability', 'version')
+
+    def __init__(self):
+        # Armazena informações dos peers: { 'peer_id': PeerRecord }
+        # 'peer_id' é uma string no formato 'IP:porta_tcp'.
+        self.peers = {}
+        # Lock para proteger o acesso a 'peers' de múltiplas threads (com a espera medida).
+        self.lock = tracker_metrics.TimedLock(metrics)
+        self.seeders = 0          # Peers da partição com todos os pedaços.
+        self.completed = 0        # Downloads concluídos por peers da partição.
+        self.availability = []    # availability[i] = quantos peers da partição têm o pedaço i.
+        self.version = 0          # Incrementada a cada mudança nas estatísticas da partição.
+
+    def account(self, old, new, full_mask):
+        """Ajusta as estatísticas para um peer cujos pedaços passam de `old` para `new`.
+        Deve ser chamado com o lock da partição.
+        """
+        added = new & ~old
+        removed = old & ~new
+        availability = self.availability
+        if added:
+            if len(availability) < added.bit_length():
+                availability.extend([0] * (added.bit_length() - len(availability)))
+            for index in binary_protocol.mask_to_pieces(added):
+                availability[index] += 1
+        for index in binary_protocol.mask_to_pieces(removed):
+            availability[index] -= 1
+        self.seeders += (new == full_mask) - (old == full_mask)
+        self.version += 1
+
+class Swarm:
+    """Enxame de um conteúdo (identificado pelo info-hash).
+    Cada enxame tem o seu próprio índice de peers, dividido em `peer_shards` partições
+    por hash do peer_id (ver `PeerShard`): um anúncio segura só o lock da partição do
+    peer, e a montagem da PEERLIST copia uma partição de cada vez.
+
+    Também mantém as estatísticas do SCRAPE de forma incremental: toda entrada, saída ou
+    mudança de pedaços de um peer passa por `add_peer`, `remove_peer` ou `set_pieces`,
+    que ajustam só os contadores dos pedaços que mudaram, na partição do peer. Todos
+    devem ser chamados com o lock da partição do peer, que protege o índice e os
+    contadores juntos; o SCRAPE soma as partições (ver `stats`). O `stats_lock` só
+    protege o total de pedaços, o cache do SCRAPE e os votos do total, e é sempre
+    tomado depois dos locks de partição.
+    """
+    __slots__ = ('info_hash', 'shards', 'stats_lock', 'total_pieces', 'full_mask', 'restored_completed',
+                 'total_version', 'scrape_cache', 'total_reports')
+
+    def __init__(self, info_hash):
+        self.info_hash = info_hash # Identificador do conteúdo (20 bytes).
+        self.shards = [PeerShard() for _ in range(peer_shards)]
+        # Lock do total de pedaços, do cache do SCRAPE e dos votos do total.
+        self.stats_lock = tracker_metrics.TimedLock(metrics)
+        self.total_pieces = 0     # Pedaços do arquivo (0 enquanto nenhum peer informou).
+        self.full_mask = None     # Máscara de um seeder; None enquanto o total é desconhecido.
+        self.restored_completed = 0 # Downloads concluídos restaurados do snapshot.
+        self.total_version = 0    # Incrementada a cada mudança do total de pedaços.
+        self.scrape_cache = None  # (versão, resposta de texto, resposta binária)
+        self.total_reports = {}   # { total: peers novos que o informaram no JOIN } (ver `report_total`)
+
+    @property
+    def version(self):
+        """Versão das estatísticas: cresce a cada mudança em qualquer partição ou no total."""
+        return self.total_version + sum(shard.version for shard in self.shards)
+
+    @property
+    def completed(self):
+        """Downloads concluídos (peers que viraram seeders)."""
+        return self.restored_completed + sum(shard.completed for shard in self.shards)
+
+    def restore_completed(self, completed):
+        """Garante ao menos `completed` downloads concluídos (recarga do snapshot)."""
+        with self.stats_lock:
+            self.restored_completed += max(0, completed - self.completed)
+
+    def stats(self):
+        """(seeders, leechers, concluídos, disponibilidade) somando as partições.
+        Segura o lock de uma partição de cada vez, então deve ser chamado sem nenhum.
+        """
+        seeders = peers = 0
+        availability = []
+        for shard in self.shards:
+            with shard.lock:
+                seeders += shard.seeders
+                peers += len(shard.peers)
+                counts = shard.availability
+                if len(availability) < len(counts):
+                    availability.extend([0] * (len(counts) - len(availability)))
+                availability[:len(counts)] = map(operator.add, availability, counts)
+        total = self.total_pieces
+        if len(availability) < total:
+            availability.extend([0] * (total - len(availability)))
+        return seeders, peers - seeders, self.completed, availability[:total or len(availability)]
+
+    def shard(self, peer_id):
+        """Partição que guarda `peer_id`."""
+        return self.shards[hash(peer_id) % len(self.shards)]
+
+    def get_peer(self, peer_id):
+        """Registro de `peer_id`, ou None. Leitura sem lock (um `dict.get` é atômico)."""
+        return self.shard(peer_id).peers.get(peer_id)
+
+    def peer_count(self):
+        return sum(len(shard.peers) for shard in self.shards)
+
+    def records(self):
+        """Lista de (peer_id, registro) de todas as partições, cada uma copiada sob o seu lock."""
+        items = []
+        for shard in self.shards:
+            with shard.lock:
+                items.extend(shard.peers.items())
+        return items
+
+    def add_peer(self, peer_id, record):
+        shard = self.shard(peer_id)
+        shard.account(0, record.pieces, self.full_mask)
+        shard.peers[peer_id] = record
+
+    def add_peers(self, items):
+        """Adiciona vários peers de uma vez (recarga do snapshot, benchmarks).
+        Segura os locks das partições por conta própria, então deve ser chamado sem
+        nenhum deles.
+        Em vez de percorrer os pedaços de cada peer, soma as máscaras em contadores
+        fatiados por bit: planes[k] guarda o bit k da contagem de cada pedaço. Somar uma
+        máscara custa poucas operações em ints grandes (feitas em C), e os pedaços só são
+        percorridos uma vez por fatia no final.
+        """
+        by_shard = [[] for _ in self.shards]
+        for peer_id, record in items:
+            by_shard[hash(peer_id) % len(self.shards)].append((peer_id, record))
+        for shard, shard_items in zip(self.shards, by_shard):
+            if not shard_items:
+                continue
+            planes = []
+            batch = [] # Contadores curtos de um lote de até 31 peers, somados a `planes` no fim do lote.
+            batch_size = 0
+            for _, record in shard_items:
+                carry = record.pieces
+                for k in range(len(batch)):
+                    if not carry:
+                        break
+                    batch[k], carry = batch[k] ^ carry, batch[k] & carry
+                if carry:
+                    batch.append(carry)
+                batch_size += 1
+                if batch_size == 31:
+                    add_bit_planes(planes, batch)
+                    batch = []
+                    batch_size = 0
+            add_bit_planes(planes, batch)
+            with shard.lock:
+                shard.peers.update(shard_items)
+                shard.seeders += sum(1 for _, record in shard_items if record.pieces == self.full_mask)
+                availability = shard.availability
+                if planes:
+                    length = max(plane.bit_length() for plane in planes)
+                    if len(availability) < length:
+                        availability.extend([0] * (length - len(availability)))
+                for k, plane in enumerate(planes):
+                    weight = 1 << k
+                    for index in binary_protocol.mask_to_pieces(plane):
+                        availability[index] += weight
+                shard.version += 1
+
+    def remove_peer(self, peer_id):
+        shard = self.shard(peer_id)
+        record = shard.peers.pop(peer_id)
+        shard.account(record.pieces, 0, self.full_mask)
+        return record
+
+    def set_pieces(self, peer_id, record, pieces):
+        """Troca os pedaços de um peer do enxame.
+        Se nada mudou, mantém o mesmo objeto para não invalidar as entradas da PEERLIST
+        já serializadas. Um peer que já tinha parte dos pedaços e passa a ter todos conta
+        como download concluído (um seeder que anuncia tudo de uma vez, não).
+        """
+        old = record.pieces
+        if old == pieces:
+            return
+        shard = self.shard(peer_id)
+        shard.account(old, pieces, self.full_mask)
+        record.pieces = pieces
+        if pieces == self.full_mask and old:
+            shard.completed += 1
+
+    def set_total_pieces(self, total, replace=False):
+        """Registra o número de pedaços do arquivo e reconta os seeders. Sem `replace`,
+        só vale se o total era desconhecido. Retorna True se o total mudou. Segura os
+        locks de todas as partições e o `stats_lock` por conta própria.
+        """
+        if total <= 0 or total > MAX_PIECES or total == self.total_pieces or self.total_pieces and not replace:
+            return False
+        with contextlib.ExitStack() as stack:
+            for shard in self.shards:
+                stack.enter_context(shard.lock)
+            stack.enter_context(self.stats_lock)
+            if total == self.total_pieces or self.total_pieces and not replace:
+                return False
+            self.total_pieces = total
+            self.full_mask = (1 << total) - 1
+            for shard in self.shards:
+                shard.seeders = sum(1 for record in shard.peers.values() if record.pieces == self.full_mask)
+            self.total_version += 1
+        return True
+
+    def report_total(self, total):
+        """Conta o total de pedaços informado no JOIN de um peer novo. O total de um peer
+        não é verificado, então o enxame adota o informado por mais peers (o primeiro,
+        enquanto ninguém discorda) em vez de ficar para sempre com o primeiro.
+        Retorna True se o total do enxame mudou.
+        """
+        with self.stats_lock:
+            reports = self.total_reports
+            if total not in reports and len(reports) >= MAX_TOTAL_CANDIDATES:
+                return False
+            reports[total] = reports.get(total, 0) + 1
+            current = self.total_pieces
+            votes, current_votes = reports[total], reports.get(current, 0)
+        if not current:
+            return self.set_total_pieces(total)
+        if total == current:
+            return False
+        if votes <= current_votes:
+            if votes == 1:
+                logging.warning(f"Enxame {self.info_hash.hex()}: JOIN informa {total} pedaços, mas o enxame "
+                                f"usa {current} (informado por {current_votes} peers).")
+            return False
+        logging.warning(f"Enxame {self.info_hash.hex()}: total de pedaços trocado de {current} para {total} "
+                        f"(informado por {votes} peers contra {current_votes}).")
+        return self.set_total_pieces(total, replace=True)
+
+class ExpiryShard:
+    """Partição do índice de expiração: heap de 'last_update' e o lock que o protege."""
+    __slots__ = ('heap', 'lock')
+
+    def __init__(self):
+        self.heap = []
+        self.lock = threading.Lock()
+
+# Métricas expostas em /metrics (--metrics-port); atualizadas mesmo com o endpoint desligado.
+metrics = tracker_metrics.Metrics()
+# Resultados de `apply_have`.
+HAVE_OK = 0             # Nada a responder.
+HAVE_RESYNC = 1         # O peer precisa enviar um UPDATE completo.
+HAVE_STALE_INTERVAL = 2 # Sinal de vida fora do intervalo atual: o peer precisa de um INTERVAL.
+
+# Nome de cada tipo de mensagem binária nas métricas.
+BINARY_COMMANDS = {binary_protocol.MSG_JOIN: 'JOIN', binary_protocol.MSG_UPDATE: 'UPDATE',
+                   binary_protocol.MSG_HAVE: 'HAVE', binary_protocol.MSG_RESEND: 'RESEND',
+                   binary_protocol.MSG_SCRAPE: 'SCRAPE'}
+# Os comandos de texto começam com letras distintas; a primeira letra indexa o nome.
+TEXT_COMMANDS = {command[0]: command for command in (b'JOIN', b'UPDATE', b'HAVE', b'RESEND', b'SCRAPE')}
+
+# Enxame usado pelas mensagens que não informam o info-hash (peers antigos).
+DEFAULT_INFO_HASH = bytes(binary_protocol.INFO_HASH_SIZE)
+
+# Todos os enxames hospedados: { info_hash: Swarm }
+swarms = {}
+# Lock usado apenas para criar e remover enxames; os anúncios usam o lock de cada enxame.
+swarms_lock = tracker_metrics.TimedLock(metrics)
+# Partições do índice de peers de cada enxame novo (ver `configure_shards`).
+peer_shards = PEER_SHARDS
+# Índice de expiração, particionado como os enxames: cada partição tem um heap de
+# (último anúncio, desempate, enxame, peer_id, registro) com uma entrada por peer e o seu lock.
+# Ver `schedule_expiry` e `expire_peers`.
+expiry_shards = [ExpiryShard() for _ in range(PEER_SHARDS)]
+expiry_counter = itertools.count()
+# Respostas paginadas recentes, para atender RESEND: { (addr, id_resposta): (expira_em, páginas) }
+sent_pages = OrderedDict()
+sent_pages_lock = threading.Lock()
+response_ids = itertools.count(1)
+# Snapshot em disco (--snapshot): log aberto por este processo (None se não grava) e
+# os peers alterados desde a última gravação: { (info_hash, peer_id) }
+snapshot_log = None
+dirty_peers = set()
+dirty_lock = threading.Lock()
+# MTU usada para paginar as PEERLISTs (ver --mtu); o peer pode pedir uma menor no JOIN.
+peerlist_mtu = PEERLIST_MTU
+# No modo com vários processos (--workers), função que envia as alterações de estado
+# deste processo para os demais. None quando o tracker roda em um único processo.
+replication_hook = None
+# Limitador de taxa dos datagramas recebidos (ver configure_rate_limit); None = sem limite.
+rate_limiter = None
+# Intervalo de anúncio adaptativo; também define o prazo de expiração dos peers.
+interval_controller = tracker_interval.IntervalController(
+    TARGET_MESSAGE_RATE, MIN_ANNOUNCE_INTERVAL, MAX_ANNOUNCE_INTERVAL, TARGET_UTILIZATION,
+    ANNOUNCE_JITTER, min_timeout=PEER_TIMEOUT)
+# Processos (--workers) ou instâncias do cluster; cada um recebe só a sua parte dos anúncios.
+tracker_processes = 1
+# Nó de gossip do modo cluster (ver start_cluster); None fora do cluster.
+gossip_node = None
+# Trace dos datagramas recebidos (--capture, ver tracker_capture.py); None sem captura.
+traffic_capture = None
 # ---------------------------
 
-def format_peer_list(exclude_peer_id=None):
-    """Formata a lista atual de peers para envio aos peers.
+def configure_shards(count=PEER_SHARDS):
+    """Define em quantas partições os índices de peers e de expiração são divididos.
+    Vale para os enxames criados depois; deve ser chamada antes de o tracker receber peers.
+    """
+    global peer_shards, expiry_shards
+    peer_shards = max(1, count)
+    expiry_shards = [ExpiryShard() for _ in range(peer_shards)]
+
+def expiry_shard(peer_id):
+    """Partição do índice de expiração que guarda `peer_id`."""
+    return expiry_shards[hash(peer_id) % len(expiry_shards)]
+
+def get_swarm(info_hash, create=True):
+    """Retorna o enxame do info-hash, criando-o se necessário (ou None se `create` for False)."""
+    swarm = swarms.get(info_hash) # Leitura sem lock: o caso comum é o enxame já existir.
+    if swarm is None and create:
+        with swarms_lock:
+            swarm = swarms.get(info_hash)
+            if swarm is None:
+                swarm = Swarm(info_hash)
+                swarms[info_hash] = swarm
+                logging.info(f"Novo enxame: {info_hash.hex()}")
+    return swarm
+
+def snapshot_peers(swarm, exclude_peer_id=None):
+    """Copia as referências (registro, pedaços) de todos os peers, segurando o lock de
+    uma partição de cada vez. A serialização fica para depois, fora dos locks, para não
+    travar os UPDATEs dos outros peers. A máscara de pedaços é um int imutável, então a
+    cópia das referências é segura. Só a partição do peer excluído precisa do filtro.
+    """
+    excluded = swarm.shard(exclude_peer_id) if exclude_peer_id is not None else None
+    candidates = []
+    for shard in swarm.shards:
+        with shard.lock:
+            if shard is excluded:
+                candidates += [(record, record.pieces)
+                               for peer_id, record in shard.peers.items()
+                               if peer_id != exclude_peer_id]
+            else:
+                candidates += [(record, record.pieces) for record in shard.peers.values()]
+    return candidates
+
+def select_peers(swarm, requester_id=None, numwant=None):
+    """Escolhe os peers do enxame que vão na PEERLIST de `requester_id`.
+
+    Sem `numwant`, devolve todos. Caso contrário devolve no máximo `numwant` peers:
+    a maior parte ordenada por complementaridade (quantos pedaços o candidato tem que
+    o solicitante ainda não tem) e uma fração aleatória entre os restantes, para que
+    peers recém-chegados e com poucos pedaços também circulem.
+    """
+    candidates = snapshot_peers(swarm, requester_id)
+    if numwant is None or len(candidates) <= numwant:
+        return candidates
+
+    requester = swarm.get_peer(requester_id)
+    missing = ~requester.pieces if requester is not None else -1
+
+    random_count = int(numwant * RANDOM_PEER_FRACTION)
+    ranked_count = numwant - random_count
+    # nlargest é O(n log k); a pontuação é um AND + popcount sobre as máscaras.
+    ranked_indices = heapq.nlargest(ranked_count, range(len(candidates)),
+                                    key=lambda i: (candidates[i][1] & missing).bit_count())
+    chosen = set(ranked_indices)
+    rest = [i for i in range(len(candidates)) if i not in chosen]
+    random_indices = random.sample(rest, min(random_count, len(rest)))
+    return [candidates[i] for i in ranked_indices + random_indices]
+
+def format_peer_list(swarm, exclude_peer_id=None, numwant=None):
+    """Formata a lista atual de peers de um enxame para envio aos peers.
 
     Args:
+        swarm (Swarm): Enxame cujos peers serão listados.
         exclude_peer_id (str, optional): ID do peer a ser excluído da lista (geralmente o peer solicitante).
+        numwant (int, optional): Máximo de peers na lista (ver `select_peers`). None = todos.
 
     Returns:
         str: String formatada como "PEERLIST [<ip1>:<porta1>:[p1,p2];<ip2>:<porta2>:[p3];...]"
     """
-    peer_strings = []
-    with db_lock:
-        # Itera sobre todos os peers no banco de dados.
-        for peer_id, data in peers_db.items():
-            # Exclui o peer que fez a solicitação, se especificado.
-            if peer_id == exclude_peer_id:
-                continue
-            # Converte o conjunto de pedaços para uma string separada por vírgulas e ordenada.
-            pieces_str = ','.join(map(str, sorted(list(data['pieces']))))
-            # Adiciona a string formatada do peer à lista.
-            peer_strings.append(f"{data['ip']}:{data['tcp_port']}:[{pieces_str}]")
+    # Cada entrada vem do cache do registro; só é serializada de novo se os pedaços mudaram.
+    peer_strings = [record.text_entry(pieces) for record, pieces in select_peers(swarm, exclude_peer_id, numwant)]
     # Retorna a lista de peers formatada com o prefixo "PEERLIST ".
     return f"PEERLIST [{' ; '.join(peer_strings)}]"
 
+def format_binary_peer_list(swarm, exclude_peer_id=None, numwant=None):
+    """Equivalente binário de `format_peer_list`.
+
+    Returns:
+        bytes: PEERLIST binária com endereço compactado (6 bytes) e bitfield de cada peer.
+    """
+    entries = [record.binary_entry(pieces) for record, pieces in select_peers(swarm, exclude_peer_id, numwant)]
+    return binary_protocol.encode_peerlist(entries)
+
+def fit_entry(record, pieces, entry, budget, binary):
+    """Lista de entradas que representam `entry` (a de `record` com a máscara `pieces`)
+    em no máximo `budget` bytes cada, para que nenhuma página passe da MTU.
+    A lista de pedaços (texto) ou o bitfield (binário, cada parte com o seu
+    deslocamento) é dividido em várias entradas do mesmo peer, que o peer junta de volta.
+    """
+    if len(entry) <= budget:
+        return [entry]
+    if binary:
+        overhead = len(binary_protocol.encode_peer_entry(record.ip, record.tcp_port, b""))
+        bitfield = binary_protocol.mask_to_bitfield(pieces)
+        size = budget - overhead
+        entries = []
+        for offset in range(0, len(bitfield), size):
+            chunk = bitfield[offset:offset + size].rstrip(b"\0")
+            if chunk:
+                entries.append(binary_protocol.encode_peer_entry(record.ip, record.tcp_port, chunk, offset))
+        return entries
+    prefix = f"{record.ip}:{record.tcp_port}:["
+    entries = []
+    chunk = []
+    used = len(prefix) + 1
+    for piece in map(str, binary_protocol.mask_to_pieces(pieces)):
+        size = len(piece) + (1 if chunk else 0)
+        if chunk and used + size > budget:
+            entries.append(f"{prefix}{','.join(chunk)}]")
+            chunk = []
+            used = len(prefix) + 1
+            size = len(piece)
+        chunk.append(piece)
+        used += size
+    entries.append(f"{prefix}{','.join(chunk)}]")
+    return entries
+
+def paginate_entries(entries, budget, separator_size=0):
+    """Agrupa entradas serializadas em páginas de no máximo `budget` bytes.
+    Uma entrada nunca é dividida; as maiores que o orçamento já devem ter passado por
+    `fit_entry`.
+    """
+    pages = []
+    page = []
+    used = 0
+    for entry in entries:
+        size = len(entry) + (separator_size if page else 0)
+        if page and used + size > budget:
+            pages.append(page)
+            page = []
+            used = 0
+            size = len(entry)
+        page.append(entry)
+        used += size
+    pages.append(page) # Sempre há ao menos uma página, mesmo vazia.
+    return pages
+
+def build_peer_list(swarm, exclude_peer_id=None, numwant=None, binary=False, mtu=None):
+    """Monta a resposta a um JOIN como uma lista de datagramas.
+    Se a PEERLIST cabe em `mtu` bytes, é um único datagrama PEERLIST, como antes. Caso
+    contrário as entradas são divididas em páginas PEERPAGE com o mesmo id de resposta,
+    que o peer junta de volta (e pede de novo com RESEND se alguma se perder).
+
+    Returns:
+        tuple: (id_resposta ou None se não paginada, lista de datagramas em bytes)
+    """
+    mtu = peerlist_mtu if mtu is None else max(MIN_PEERLIST_MTU, min(mtu, peerlist_mtu))
+    selected = select_peers(swarm, exclude_peer_id, numwant)
+    if binary:
+        entries = [record.binary_entry(pieces) for record, pieces in selected]
+        single = binary_protocol.encode_peerlist(entries)
+    else:
+        entries = [record.text_entry(pieces) for record, pieces in selected]
+        single = f"PEERLIST [{' ; '.join(entries)}]".encode('utf-8')
+    if len(single) <= mtu:
+        return None, [single]
+
+    response_id = next(response_ids) & 0xFFFFFFFF
+    if binary:
+        budget = mtu - binary_protocol.HEADER.size - binary_protocol.PAGE.size - binary_protocol.COUNT.size
+    else:
+        # Cabeçalho de texto no pior caso: "PEERPAGE <id> <índice> <total> []".
+        budget = mtu - len("PEERPAGE 4294967295 65535 65535 []")
+    entries = [fitted for (record, pieces), entry in zip(selected, entries)
+               for fitted in fit_entry(record, pieces, entry, budget, binary)]
+    if binary:
+        pages = paginate_entries(entries, budget)
+        datagrams = [binary_protocol.encode_peerpage(response_id, index, len(pages), page)
+                     for index, page in enumerate(pages)]
+    else:
+        pages = paginate_entries(entries, budget, separator_size=len(' ; '))
+        datagrams = [f"PEERPAGE {response_id} {index} {len(pages)} [{' ; '.join(page)}]".encode('utf-8')
+                     for index, page in enumerate(pages)]
+    return response_id, datagrams
+
+def send_peer_list(sock, addr, swarm, peer_id, numwant, binary=False, mtu=None):
+    """Envia a resposta de um JOIN (uma PEERLIST ou a rajada de páginas) para `addr`."""
+    response_id, datagrams = build_peer_list(swarm, peer_id, numwant, binary, mtu)
+    if response_id is not None:
+        now = time.time()
+        with sent_pages_lock:
+            sent_pages[(addr, response_id)] = (now + PAGE_CACHE_TTL, datagrams)
+            # Descarta as respostas mais antigas (vencidas ou além do limite).
+            while sent_pages:
+                (expires_at, _) = next(iter(sent_pages.values()))
+                if expires_at > now and len(sent_pages) <= PAGE_CACHE_SIZE:
+                    break
+                sent_pages.popitem(last=False)
+        logging.debug(f"Enviando PEERLIST para {addr} em {len(datagrams)} páginas (resposta {response_id})")
+    for index, datagram in enumerate(datagrams):
+        # Uma página que falha não impede o envio das outras (o peer pede as que faltam com RESEND).
+        try:
+            sock.sendto(datagram, addr)
+        except OSError as e:
+            logging.warning(f"Falha ao enviar a página {index} da PEERLIST para {addr} ({len(datagram)} bytes): {e}")
+
+def resend_pages(sock, addr, response_id, indices):
+    """Reenvia as páginas pedidas em um RESEND, se a resposta ainda estiver guardada."""
+    with sent_pages_lock:
+        cached = sent_pages.get((addr, response_id))
+    if cached is None or cached[0] < time.time():
+        logging.info(f"RESEND de {addr} para resposta {response_id} desconhecida ou vencida. Ignorando.")
+        return
+    datagrams = cached[1]
+    logging.debug(f"Reenviando páginas {indices} da resposta {response_id} para {addr}")
+    for index in indices:
+        if 0 <= index < len(datagrams):
+            try:
+                sock.sendto(datagrams[index], addr)
+            except OSError as e:
+                logging.warning(f"Falha ao reenviar a página {index} da resposta {response_id} para {addr}: {e}")
+
+def format_availability(availability):
+    """Disponibilidade em texto, com sequências repetidas compactadas: "3,0*120,2"
+    equivale a 3 seguido de 120 zeros e de um 2.
+    """
+    return ','.join(str(count) if length == 1 else f"{count}*{length}"
+                    for count, length in binary_protocol.availability_runs(availability))
+
+def scrape_response(info_hash, binary=False):
+    """Resposta ao SCRAPE de um enxame: seeders, leechers, downloads concluídos e a
+    disponibilidade de cada pedaço.
+    Os números já são mantidos a cada anúncio, por partição (ver `Swarm`); aqui só
+    são somados. A resposta serializada fica em cache até a próxima mudança no enxame,
+    então polls repetidos custam O(1) sem travar nenhuma partição de peers.
+    """
+    swarm = get_swarm(info_hash, create=False)
+    if swarm is None:
+        stats = (0, 0, 0, [])
+    else:
+        version = swarm.version
+        with swarm.stats_lock:
+            cache = swarm.scrape_cache
+            if cache is not None and cache[0] == version and cache[1 + binary] is not None:
+                return cache[1 + binary]
+        stats = swarm.stats()
+    seeders, leechers, completed, availability = stats
+    if binary:
+        response = binary_protocol.encode_scrapeinfo(seeders, leechers, completed, availability)
+    else:
+        response = (f"SCRAPEINFO seeders={seeders} leechers={leechers} completed={completed} "
+                    f"pieces={len(availability)} [{format_availability(availability)}]").encode('utf-8')
+    if swarm is not None:
+        with swarm.stats_lock:
+            if swarm.version == version:
+                cache = swarm.scrape_cache
+                if cache is None or cache[0] != version:
+                    cache = [version, None, None]
+                cache[1 + binary] = response
+                swarm.scrape_cache = cache
+    return response
+
+def parse_numwant(value):
+    """Converte o numwant pedido pelo peer, aplicando o padrão e o limite do tracker."""
+    if value is None:
+        return DEFAULT_NUMWANT
+    return max(0, min(int(value), MAX_NUMWANT))
+
+def parse_total(value):
+    """Valida o total de pedaços informado no JOIN (None se o peer não informou)."""
+    if value is None:
+        return None
+    total = int(value)
+    if not 0 <= total <= MAX_PIECES:
+        raise ValueError(f"Total de pedaços fora do limite (0..{MAX_PIECES}): {total}")
+    return total
+
+def parse_options(tokens):
+    """Converte tokens 'chave=valor' (opções no fim dos comandos de texto) em dicionário."""
+    options = {}
+    for token in tokens:
+        key, sep, value = token.partition('=')
+        if not sep:
+            raise ValueError(f"Opção inválida: {token}")
+        options[key] = value
+    return options
+
+def parse_info_hash(options):
+    """Obtém o info-hash da opção 'swarm=<40 hex>' ou o enxame padrão se ausente."""
+    value = options.get('swarm')
+    if value is None:
+        return DEFAULT_INFO_HASH
+    info_hash = bytes.fromhex(value)
+    if len(info_hash) != binary_protocol.INFO_HASH_SIZE:
+        raise ValueError(f"Info-hash com tamanho inválido: {value}")
+    return info_hash
+
+def parse_pieces_list(pieces_str):
+    """Converte '[p1,p2,...]' em máscara de pedaços. Levanta ValueError se malformada."""
+    pieces_str = pieces_str.strip('[]')
+    if not pieces_str: # Evita erro se a lista estiver vazia '[]'.
+        return 0
+    return binary_protocol.pieces_to_mask(set(map(int, pieces_str.split(','))), MAX_PIECES)
+
+def bitfield_to_pieces_mask(bitfield):
+    """Converte o bitfield de um UPDATE binário em máscara. Levanta ValueError se ele
+    tiver pedaços além de MAX_PIECES.
+    """
+    pieces = binary_protocol.bitfield_to_mask(bitfield)
+    if pieces.bit_length() > MAX_PIECES:
+        raise ValueError(f"Bitfield com pedaços além do limite ({MAX_PIECES})")
+    return pieces
+
+def mark_dirty(info_hash, peer_id):
+    """Marca um peer para ser gravado (ou apagado) no snapshot na próxima gravação."""
+    if snapshot_log is None:
+        return
+    with dirty_lock:
+        dirty_peers.add((info_hash, peer_id))
+
+def publish_peer_state(swarm, peer_id, record):
+    """Envia o estado atual de um peer para os outros processos do tracker, se houver,
+    e o marca para o snapshot.
+    Deve ser chamada com um registro consistente (ex.: cópia feita sob o lock do enxame).
+    """
+    mark_dirty(swarm.info_hash, peer_id)
+    if replication_hook is None:
+        return
+    replication_hook(('put', swarm.info_hash, peer_id, record.ip, record.tcp_port, record.pieces, record.last_update))
+
+def publish_peer_touch(swarm, peer_id, record):
+    """Replica um sinal de vida (só o novo 'last_update'), para que os outros processos
+    não expirem um peer que anuncia apenas aqui.
+    """
+    if replication_hook is not None:
+        replication_hook(('touch', swarm.info_hash, peer_id, record.ip, record.tcp_port, record.last_update))
+
+def publish_peer_removal(swarm, peer_id, record):
+    """Replica a expiração de um peer e a marca para o snapshot."""
+    mark_dirty(swarm.info_hash, peer_id)
+    if replication_hook is not None:
+        replication_hook(('del', swarm.info_hash, peer_id, record.ip, record.tcp_port, record.last_update))
+
+def apply_replicated_state(message):
+    """Aplica localmente uma alteração de estado vinda de outro processo ou instância.
+    Mantém a versão mais recente de cada peer (maior 'last_update'): um PUT ou TOUCH
+    mais antigo que o registro local é ignorado, e um DEL só remove o peer se ele não
+    anunciou de novo depois do 'last_update' que expirou.
+    Retorna True se a alteração mudou o estado local (o gossip só repassa essas).
+    """
+    kind = message[0]
+    if kind == 'swarm':
+        _, info_hash, total_pieces = message
+        return get_swarm(info_hash).set_total_pieces(total_pieces, replace=True)
+    if kind in ('touch', 'del'):
+        _, info_hash, peer_id, _, _, last_update = message
+        swarm = get_swarm(info_hash, create=False)
+        if swarm is None:
+            return False
+        shard = swarm.shard(peer_id)
+        with shard.lock:
+            current = shard.peers.get(peer_id)
+            if current is None:
+                return False
+            if kind == 'touch':
+                if current.last_update >= last_update:
+                    return False
+                current.last_update = last_update
+                return True
+            if current.last_update > last_update:
+                return False # O peer anunciou de novo depois da expiração.
+            swarm.remove_peer(peer_id)
+        mark_dirty(info_hash, peer_id)
+        return True
+    if kind != 'put':
+        logging.warning(f"Mensagem de replicação desconhecida: {kind}")
+        return False
+    _, info_hash, peer_id, ip, tcp_port, pieces, last_update = message
+    swarm = get_swarm(info_hash)
+    shard = swarm.shard(peer_id)
+    with shard.lock:
+        current = shard.peers.get(peer_id)
+        if current is None:
+            record = PeerRecord(ip, tcp_port, pieces, last_update)
+            swarm.add_peer(peer_id, record)
+            schedule_expiry(swarm, peer_id, record)
+        elif current.last_update > last_update:
+            return False # Já temos uma versão mais nova deste peer.
+        elif current.last_update == last_update and current.pieces == pieces:
+            return False # Nada novo (ex.: a mesma alteração chegando por outro caminho).
+        else:
+            swarm.set_pieces(peer_id, current, pieces)
+            current.last_update = last_update
+    mark_dirty(info_hash, peer_id)
+    return True
+
+def schedule_expiry(swarm, peer_id, record):
+    """Coloca um peer recém-criado no índice de expiração (na partição do seu peer_id).
+    Cada peer tem uma única entrada no heap; quando ela vence, `expire_peers` confere o
+    'last_update' e, se o peer anunciou nesse meio tempo, apenas a reagenda. Assim os
+    anúncios não mexem no heap (remoção preguiçosa).
+    O heap é ordenado pelo 'last_update' e não pelo prazo: o prazo de expiração é o
+    mesmo para todos os peers, então `expire_peers` aplica o prazo atual na hora de
+    olhar o heap e um prazo que diminuiu vale também para as entradas já agendadas.
+    """
+    shard = expiry_shard(peer_id)
+    with shard.lock:
+        heapq.heappush(shard.heap, (record.last_update, next(expiry_counter), swarm, peer_id, record))
+
+def expire_peers(now):
+    """Remove os peers cujo prazo venceu e retorna quantos foram removidos.
+    Só olha as entradas vencidas dos heaps, em vez de varrer todos os peers. Cada
+    partição de expiração é tratada por vez, e o lock da partição do enxame é segurado
+    por apenas uma entrada de cada vez.
+    """
+    removed = 0
+    emptied = []
+    # Vence quem não anuncia desde `cutoff`, com o prazo de agora (ver `schedule_expiry`).
+    cutoff = now - interval_controller.peer_timeout()
+    for expiry in expiry_shards:
+        due = []
+        with expiry.lock:
+            while expiry.heap and expiry.heap[0][0] <= cutoff:
+                due.append(heapq.heappop(expiry.heap))
+
+        rescheduled = []
+        for _, _, swarm, peer_id, record in due:
+            shard = swarm.shard(peer_id)
+            with shard.lock:
+                if shard.peers.get(peer_id) is not record:
+                    continue # Entrada obsoleta: o peer já saiu (e talvez tenha voltado com outro registro).
+                if record.last_update > cutoff:
+                    # O peer anunciou depois do agendamento: reagenda a partir do novo anúncio.
+                    rescheduled.append((record.last_update, next(expiry_counter), swarm, peer_id, record))
+                    continue
+                swarm.remove_peer(peer_id)
+            removed += 1
+            publish_peer_removal(swarm, peer_id, record)
+            if not swarm.peer_count():
+                emptied.append(swarm)
+
+        if rescheduled:
+            with expiry.lock:
+                for entry in rescheduled:
+                    heapq.heappush(expiry.heap, entry)
+    for swarm in emptied:
+        with swarms_lock:
+            # Confere de novo: um JOIN pode ter chegado entre os dois locks.
+            if not swarm.peer_count() and swarms.get(swarm.info_hash) is swarm:
+                del swarms[swarm.info_hash]
+    if removed:
+        logging.info(f"Peers inativos removidos: {removed}")
+    return removed
+
+def write_snapshot(log):
+    """Grava no log as alterações (PUT ou DEL) dos peers marcados desde a última gravação
+    e compacta o log quando ele cresce demais.
+    """
+    global dirty_peers
+    with dirty_lock:
+        dirty, dirty_peers = dirty_peers, set()
+    records = []
+    touched = set()
+    for info_hash, peer_id in dirty:
+        swarm = swarms.get(info_hash)
+        state = None
+        if swarm is not None:
+            touched.add(swarm)
+            shard = swarm.shard(peer_id)
+            with shard.lock:
+                record = shard.peers.get(peer_id)
+                if record is not None:
+                    state = (record.ip, record.tcp_port, record.pieces)
+        if state is not None:
+            records.append(tracker_snapshot.encode_put(info_hash, *state))
+        else:
+            ip, port = peer_id.rsplit(':', 1)
+            records.append(tracker_snapshot.encode_del(info_hash, ip, int(port)))
+    # O total de pedaços e os downloads concluídos dos enxames que mudaram.
+    for swarm in touched:
+        records.append(tracker_snapshot.encode_swarm(swarm.info_hash, swarm.total_pieces, swarm.completed))
+    log.append(records)
+    if log.size() > max(COMPACT_MIN_BYTES, COMPACT_FACTOR * log.compacted_size):
+        compact_snapshot(log)
+
+def compact_snapshot(log):
+    """Reescreve o log do snapshot só com o estado atual (um PUT por peer)."""
+    start = time.perf_counter()
+    with swarms_lock:
+        all_swarms = list(swarms.values())
+    records = []
+    peers = 0
+    for swarm in all_swarms:
+        # Copia sob os locks das partições e codifica fora deles, para não atrasar os anúncios.
+        states = [(record.ip, record.tcp_port, record.pieces) for _, record in swarm.records()]
+        info = (swarm.total_pieces, swarm.completed)
+        records.append(tracker_snapshot.encode_swarm(swarm.info_hash, *info))
+        records.extend(tracker_snapshot.encode_put(swarm.info_hash, *state) for state in states)
+        peers += len(states)
+    log.compact(records)
+    logging.info(f"Snapshot compactado: {peers} peers em {len(all_swarms)} enxames, {log.size()} bytes "
+                 f"em {time.perf_counter() - start:.2f}s")
+
+def snapshot_thread(log):
+    """Grava periodicamente as alterações de estado no snapshot."""
+    while True:
+        time.sleep(SNAPSHOT_INTERVAL)
+        try:
+            write_snapshot(log)
+        except OSError as e:
+            logging.error(f"Erro ao gravar o snapshot: {e}")
+
+def load_snapshot(path):
+    """Recarrega os enxames gravados no snapshot e retorna quantos peers foram restaurados.
+    Os peers restaurados ganham um novo prazo de expiração para voltar a anunciar;
+    os que não anunciarem expiram normalmente.
+    """
+    start = time.perf_counter()
+    state, swarm_info = tracker_snapshot.read_log(path)
+    now = time.time()
+    entries = [[] for _ in expiry_shards]
+    restored = {} # { info_hash: [(peer_id, registro)] }
+    for (info_hash, ip, tcp_port), pieces in state.items():
+        peer_id = f"{ip}:{tcp_port}"
+        record = PeerRecord(ip, tcp_port, pieces, now)
+        restored.setdefault(info_hash, []).append((peer_id, record))
+    for info_hash, items in restored.items():
+        swarm = swarms.get(info_hash)
+        if swarm is None:
+            swarm = swarms[info_hash] = Swarm(info_hash)
+        total_pieces, completed = swarm_info.get(info_hash, (0, 0))
+        swarm.set_total_pieces(total_pieces)
+        swarm.restore_completed(completed)
+        swarm.add_peers(items)
+        for peer_id, record in items:
+            entries[hash(peer_id) % len(entries)].append((now, next(expiry_counter), swarm, peer_id, record))
+    for expiry, shard_entries in zip(expiry_shards, entries):
+        with expiry.lock:
+            expiry.heap.extend(shard_entries)
+            heapq.heapify(expiry.heap)
+    logging.info(f"Snapshot {path} carregado: {len(state)} peers em {len(swarms)} enxames "
+                 f"em {time.perf_counter() - start:.2f}s")
+    return len(state)
+
+def start_snapshot(path, writer=True):
+    """Restaura o estado de `path` e, se `writer`, passa a gravar as alterações nele.
+    No modo --workers todos os processos restauram, mas só um grava.
+    Um arquivo que não é um snapshot válido nunca é sobrescrito: quem grava o move para
+    `path` + SNAPSHOT_CORRUPT_SUFFIX e começa um log novo. Um erro de leitura (permissão,
+    disco) impede o tracker de iniciar.
+    """
+    global snapshot_log
+    try:
+        load_snapshot(path)
+    except tracker_snapshot.SnapshotError as e:
+        if writer:
+            corrupt_path = path + SNAPSHOT_CORRUPT_SUFFIX
+            os.replace(path, corrupt_path)
+            logging.error(f"Snapshot {path} inválido: {e}. Arquivo movido para {corrupt_path}; começando vazio.")
+        else:
+            logging.error(f"Snapshot {path} inválido: {e}. Começando vazio.")
+    except OSError as e:
+        logging.critical(f"Não foi possível ler o snapshot {path}: {e}")
+        raise
+    if not writer:
+        return
+    snapshot_log = tracker_snapshot.SnapshotLog(path)
+    compact_snapshot(snapshot_log) # Começa de um log enxuto (só o estado restaurado).
+    threading.Thread(target=snapshot_thread, args=(snapshot_log,), name="Snapshot", daemon=True).start()
+
+def stop_snapshot():
+    """Grava as últimas alterações pendentes antes de o tracker sair."""
+    if snapshot_log is not None:
+        write_snapshot(snapshot_log)
+        snapshot_log.close()
+
+def adapt_announce_interval(now):
+    """Recalcula o intervalo de anúncio com a carga medida desde a última chamada."""
+    messages, busy = metrics.totals()
+    with swarms_lock:
+        peers = sum(swarm.peer_count() for swarm in swarms.values())
+    # Com --workers, cada processo vê todos os peers (replicados), mas trata só a sua parte.
+    interval = interval_controller.update(now, messages, busy, peers / tracker_processes)
+    logging.debug(f"Intervalo de anúncio: {interval:.0f}s (taxa {interval_controller.rate or 0:.0f} msg/s, "
+                  f"prazo de expiração {interval_controller.peer_timeout():.0f}s)")
+
+def send_interval(sock, addr, binary=False):
+    """Envia ao peer o intervalo de anúncio atual (com jitter) e o intervalo mínimo."""
+    interval, min_interval = interval_controller.announce_interval()
+    if binary:
+        sock.sendto(binary_protocol.encode_interval(interval, min_interval), addr)
+    else:
+        sock.sendto(f"INTERVAL {interval} {min_interval}".encode('utf-8'), addr)
+
 def cleanup_inactive_peers():
-    """Verifica periodicamente e remove peers inativos.
-    Um peer é considerado inativo se não enviar uma atualização dentro do PEER_TIMEOUT.
+    """Remove periodicamente os peers inativos e ajusta o intervalo de anúncio.
+    Um peer é considerado inativo se não enviar uma atualização dentro do prazo de
+    expiração (ver `IntervalController.peer_timeout`).
+    A cada EXPIRY_TICK segundos expira só os peers vencidos (ver `expire_peers`), então
+    um peer morto sai da PEERLIST no máximo EXPIRY_TICK segundos depois do prazo.
     """
+    next_adapt = time.monotonic()
     while True:
-        # Espera por um período antes de verificar novamente.
-        time.sleep(PEER_TIMEOUT / 2) 
+        time.sleep(EXPIRY_TICK)
+        expire_peers(time.time())
+        if time.monotonic() >= next_adapt:
+            adapt_announce_interval(time.monotonic())
+            next_adapt += INTERVAL_ADAPT_PERIOD
+
+def register_peer(swarm, peer_ip, peer_tcp_port, total_pieces=None):
+    """Registra um peer no enxame após um JOIN e retorna o seu ID.
+    Um JOIN de um peer já conhecido é um novo anúncio (o peer quer uma PEERLIST
+    atualizada): apenas renova o 'last_update', mantendo os pedaços e a sequência.
+    `total_pieces`, se o peer informou, conta como voto no total de pedaços do arquivo
+    (necessário para contar os seeders no SCRAPE; ver `Swarm.report_total`). Só o
+    primeiro JOIN de cada peer vota.
+    """
+    peer_id = f"{peer_ip}:{peer_tcp_port}"
+    logging.info(f"Requisição JOIN de {peer_id}")
+    shard = swarm.shard(peer_id)
+    with shard.lock:
+        record = shard.peers.get(peer_id)
+        is_new = record is None
+        if is_new:
+            # Inicialmente, o peer não possui pedaços conhecidos.
+            record = PeerRecord(peer_ip, peer_tcp_port, 0, time.time())
+            swarm.add_peer(peer_id, record)
+            schedule_expiry(swarm, peer_id, record)
+        else:
+            record.last_update = time.time()
+        record = record.copy()
+    learned_total = bool(total_pieces) and is_new and swarm.report_total(total_pieces)
+    if learned_total and replication_hook is not None:
+        replication_hook(('swarm', swarm.info_hash, total_pieces))
+    publish_peer_state(swarm, peer_id, record)
+    return peer_id
+
+def update_peer_pieces(swarm, peer_id, pieces):
+    """Substitui a máscara de pedaços de um peer conhecido após um UPDATE."""
+    logging.debug(f"UPDATE de {peer_id}: {pieces.bit_count()} pedaços")
+    shard = swarm.shard(peer_id)
+    with shard.lock:
+        record = shard.peers.get(peer_id) # Verifica novamente dentro do lock.
+        if record is not None:
+            # Atualiza os pedaços possuídos e o tempo da última atualização do peer.
+            swarm.set_pieces(peer_id, record, pieces)
+            record.last_update = time.time()
+            # O UPDATE completo reinicia a sequência dos HAVEs do peer.
+            record.seq = 0
+            record = record.copy()
+        else:
+             logging.warning(f"Peer {peer_id} desapareceu antes do lock de UPDATE.")
+             return
+    publish_peer_state(swarm, peer_id, record)
+
+def handle_update(info_hash, peer_ip, peer_tcp_port, pieces):
+    """Aplica um UPDATE completo.
+    Um UPDATE de um peer desconhecido (ex.: o tracker reiniciou sem snapshot, ou o peer
+    expirou) vale como JOIN implícito: o peer volta ao enxame com os pedaços informados.
+    """
+    peer_id = f"{peer_ip}:{peer_tcp_port}"
+    swarm = get_swarm(info_hash)
+    if swarm.get_peer(peer_id) is None:
+        logging.info(f"UPDATE de peer desconhecido {peer_id}. Tratando como JOIN implícito.")
+        register_peer(swarm, peer_ip, peer_tcp_port)
+    update_peer_pieces(swarm, peer_id, pieces)
+
+def apply_have(info_hash, peer_id, seq, new_pieces):
+    """Aplica um HAVE (pedaços adquiridos desde o HAVE anterior) de forma incremental.
+
+    Args:
+        info_hash (bytes): Enxame do peer.
+        peer_id (str): ID do peer que enviou o HAVE.
+        seq (int): Sequência do HAVE. O peer a incrementa a cada HAVE com pedaços novos
+            e a reinicia em 0 ao enviar um UPDATE completo. Um HAVE sem pedaços e com a
+            sequência atual serve só como sinal de vida; sem pedaços e com uma sequência
+            maior que a conhecida, indica que um HAVE se perdeu.
+        new_pieces (int): Máscara dos pedaços novos.
+
+    Returns:
+        int: HAVE_RESYNC se houve um buraco na sequência (um HAVE se perdeu) ou o peer é
+            desconhecido, e o peer precisa enviar um UPDATE completo (que, para um peer
+            desconhecido, vale como JOIN implícito); HAVE_STALE_INTERVAL se foi um sinal
+            de vida espaçado de forma diferente do intervalo atual (o peer ainda não
+            conhece o intervalo atual); HAVE_OK caso contrário.
+    """
+    swarm = get_swarm(info_hash, create=False)
+    if swarm is None:
+        logging.info(f"HAVE de peer desconhecido {peer_id}. Pedindo RESYNC.")
+        return HAVE_RESYNC
+    shard = swarm.shard(peer_id)
+    with shard.lock:
+        record = shard.peers.get(peer_id)
+        if record is None:
+            logging.info(f"HAVE de peer desconhecido {peer_id}. Pedindo RESYNC.")
+            return HAVE_RESYNC
         now = time.time()
-        inactive_peers = []
-        with db_lock:
-            # Identifica peers que não foram atualizados dentro do tempo limite.
-            for peer_id, data in peers_db.items():
-                if now - data['last_update'] > PEER_TIMEOUT:
-                    inactive_peers.append(peer_id)
-
-            # Remove os peers inativos do banco de dados.
-            if inactive_peers:
-                logging.info(f"Removendo peers inativos: {inactive_peers}")
-                for peer_id in inactive_peers:
-                    del peers_db[peer_id]
+        gap = now - record.last_update
+        record.last_update = now
+        if seq < record.seq or seq == record.seq and new_pieces:
+            # HAVE repetido/atrasado: nada a aplicar além do 'last_update'.
+            heartbeat = HAVE_OK
+        elif seq == record.seq:
+            # Sinal de vida: repete a sequência atual, sem pedaços.
+            heartbeat = HAVE_STALE_INTERVAL if interval_controller.is_stale(gap) else HAVE_OK
+        elif seq != record.seq + 1 or not new_pieces:
+            # Um sinal de vida à frente da sequência também é um buraco: o HAVE com os
+            # pedaços da sequência que ele repete se perdeu.
+            logging.info(f"Buraco na sequência de HAVE de {peer_id}: esperado {record.seq + 1}, recebido {seq}. Pedindo RESYNC.")
+            return HAVE_RESYNC
+        else:
+            heartbeat = None
+            record.seq = seq
+            swarm.set_pieces(peer_id, record, record.pieces | new_pieces)
+            record = record.copy()
+    if heartbeat is not None:
+        # Sem cópia: ip e porta não mudam, e um 'last_update' lido mais novo só adianta o sinal de vida.
+        publish_peer_touch(swarm, peer_id, record)
+        return heartbeat
+    logging.debug(f"HAVE {seq} de {peer_id}: {new_pieces.bit_count()} pedaços novos")
+    publish_peer_state(swarm, peer_id, record)
+    return HAVE_OK
+
+def handle_binary_message(data, addr, sock):
+    """Lida com as mensagens do protocolo binário (ver binary_protocol.py).
+    Um peer que envia JOIN binário recebe a PEERLIST também em binário; é assim que
+    a versão do protocolo é negociada.
+    """
+    peer_ip, _ = addr
+    try:
+        msg_type, body = binary_protocol.decode_header(data)
+        if msg_type == binary_protocol.MSG_JOIN:
+            info_hash, peer_tcp_port, numwant, mtu, total_pieces = binary_protocol.decode_join(body)
+            swarm = get_swarm(info_hash)
+            peer_id = register_peer(swarm, peer_ip, peer_tcp_port, parse_total(total_pieces))
+            send_peer_list(sock, addr, swarm, peer_id, parse_numwant(numwant), binary=True, mtu=mtu)
+            send_interval(sock, addr, binary=True)
+
+        elif msg_type == binary_protocol.MSG_UPDATE:
+            info_hash, peer_tcp_port, bitfield = binary_protocol.decode_update(body)
+            handle_update(info_hash, peer_ip, peer_tcp_port, bitfield_to_pieces_mask(bitfield))
+            send_interval(sock, addr, binary=True)
+
+        elif msg_type == binary_protocol.MSG_HAVE:
+            info_hash, peer_tcp_port, seq, indices = binary_protocol.decode_have(body)
+            peer_id = f"{peer_ip}:{peer_tcp_port}"
+            result = apply_have(info_hash, peer_id, seq, binary_protocol.pieces_to_mask(indices, MAX_PIECES))
+            if result == HAVE_RESYNC:
+                sock.sendto(binary_protocol.encode_resync(), addr)
+            elif result == HAVE_STALE_INTERVAL:
+                send_interval(sock, addr, binary=True)
+
+        elif msg_type == binary_protocol.MSG_RESEND:
+            response_id, indices = binary_protocol.decode_resend(body)
+            resend_pages(sock, addr, response_id, indices)
+
+        elif msg_type == binary_protocol.MSG_SCRAPE:
+            info_hash = binary_protocol.decode_scrape(body)
+            sock.sendto(scrape_response(info_hash, binary=True), addr)
+
+        else:
+            metrics.count_parse_error('other')
+            logging.warning(f"Tipo de mensagem binária desconhecido de {addr}: {msg_type}")
+
+    except (binary_protocol.ProtocolError, IndexError, struct.error, ValueError) as e:
+        metrics.count_parse_error(message_command(data))
+        logging.warning(f"Mensagem binária inválida de {addr}: {e}")
+    except Exception as e:
+        logging.error(f"Erro ao lidar com a mensagem binária de {addr}: {e}", exc_info=True)
 
 def handle_udp_message(data, addr, sock):
     """Analisa e lida com as mensagens UDP de entrada.
-    Processa comandos como JOIN e UPDATE enviados pelos peers.
+    Processa comandos como JOIN, UPDATE e HAVE enviados pelos peers.
+    Todos os comandos de texto aceitam a opção final 'swarm=<info-hash em hex>';
+    sem ela, o peer entra no enxame padrão.
     """
-    message = data.decode('utf-8')
+    if binary_protocol.is_binary(data):
+        handle_binary_message(data, addr, sock)
+        return
+
+    try:
+        message = data.decode('utf-8')
+    except UnicodeDecodeError:
+        metrics.count_parse_error('other')
+        logging.warning(f"Mensagem de texto inválida (não é UTF-8) de {addr}")
+        return
     # O IP de origem UDP é geralmente efêmero, não a porta TCP de escuta do peer.
     peer_ip, _ = addr 
     logging.debug(f"Mensagem recebida de {addr}: {message}")
 
     # Divide a mensagem em comando e argumentos.
-    parts = message.split(' ', 2) 
-    command = parts[0]
+    parts = message.split()
+    command = parts[0] if parts else ''
 
     try:
         # Lida com o comando JOIN.
-        if command == 'JOIN' and len(parts) == 3:
-            # Formato: JOIN <peer_ip> <peer_tcp_port>
+        if command == 'JOIN' and len(parts) >= 3:
+            # Formato: JOIN <peer_ip> <peer_tcp_port> [numwant=<n>] [mtu=<bytes>] [total=<pedaços>] [swarm=<hex>]
             # Nota: Usamos o IP de origem do pacote (peer_ip), não o que está na mensagem,
             #       pois o da mensagem pode estar incorreto (ex: atrás de NAT sem configuração).
             #       No entanto, a porta TCP DEVE vir da mensagem.
             try:
-                peer_tcp_port = int(parts[2])
-                peer_id = f"{peer_ip}:{peer_tcp_port}"
-                logging.info(f"Requisição JOIN de {peer_id}")
-
-                with db_lock:
-                    # Adiciona ou atualiza as informações do peer no banco de dados.
-                    peers_db[peer_id] = {
-                        'ip': peer_ip,
-                        'tcp_port': peer_tcp_port,
-                        'pieces': set(), # Inicialmente, o peer não possui pedaços conhecidos.
-                        'last_update': time.time() # Registra o tempo da última atualização.
-                    }
-
-                # Envia a lista de peers de volta (excluindo o próprio peer recém-chegado inicialmente).
-                response = format_peer_list(exclude_peer_id=peer_id)
-                logging.debug(f"Enviando para {addr}: {response}")
-                sock.sendto(response.encode('utf-8'), addr)
+                options = parse_options(parts[3:])
+                numwant = parse_numwant(options.get('numwant'))
+                mtu = int(options['mtu']) if 'mtu' in options else None
+                total_pieces = parse_total(options.get('total'))
+                swarm = get_swarm(parse_info_hash(options))
+                peer_id = register_peer(swarm, peer_ip, int(parts[2]), total_pieces)
+
+                # Envia a lista de peers de volta (excluindo o próprio peer), limitada a numwant
+                # e paginada se não couber na MTU.
+                send_peer_list(sock, addr, swarm, peer_id, numwant, mtu=mtu)
+                # Em seguida, o intervalo de anúncio que o peer deve usar.
+                send_interval(sock, addr)
 
             except ValueError:
-                logging.warning(f"Porta inválida no JOIN de {addr}: {parts[2]}")
+                metrics.count_parse_error(command)
+                logging.warning(f"Formato inválido no JOIN de {addr}: {message}")
 
         # Lida com o comando UPDATE.
-        elif command == 'UPDATE' and len(parts) == 3:
-            # Formato: UPDATE <peer_tcp_port> [p1,p2,...]
+        elif command == 'UPDATE' and len(parts) >= 3:
+            # Formato: UPDATE <peer_tcp_port> [p1,p2,...] [swarm=<hex>]
             try:
                 peer_tcp_port = int(parts[1]) # A porta é a segunda parte aqui.
                 peer_id = f"{peer_ip}:{peer_tcp_port}"
+                info_hash = parse_info_hash(parse_options(parts[3:]))
+            except ValueError:
+                metrics.count_parse_error(command)
+                logging.warning(f"Porta ou opção inválida no UPDATE de {addr}: {message}")
+                return
+
+            # Extrai a string de pedaços e a converte para uma máscara de bits.
+            try:
+                pieces = parse_pieces_list(parts[2])
+            except ValueError:
+                metrics.count_parse_error(command)
+                logging.warning(f"Formato de pedaços inválido no UPDATE de {peer_id}: {parts[2]}")
+                return # Ignora atualização inválida.
 
-                if peer_id not in peers_db:
-                    logging.warning(f"UPDATE de peer desconhecido {peer_id}. Pedindo para JOIN primeiro.")
-                    # Opcionalmente, enviar um erro ou ignorar. Por enquanto, ignorar.
-                    return
-
-                # Extrai a string de pedaços e a converte para um conjunto de inteiros.
-                pieces_str = parts[2].strip('[]')
-                pieces = set()
-                if pieces_str: # Evita erro se a lista estiver vazia '[]'.
-                    try:
-                        pieces = set(map(int, pieces_str.split(',')))
-                    except ValueError:
-                        logging.warning(f"Formato de pedaços inválido no UPDATE de {peer_id}: {parts[2]}")
-                        return # Ignora atualização inválida.
-
-                logging.debug(f"UPDATE de {peer_id}: {len(pieces)} pedaços")
-                with db_lock:
-                    if peer_id in peers_db: # Verifica novamente dentro do lock.
-                        # Atualiza os pedaços possuídos e o tempo da última atualização do peer.
-                        peers_db[peer_id]['pieces'] = pieces
-                        peers_db[peer_id]['last_update'] = time.time()
-                    else:
-                         logging.warning(f"Peer {peer_id} desapareceu antes do lock de UPDATE.")
+            handle_update(info_hash, peer_ip, peer_tcp_port, pieces)
+            send_interval(sock, addr)
 
+        # Lida com o comando HAVE (atualização incremental).
+        elif command == 'HAVE' and len(parts) >= 4:
+            # Formato: HAVE <peer_tcp_port> <seq> [p1,p2,...] [swarm=<hex>]
+            try:
+                peer_id = f"{peer_ip}:{int(parts[1])}"
+                seq = int(parts[2])
+                new_pieces = parse_pieces_list(parts[3])
+                info_hash = parse_info_hash(parse_options(parts[4:]))
             except ValueError:
-                logging.warning(f"Porta inválida no UPDATE de {addr}: {parts[1]}")
-            except Exception as e:
-                 logging.error(f"Erro ao processar UPDATE de {peer_id}: {e}")
+                metrics.count_parse_error(command)
+                logging.warning(f"Formato inválido no HAVE de {addr}: {message}")
+                return
+            result = apply_have(info_hash, peer_id, seq, new_pieces)
+            if result == HAVE_RESYNC:
+                sock.sendto(b"RESYNC", addr)
+            elif result == HAVE_STALE_INTERVAL:
+                send_interval(sock, addr)
 
+        # Lida com o pedido de páginas perdidas de uma PEERLIST paginada.
+        elif command == 'RESEND' and len(parts) >= 3:
+            # Formato: RESEND <id_resposta> <i1,i2,...>
+            try:
+                response_id = int(parts[1])
+                indices = [int(index) for index in parts[2].split(',')]
+            except ValueError:
+                metrics.count_parse_error(command)
+                logging.warning(f"Formato inválido no RESEND de {addr}: {message}")
+                return
+            resend_pages(sock, addr, response_id, indices)
+
+        # Lida com o pedido de estatísticas do enxame.
+        elif command == 'SCRAPE':
+            # Formato: SCRAPE [swarm=<hex>]
+            try:
+                info_hash = parse_info_hash(parse_options(parts[1:]))
+            except ValueError:
+                metrics.count_parse_error(command)
+                logging.warning(f"Formato inválido no SCRAPE de {addr}: {message}")
+                return
+            sock.sendto(scrape_response(info_hash), addr)
 
         else:
+            metrics.count_parse_error(message_command(data))
             logging.warning(f"Comando ou formato desconhecido de {addr}: {message}")
 
     except Exception as e:
         logging.error(f"Erro ao lidar com a mensagem de {addr}: {e}", exc_info=True)
 
-def start_tracker():
+def message_command(data):
+    """Comando da mensagem (texto ou binária) usado como rótulo nas métricas."""
+    if binary_protocol.is_binary(data):
+        return BINARY_COMMANDS.get(data[2] if len(data) > 2 else None, 'other')
+    command = TEXT_COMMANDS.get(data[0] if data else None)
+    return command.decode('ascii') if command is not None and data.startswith(command) else 'other'
+
+def process_datagram(data, addr, sock):
+    """Trata um datagrama já admitido pelo limitador, medindo o tempo de tratamento."""
+    start = time.perf_counter()
+    try:
+        handle_udp_message(data, addr, sock)
+    finally:
+        metrics.observe_message(message_command(data), time.perf_counter() - start)
+
+class MeteredSocket:
+    """Socket do modo tradicional que conta os datagramas e bytes enviados aos peers."""
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def sendto(self, data, addr):
+        metrics.count_response(len(data))
+        return self.sock.sendto(data, addr)
+
+def collect_state_metrics():
+    """Métricas lidas do estado do tracker no momento da coleta (fora do caminho quente)."""
+    with swarms_lock:
+        sizes = [swarm.peer_count() for swarm in swarms.values()]
+    collected = [
+        ('tracker_peers', 'gauge', 'Peers registrados em todos os enxames.', [({}, sum(sizes))]),
+        ('tracker_swarms', 'gauge', 'Enxames hospedados.', [({}, len(sizes))]),
+        ('tracker_expiry_heap_entries', 'gauge', 'Entradas nos heaps de expiração (inclui as obsoletas).',
+         [({}, sum(len(expiry.heap) for expiry in expiry_shards))]),
+        ('tracker_page_cache_responses', 'gauge', 'Respostas paginadas guardadas para RESEND.',
+         [({}, len(sent_pages))]),
+    ]
+    limiter = rate_limiter
+    if limiter is not None:
+        collected.append(('tracker_rate_limited_total', 'counter',
+                          'Datagramas descartados pelo limitador de taxa, por balde.',
+                          [({'bucket': 'ip'}, limiter.dropped_source),
+                           ({'bucket': 'global'}, limiter.dropped_global)]))
+        collected.append(('tracker_rate_limit_sources', 'gauge', 'IPs com balde próprio no limitador.',
+                          [({}, len(limiter.sources))]))
+    return collected
+
+metrics.add_collector(collect_state_metrics)
+
+def start_metrics(host, port):
+    """Liga o endpoint HTTP de métricas (GET /metrics) numa thread própria."""
+    try:
+        tracker_metrics.start_metrics_server(metrics, host, port)
+        logging.info(f"Métricas disponíveis em http://{host}:{port}/metrics")
+    except OSError as e:
+        logging.error(f"Falha ao iniciar o endpoint de métricas em {host}:{port}. Erro: {e}")
+
+def configure_rate_limit(per_ip=RATE_LIMIT_PER_IP, global_rate=RATE_LIMIT_GLOBAL):
+    """Liga o limitador de taxa (rajadas de até o dobro da taxa); com as duas taxas em 0, desliga."""
+    global rate_limiter
+    if not per_ip and not global_rate:
+        rate_limiter = None
+        return
+    rate_limiter = tracker_ratelimit.RateLimiter(per_ip, 2 * per_ip, global_rate, 2 * global_rate,
+                                                 RATE_LIMIT_SOURCES)
+
+def admit_datagram(addr):
+    """Verifica o limite de taxa antes de qualquer análise da mensagem.
+    Retorna False se o datagrama deve ser descartado. Chamado só pela thread de recepção.
+    """
+    limiter = rate_limiter
+    if limiter is None or limiter.allow(addr[0]):
+        return True
+    if limiter.dropped() % 1000 == 1:
+        logging.warning(f"Limite de taxa excedido (último: {addr[0]}). Descartados por IP: "
+                        f"{limiter.dropped_source}, pelo limite global: {limiter.dropped_global}")
+    return False
+
+def replicated_state():
+    """Alterações que reconstroem o estado local inteiro (antientropia do gossip)."""
+    with swarms_lock:
+        all_swarms = list(swarms.values())
+    for swarm in all_swarms:
+        if swarm.total_pieces:
+            yield ('swarm', swarm.info_hash, swarm.total_pieces)
+        for peer_id, record in swarm.records():
+            yield ('put', swarm.info_hash, peer_id, record.ip, record.tcp_port, record.pieces, record.last_update)
+
+def collect_cluster_metrics():
+    """Contadores do gossip do modo cluster."""
+    stats = gossip_node.stats()
+    return [
+        ('tracker_gossip_datagrams_sent_total', 'counter', 'Datagramas de gossip enviados.',
+         [({}, stats['sent_datagrams'])]),
+        ('tracker_gossip_records_total', 'counter', 'Registros de gossip, por direção.',
+         [({'direction': 'sent'}, stats['sent_records']), ({'direction': 'received'}, stats['received_records']),
+          ({'direction': 'applied'}, stats['applied_records'])]),
+        ('tracker_gossip_rejected_total', 'counter', 'Datagramas de gossip inválidos ou de fora do cluster.',
+         [({}, stats['rejected_datagrams'])]),
+        ('tracker_gossip_pending_records', 'gauge', 'Registros aguardando o próximo lote.',
+         [({}, stats['pending'])]),
+    ]
+
+def capture_flush_thread(capture):
+    """Descarrega periodicamente o trace, para ele ser legível com o tracker rodando."""
+    while not capture.file.closed:
+        time.sleep(CAPTURE_FLUSH_INTERVAL)
+        try:
+            capture.flush()
+        except OSError as e:
+            logging.error(f"Erro ao gravar o trace {capture.path}: {e}")
+
+def start_capture(path, max_bytes=0):
+    """Passa a gravar em `path` todos os datagramas recebidos, com o momento e o endereço
+    de origem, antes do limitador de taxa. Ver tracker_capture.py para reproduzi-los.
+    """
+    global traffic_capture
+    try:
+        traffic_capture = tracker_capture.TraceWriter(path, max_bytes)
+    except OSError as e:
+        logging.error(f"Não foi possível criar o trace {path}: {e}. Seguindo sem captura.")
+        return
+    threading.Thread(target=capture_flush_thread, args=(traffic_capture,), name="Capture", daemon=True).start()
+    limit = f" (até {max_bytes} bytes)" if max_bytes else ""
+    logging.info(f"Capturando os datagramas recebidos em {path}{limit}")
+
+def stop_capture():
+    """Grava o que falta do trace e o fecha."""
+    global traffic_capture
+    capture, traffic_capture = traffic_capture, None
+    if capture is not None:
+        capture.close()
+        logging.info(f"Trace {capture.path}: {capture.records} datagramas, {capture.size} bytes")
+
+def start_cluster(bind_addr, members):
+    """Entra no cluster: replica o estado local para `members` (endereços de gossip das
+    outras instâncias) e aplica o que vier deles. Ver tracker_gossip.py.
+    """
+    global gossip_node, replication_hook, tracker_processes
+    gossip_node = tracker_gossip.GossipNode(bind_addr, members, apply_replicated_state, replicated_state)
+    replication_hook = gossip_node.publish
+    # Os peers se dividem entre as instâncias; cada uma recebe só a sua parte dos anúncios.
+    tracker_processes = len(gossip_node.members) + 1
+    metrics.add_collector(collect_cluster_metrics)
+    gossip_node.start()
+    logging.info(f"Cluster: gossip em {bind_addr[0]}:{bind_addr[1]} com {len(gossip_node.members)} membros")
+
+def start_tracker(host=TRACKER_HOST, port=TRACKER_PORT, reuse_port=False):
     """Inicia o servidor UDP do tracker.
     Cria um socket UDP, vincula-o a um endereço e porta, e começa a escutar por mensagens.
+    Com `reuse_port`, vários processos podem escutar na mesma porta (SO_REUSEPORT).
     """
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         # Vincula o socket do tracker ao host e porta configurados.
-        sock.bind((TRACKER_HOST, TRACKER_PORT))
-        logging.info(f"Servidor UDP do Tracker iniciado em {TRACKER_HOST}:{TRACKER_PORT}")
+        sock.bind((host, port))
+        logging.info(f"Servidor UDP do Tracker iniciado em {host}:{port}")
 
         # Inicia a thread de limpeza de peers inativos.
         cleanup_thread = threading.Thread(target=cleanup_inactive_peers, daemon=True)
         cleanup_thread.start()
 
+        responder = MeteredSocket(sock)
         while True:
             try:
                 # Recebe dados de qualquer peer.
-                data, addr = sock.recvfrom(1024) # Tamanho do buffer: 1024 bytes.
-                # Lida com cada mensagem em uma nova thread para evitar bloquear o loop principal?
-                # Para UDP, pode ser aceitável, a menos que o processamento seja muito lento.
-                # Por enquanto, vamos manter simples.
-                handle_udp_message(data, addr, sock)
+                data, addr = sock.recvfrom(MAX_DATAGRAM_SIZE)
+                capture = traffic_capture
+                if capture is not None:
+                    capture.record(data, addr)
+                if not admit_datagram(addr):
+                    continue
+                # Neste modo cada mensagem é processada na própria thread de recepção;
+                # o modo asyncio (start_async_tracker) evita esse bloqueio.
+                process_datagram(data, addr, responder)
             except ConnectionResetError:
                  # Comum no Windows quando um envio anterior falhou.
                  logging.warning(f"Erro de redefinição de conexão de {addr}. Ignorando.")
@@ -187,15 +1521,313 @@ def start_tracker():
                 logging.error(f"Erro ao receber dados: {e}", exc_info=True)
 
     except OSError as e:
-        logging.error(f"Falha ao vincular o tracker a {TRACKER_HOST}:{TRACKER_PORT}. Erro: {e}")
+        logging.error(f"Falha ao vincular o tracker a {host}:{port}. Erro: {e}")
     except Exception as e:
         logging.critical(f"Ocorreu um erro inesperado: {e}", exc_info=True)
     finally:
         logging.info("Encerrando o servidor do tracker.")
         sock.close()
 
-if __name__ == '__main__':
-    start_tracker()
+class ThreadSafeTransport:
+    """Adapta o transporte do asyncio para ser usado pelas threads de processamento.
+    Expõe o mesmo `sendto(data, addr)` de um socket, agendando o envio no loop de eventos.
+    """
+
+    def __init__(self, loop, transport):
+        self.loop = loop
+        self.transport = transport
+
+    def sendto(self, data, addr):
+        metrics.count_response(len(data))
+        self.loop.call_soon_threadsafe(self.transport.sendto, data, addr)
+
+class TrackerProtocol(asyncio.DatagramProtocol):
+    """Protocolo UDP do tracker no modo asyncio.
+    O loop de eventos apenas recebe os datagramas e os entrega a um pool de threads,
+    então um JOIN lento não atrasa a recepção das mensagens dos outros peers.
+    """
+
+    def __init__(self, executor, max_pending=MAX_PENDING_DATAGRAMS):
+        self.executor = executor
+        self.max_pending = max_pending
+        self.pending = 0
+        self.dropped = 0
+        self.transport = None
+        self.responder = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.responder = ThreadSafeTransport(asyncio.get_running_loop(), transport)
 
+    def datagram_received(self, data, addr):
+        capture = traffic_capture
+        if capture is not None:
+            capture.record(data, addr)
+        if not admit_datagram(addr):
+            return
+        # Limita a fila de processamento para não acumular memória sem limite sob sobrecarga.
+        if self.pending >= self.max_pending:
+            self.dropped += 1
+            metrics.count_dropped('queue_full')
+            if self.dropped % 1000 == 1:
+                logging.warning(f"Fila de processamento cheia. Mensagens descartadas: {self.dropped}")
+            return
+        self.pending += 1
+        future = self.executor.submit(process_datagram, data, addr, self.responder)
+        future.add_done_callback(self._message_done)
 
+    def _message_done(self, future):
+        # Chamado na thread de processamento; devolve o decremento ao loop de eventos.
+        self.responder.loop.call_soon_threadsafe(self._decrement_pending)
 
+    def _decrement_pending(self):
+        self.pending -= 1
+
+    def error_received(self, exc):
+        # Comum no Windows quando um envio anterior falhou.
+        logging.warning(f"Erro recebido no socket do tracker: {exc}. Ignorando.")
+
+async def serve_async(host=TRACKER_HOST, port=TRACKER_PORT, workers=ASYNC_WORKERS, reuse_port=False):
+    """Executa o tracker no modo asyncio até ser cancelado."""
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="TrackerWorker")
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: TrackerProtocol(executor), local_addr=(host, port), reuse_port=reuse_port or None)
+    logging.info(f"Servidor UDP do Tracker (asyncio) iniciado em {host}:{port}")
+
+    # A limpeza continua em uma thread própria, como no modo tradicional.
+    cleanup_thread = threading.Thread(target=cleanup_inactive_peers, daemon=True)
+    cleanup_thread.start()
+    try:
+        await asyncio.Future() # Executa para sempre.
+    finally:
+        transport.close()
+        executor.shutdown(wait=False)
+
+def start_async_tracker(host=TRACKER_HOST, port=TRACKER_PORT, workers=ASYNC_WORKERS, reuse_port=False):
+    """Inicia o servidor UDP do tracker no modo asyncio."""
+    try:
+        asyncio.run(serve_async(host, port, workers, reuse_port))
+    except OSError as e:
+        logging.error(f"Falha ao vincular o tracker a {host}:{port}. Erro: {e}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logging.info("Encerrando o servidor do tracker.")
+
+def replication_thread(inbox):
+    """Aplica continuamente as alterações de estado recebidas dos outros processos."""
+    while True:
+        try:
+            apply_replicated_state(inbox.get())
+        except Exception as e:
+            logging.error(f"Erro ao aplicar replicação: {e}", exc_info=True)
+
+def run_worker(index, inboxes, host, port, mode, async_workers, log_level=LOG_LEVEL, mtu=PEERLIST_MTU,
+               snapshot_path=None, rate_limits=(RATE_LIMIT_PER_IP, RATE_LIMIT_GLOBAL), metrics_port=None,
+               target_rate=TARGET_MESSAGE_RATE, shards=PEER_SHARDS, capture=None):
+    """Ponto de entrada de cada processo do tracker no modo --workers.
+    Todos os processos escutam na mesma porta com SO_REUSEPORT. O kernel distribui os
+    datagramas pelo endereço de origem, então cada peer sempre fala com o mesmo processo.
+    Cada processo mantém uma cópia completa de todos os enxames: aplica localmente os anúncios
+    que recebe e replica o resultado para os outros pela fila de cada um.
+    Cada processo tem seu próprio limitador de taxa; como um IP sempre cai no mesmo
+    processo, o limite por IP vale inteiro, e o global já chega dividido entre eles.
+    As métricas também são por processo: o processo N as serve em metrics_port + N.
+    O intervalo de anúncio é calculado por processo, com a taxa alvo dividida entre eles.
+    Com `capture` = (arquivo, limite), o processo N grava o seu trace em arquivo.N.
+    """
+    global replication_hook, peerlist_mtu, tracker_processes
+    logging.getLogger().setLevel(log_level)
+    peerlist_mtu = mtu
+    configure_shards(shards)
+    tracker_processes = len(inboxes)
+    interval_controller.target_rate = target_rate / tracker_processes
+    configure_rate_limit(*rate_limits)
+    if metrics_port:
+        start_metrics(host, metrics_port + index)
+    siblings = [queue for i, queue in enumerate(inboxes) if i != index]
+
+    def broadcast(message):
+        for queue in siblings:
+            queue.put(message)
+
+    replication_hook = broadcast
+    if snapshot_path:
+        # O processo 0 grava o snapshot; ele recebe todas as alterações pela replicação.
+        start_snapshot(snapshot_path, writer=index == 0)
+    if capture:
+        start_capture(f"{capture[0]}.{index}", capture[1])
+    threading.Thread(target=replication_thread, args=(inboxes[index],),
+                     name="Replication", daemon=True).start()
+    logging.info(f"Processo {index} do tracker iniciado (pid {multiprocessing.current_process().pid})")
+    try:
+        if mode == "asyncio":
+            start_async_tracker(host, port, async_workers, reuse_port=True)
+        else:
+            start_tracker(host, port, reuse_port=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_capture()
+        stop_snapshot()
+
+def start_workers(num_workers, host, port, mode, async_workers, log_level=LOG_LEVEL, mtu=PEERLIST_MTU,
+                  snapshot_path=None, rate_limits=(RATE_LIMIT_PER_IP, RATE_LIMIT_GLOBAL), metrics_port=None,
+                  target_rate=TARGET_MESSAGE_RATE, shards=PEER_SHARDS, capture=None):
+    """Inicia N processos do tracker compartilhando a mesma porta UDP."""
+    if not hasattr(socket, "SO_REUSEPORT"):
+        logging.critical("SO_REUSEPORT não é suportado neste sistema. Use --workers 1.")
+        return
+    inboxes = [multiprocessing.Queue() for _ in range(num_workers)]
+    per_ip, global_rate = rate_limits
+    rate_limits = (per_ip, global_rate / num_workers)
+    processes = []
+    for index in range(num_workers):
+        process = multiprocessing.Process(target=run_worker, name=f"TrackerWorker-{index}",
+                                          args=(index, inboxes, host, port, mode, async_workers, log_level, mtu, snapshot_path,
+                                                rate_limits, metrics_port, target_rate, shards, capture),
+                                          daemon=True)
+        process.start()
+        processes.append(process)
+    logging.info(f"Tracker iniciado com {num_workers} processos em {host}:{port}")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        logging.info("Encerrando os processos do tracker.")
+        for process in processes:
+            process.terminate()
+
+def run_cluster_node(index, args):
+    """Ponto de entrada de cada instância do cluster local (--cluster-local)."""
+    logging.getLogger().setLevel(args.log_level)
+    try:
+        serve(args)
+    except KeyboardInterrupt:
+        pass
+
+def start_local_cluster(args):
+    """Inicia `args.cluster_local` instâncias do tracker como processos locais.
+    A instância i escuta na porta UDP args.port + i e faz gossip em
+    args.port + CLUSTER_PORT_OFFSET + i com todas as outras. Ao contrário do --workers,
+    cada instância tem a sua própria porta: os peers escolhem a instância (ver a
+    lista de trackers do peer_v3.py) e qualquer uma responde pelo enxame inteiro.
+    """
+    size = args.cluster_local
+    host = '127.0.0.1' if args.host == '0.0.0.0' else args.host
+    gossip = [(host, args.port + CLUSTER_PORT_OFFSET + i) for i in range(size)]
+    processes = []
+    for index in range(size):
+        node_args = argparse.Namespace(**vars(args))
+        node_args.port = args.port + index
+        node_args.cluster_bind = f"{gossip[index][0]}:{gossip[index][1]}"
+        node_args.cluster_peers = ",".join(f"{host}:{port}" for i, (host, port) in enumerate(gossip) if i != index)
+        node_args.metrics_port = args.metrics_port + index if args.metrics_port else None
+        node_args.snapshot = f"{args.snapshot}.{index}" if args.snapshot else None
+        node_args.capture = f"{args.capture}.{index}" if args.capture else None
+        process = multiprocessing.Process(target=run_cluster_node, name=f"TrackerNode-{index}",
+                                          args=(index, node_args), daemon=True)
+        process.start()
+        processes.append(process)
+    logging.info(f"Cluster local com {size} instâncias nas portas {args.port}-{args.port + size - 1}")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        logging.info("Encerrando as instâncias do cluster.")
+        for process in processes:
+            process.terminate()
+
+def main():
+    parser = argparse.ArgumentParser(description="Tracker UDP (Simulação do BitTorrent).")
+    parser.add_argument("--host", default=TRACKER_HOST, help="Endereço em que o tracker escuta.")
+    parser.add_argument("--port", type=int, default=TRACKER_PORT, help="Porta UDP do tracker.")
+    parser.add_argument("--mode", choices=["thread", "asyncio"], default="thread",
+                        help="thread: loop bloqueante original; asyncio: recepção sem bloqueio com pool de threads.")
+    parser.add_argument("--async-workers", type=int, default=ASYNC_WORKERS,
+                        help="Threads de processamento no modo asyncio.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processos escutando na mesma porta com SO_REUSEPORT (estado replicado entre eles).")
+    parser.add_argument("--log-level", default=logging.getLevelName(LOG_LEVEL),
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], help="Nível de log.")
+    parser.add_argument("--mtu", type=int, default=PEERLIST_MTU,
+                        help="Tamanho máximo de cada datagrama de PEERLIST; listas maiores são paginadas.")
+    parser.add_argument("--snapshot", metavar="ARQUIVO",
+                        help="Grava o estado dos enxames neste arquivo e o restaura ao reiniciar.")
+    parser.add_argument("--rate-limit-ip", type=float, default=RATE_LIMIT_PER_IP,
+                        help="Datagramas por segundo aceitos de cada IP (0 = sem limite).")
+    parser.add_argument("--rate-limit-global", type=float, default=RATE_LIMIT_GLOBAL,
+                        help="Datagramas por segundo aceitos no total (0 = sem limite).")
+    parser.add_argument("--target-rate", type=float, default=TARGET_MESSAGE_RATE,
+                        help="Mensagens por segundo que o intervalo de anúncio adaptativo tenta manter.")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Porta TCP do endpoint HTTP de métricas (/metrics); com --workers, um por processo a partir dela.")
+    parser.add_argument("--shards", type=int, default=PEER_SHARDS,
+                        help="Partições (cada uma com o seu lock) do índice de peers de cada enxame.")
+    parser.add_argument("--cluster-peers", metavar="HOST:PORTA,...",
+                        help="Endereços de gossip das outras instâncias do cluster (liga o modo cluster).")
+    parser.add_argument("--cluster-bind", metavar="HOST:PORTA",
+                        help=f"Endereço de gossip desta instância (padrão: host e porta do tracker + {CLUSTER_PORT_OFFSET}).")
+    parser.add_argument("--cluster-local", type=int, default=0, metavar="N",
+                        help="Inicia um cluster de N instâncias locais, nas portas --port a --port+N-1.")
+    parser.add_argument("--capture", metavar="ARQUIVO",
+                        help="Grava os datagramas recebidos neste trace (com --workers ou --cluster-local, "
+                             "um por processo: ARQUIVO.N). Reproduza com tracker_capture.py.")
+    parser.add_argument("--capture-limit", type=float, default=0, metavar="MB",
+                        help="Encerra a captura quando o trace chegar a este tamanho em MiB (0 = sem limite).")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    args.mtu = max(MIN_PEERLIST_MTU, args.mtu)
+
+    if args.workers > 1 and (args.cluster_peers or args.cluster_local):
+        logging.critical("--workers não pode ser combinado com o modo cluster.")
+        return
+    if args.workers > 1:
+        start_workers(args.workers, args.host, args.port, args.mode, args.async_workers, args.log_level,
+                      args.mtu, args.snapshot, (args.rate_limit_ip, args.rate_limit_global), args.metrics_port,
+                      args.target_rate, args.shards,
+                      (args.capture, int(args.capture_limit * 2**20)) if args.capture else None)
+        return
+    if args.cluster_local > 1:
+        start_local_cluster(args)
+        return
+    serve(args)
+
+def serve(args):
+    """Executa o tracker em um único processo com as opções da linha de comando."""
+    global peerlist_mtu
+    peerlist_mtu = args.mtu
+    configure_shards(args.shards)
+    configure_rate_limit(args.rate_limit_ip, args.rate_limit_global)
+    interval_controller.target_rate = args.target_rate
+    if args.metrics_port:
+        start_metrics(args.host, args.metrics_port)
+    if args.snapshot:
+        start_snapshot(args.snapshot)
+    if args.capture:
+        start_capture(args.capture, int(args.capture_limit * 2**20))
+    if args.cluster_peers:
+        try:
+            members = [tracker_gossip.parse_address(member) for member in args.cluster_peers.split(",")]
+            if args.cluster_bind:
+                bind_addr = tracker_gossip.parse_address(args.cluster_bind)
+            else:
+                bind_addr = (args.host, args.port + CLUSTER_PORT_OFFSET)
+            start_cluster(bind_addr, members)
+        except (ValueError, OSError) as e:
+            logging.critical(f"Não foi possível entrar no cluster: {e}")
+            stop_capture()
+            stop_snapshot()
+            return
+    try:
+        if args.mode == "asyncio":
+            start_async_tracker(args.host, args.port, args.async_workers)
+        else:
+            start_tracker(args.host, args.port)
+    finally:
+        stop_capture()
+        stop_snapshot()
+
+if __name__ == '__main__':
+    main()